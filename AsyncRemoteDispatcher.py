@@ -0,0 +1,256 @@
+import pika
+import os
+import logging
+import time
+import asyncio
+import threading
+from pika.adapters.asyncio_connection import AsyncioConnection
+from ConnectionPool import broker_endpoints, Backoff
+from Serializer import JsonSerializer
+from FileRules import FileRule, RuleTable
+from FlowController import watch_connection
+import Metrics
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+class AsyncRemoteDispatcher:
+    """
+    RabbitMQ dispatcher built on pika's asyncio adapter.
+    Runs its own event loop thread and multiplexes several confirm-mode channels
+    over one connection, so heartbeats keep flowing while publishes are pending.
+    Exposes the same send_task(event, watching_dir) contract as
+    RemoteDispatcher_v2 and is safe to share between publisher workers.
+    """
+    def __init__(self, rabbit_dict, num_channels=4, confirm_timeout=30, connect_timeout=60, serializer=None,
+                 rules=None, flow=None):
+        self.rabbit_dict = rabbit_dict
+        # Routing key and priority per file; anything unmatched goes to the image key as before
+        self.rules = rules or RuleTable.default(self.rabbit_dict)
+        self._fallback = FileRule('fallback', [], self.rabbit_dict['routing_key_img'])
+        self.num_channels = max(1, num_channels)
+        self.confirm_timeout = confirm_timeout
+        self.connect_timeout = connect_timeout
+        self.serializer = serializer or JsonSerializer(self.rabbit_dict['server_id'])
+        # Optional FlowController fed with confirm latencies and blocked notifications
+        self.flow = flow
+        # Every node of the cluster; a failed connect moves on to the next one
+        self.endpoints = broker_endpoints(self.rabbit_dict)
+        self._endpoint = -1
+        self._backoff = Backoff()
+        self.connection = None
+        self.channels = []
+        self._pending = {}  # channel_number -> {delivery_tag: future}
+        self._next_tag = {}  # channel_number -> last delivery tag
+        self._next_channel = 0
+        self._closing = False
+        self._ready = None
+
+        # Start the event loop thread and wait until the loop is running
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="amqp-asyncio", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _start(self):
+        self._ready = asyncio.Event()
+        self._connect()
+
+    # --- Connection lifecycle (runs on the loop thread) ---
+    def _connect(self):
+        self._endpoint = (self._endpoint + 1) % len(self.endpoints)
+        self.connection = AsyncioConnection(
+            self.endpoints[self._endpoint],
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self.loop
+        )
+
+    def _reconnect_later(self):
+        """Next node right away; jittered backoff only after a full round of failures."""
+        if self._closing:
+            return
+        if self._endpoint == len(self.endpoints) - 1:
+            self.loop.call_later(self._backoff.next(), self._connect)
+        else:
+            self.loop.call_soon(self._connect)
+
+    def _on_connection_open(self, connection):
+        self._backoff.reset()
+        if self.flow is not None:
+            watch_connection(connection, self.flow)
+        params = self.endpoints[self._endpoint]
+        logger.info(f"✅ Connected to RabbitMQ node {params.host}:{params.port}")
+        self.channels = []
+        for _ in range(self.num_channels):
+            connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        params = self.endpoints[self._endpoint]
+        logger.error(f"❌ Connection to {params.host}:{params.port} failed: {error}")
+        self._reconnect_later()
+
+    def _on_connection_closed(self, connection, reason):
+        self._ready.clear()
+        self.channels = []
+        self._fail_all_pending()
+        if not self._closing:
+            logger.warning(f"⚠️ Connection lost: {reason}. Reconnecting...")
+            self._reconnect_later()
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(
+            ack_nack_callback=lambda frame: self._on_confirm(channel, frame),
+            callback=lambda frame: self._on_confirm_select(channel)
+        )
+
+    def _on_confirm_select(self, channel):
+        self._pending[channel.channel_number] = {}
+        self._next_tag[channel.channel_number] = 0
+        self.channels.append(channel)
+        if len(self.channels) == self.num_channels:
+            logger.info(f"✅ Connected to RabbitMQ with {self.num_channels} async confirm channels")
+        # Publishing can start as soon as one channel is usable
+        self._ready.set()
+
+    def _on_channel_closed(self, channel, reason):
+        if channel in self.channels:
+            self.channels.remove(channel)
+        if not self.channels:
+            self._ready.clear()
+        self._fail_pending(channel.channel_number)
+        if not self._closing and self.connection and self.connection.is_open:
+            logger.warning(f"⚠️ Channel {channel.channel_number} closed: {reason}. Reopening...")
+            self.connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_confirm(self, channel, frame):
+        """Resolves publish futures from Basic.Ack / Basic.Nack; a multiple flag covers all lower tags."""
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        pending = self._pending.get(channel.channel_number, {})
+        if method.multiple:
+            tags = [tag for tag in pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in pending else []
+        for tag in tags:
+            future = pending.pop(tag)
+            if not future.done():
+                future.set_result(acked)
+
+    def _fail_pending(self, channel_number):
+        for future in self._pending.pop(channel_number, {}).values():
+            if not future.done():
+                future.set_result(False)
+
+    def _fail_all_pending(self):
+        for channel_number in list(self._pending):
+            self._fail_pending(channel_number)
+
+    # --- Publishing ---
+    async def _publish(self, event, watching_dir):
+        payload, rule = self._create_payload(event, watching_dir)
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.error("❌ Not connected, FAILED to send %s", event.path)
+            return False
+
+        if not self.channels:
+            return False
+
+        # Round-robin across the open channels
+        channel = self.channels[self._next_channel % len(self.channels)]
+        self._next_channel += 1
+
+        number = channel.channel_number
+        self._next_tag[number] += 1
+        future = self.loop.create_future()
+        self._pending[number][self._next_tag[number]] = future
+        published_at = time.monotonic()
+        try:
+            channel.basic_publish(
+                exchange=self.rabbit_dict['exchange'],
+                routing_key=rule.routing_key,
+                body=payload,
+                properties=pika.BasicProperties(
+                    delivery_mode=2, # Persistent
+                    content_type=self.serializer.content_type,
+                    priority=rule.priority
+                )
+            )
+        except pika.exceptions.AMQPError as e:
+            self._pending[number].pop(self._next_tag[number], None)
+            logger.warning(f"⚠️ Publish failed: {e}")
+            return False
+
+        try:
+            acked = await asyncio.wait_for(future, self.confirm_timeout)
+        except asyncio.TimeoutError:
+            acked = False
+        latency = time.monotonic() - published_at
+        Metrics.PUBLISH_CONFIRM.observe(latency)
+        if self.flow is not None:
+            self.flow.observe_confirm(latency)
+        if not acked:
+            logger.warning("⚠️ Broker did not confirm: %s", os.path.basename(event.path))
+        return acked
+
+    def send_task(self, event, watching_dir):
+        """Thread-safe. Blocks the caller (not the event loop) until the broker confirms."""
+        future = asyncio.run_coroutine_threadsafe(self._publish(event, watching_dir), self.loop)
+        success = future.result()
+        if success:
+            logger.info("🚀 Sent to MQ: %s", os.path.basename(event.path))
+        return success
+
+    def send_tasks(self, tasks, on_result=None):
+        """
+        Publishes all (event, watching_dir) tasks concurrently across the channels.
+        Calls on_result(event, watching_dir, success) per message and returns
+        the list of (event, watching_dir, success).
+        """
+        tasks = list(tasks)
+        futures = [
+            asyncio.run_coroutine_threadsafe(self._publish(event, watching_dir), self.loop)
+            for event, watching_dir in tasks
+        ]
+        results = []
+        for (event, watching_dir), future in zip(tasks, futures):
+            success = future.result()
+            results.append((event, watching_dir, success))
+            if on_result:
+                on_result(event, watching_dir, success)
+
+        sent = sum(1 for r in results if r[2])
+        logger.info("🚀 Sent batch to MQ: %d/%d confirmed", sent, len(results))
+        return results
+
+    def _route(self, file_path, size):
+        return self.rules.match(file_path, size) or self._fallback
+
+    def _create_payload(self, event, watching_dir):
+        """(encoded message body, rule) for one FileEvent, from the size and mtime it carries."""
+        body = self.serializer.encode(event.path, watching_dir, time.time(), event.size, event.mtime)
+        return body, self._route(event.path, event.size)
+
+    def close(self):
+        """Closes the connection and stops the event loop thread. Safe to call more than once."""
+        if self._closing:
+            return
+        self._closing = True
+
+        def _shutdown():
+            if self.connection and not self.connection.is_closed and not self.connection.is_closing:
+                self.connection.close()
+            # Give the close handshake a moment before stopping the loop
+            self.loop.call_later(0.5, self.loop.stop)
+
+        self.loop.call_soon_threadsafe(_shutdown)
+        self._thread.join(timeout=5)
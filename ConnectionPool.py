@@ -0,0 +1,231 @@
+import time
+import random
+import threading
+import logging
+import pika
+from FlowController import watch_connection
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+
+def broker_endpoints(rabbit_dict, heartbeat=30, connect_timeout=5):
+    """
+    Connection parameters for every node in rabbit_dict['host'], which may be a
+    comma separated list ("mq1,mq2:5673,mq3"); nodes without a port use rabbit_dict['port'].
+    A single attempt with a short socket timeout per node, so a dead node costs
+    at most `connect_timeout` before the next one is tried.
+    """
+    credentials = pika.PlainCredentials(rabbit_dict['user'], rabbit_dict['pass'])
+    endpoints = []
+    for node in str(rabbit_dict['host']).split(','):
+        node = node.strip()
+        if not node:
+            continue
+        host, _, port = node.partition(':')
+        endpoints.append(pika.ConnectionParameters(
+            host=host,
+            port=int(port) if port else int(rabbit_dict['port']),
+            virtual_host=rabbit_dict['vhost'],
+            credentials=credentials,
+            heartbeat=heartbeat,
+            connection_attempts=1,
+            socket_timeout=connect_timeout,
+            blocked_connection_timeout=max(heartbeat, 60)
+        ))
+    return endpoints
+
+
+class Backoff:
+    """Exponential backoff with full jitter, so listeners don't reconnect in lockstep."""
+    def __init__(self, base=0.1, cap=5.0):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt = min(self.attempt + 1, 32)
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class ConnectionPool:
+    """
+    Keeps `size` warm BlockingConnections spread across the broker nodes.
+
+    A blocking connection may only be driven by one thread at a time, so
+    dispatchers lease a connection per send and hand it back afterwards;
+    leases rotate least-recently-used first, which spreads publishes across
+    connections (and so across nodes). A maintenance thread services
+    heartbeats on idle connections and replaces dead ones. Opening a
+    connection walks the node list starting after the last node used, so a
+    node in maintenance is skipped immediately; only when every node fails
+    does it sleep, with jittered exponential backoff.
+
+    `connection_factory` defaults to pika.BlockingConnection; stand-in brokers
+    can be injected for testing. With a FlowController as `flow`, every
+    connection reports the broker's connection.blocked/unblocked to it.
+    """
+    def __init__(self, rabbit_dict, size=2, heartbeat=30, connect_timeout=5, connection_factory=None, flow=None):
+        self.endpoints = broker_endpoints(rabbit_dict, heartbeat=heartbeat, connect_timeout=connect_timeout)
+        if not self.endpoints:
+            raise ValueError("no RabbitMQ host configured")
+        self.size = max(1, size)
+        self.heartbeat = heartbeat
+        self.connection_factory = connection_factory or pika.BlockingConnection
+        self.flow = flow
+        self.idle = []  # _PooledConnection, least recently used first
+        self.total = 0
+        self.cond = threading.Condition()
+        self._next_endpoint = 0
+        self._closed = False
+        self._thread = None
+
+        self.opened = 0
+        self.failovers = 0
+
+    def start(self):
+        """Pre-warms the pool in the background and starts heartbeat maintenance."""
+        self._thread = threading.Thread(target=self._maintain, name="amqp-pool", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        """Opens one connection, trying every node before backing off; None once closed."""
+        backoff = Backoff()
+        while not self._closed:
+            for _ in range(len(self.endpoints)):
+                with self.cond:
+                    index = self._next_endpoint
+                    self._next_endpoint = (index + 1) % len(self.endpoints)
+                params = self.endpoints[index]
+                try:
+                    connection = self.connection_factory(params)
+                    if self.flow is not None:
+                        watch_connection(connection, self.flow)
+                    self.opened += 1
+                    logger.info(f"✅ Connected to RabbitMQ node {params.host}:{params.port}")
+                    return _PooledConnection(connection, index)
+                except pika.exceptions.AMQPError as e:
+                    self.failovers += 1
+                    logger.error(f"❌ Node {params.host}:{params.port} unavailable: {e}")
+            delay = backoff.next()
+            logger.error(f"❌ All {len(self.endpoints)} RabbitMQ nodes unavailable. Retrying in {delay:.2f}s...")
+            time.sleep(delay)
+        return None
+
+    def acquire(self, timeout=None):
+        """Leases a live connection, opening one if the pool is below size. None on timeout/close."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while not self._closed:
+                while self.idle:
+                    pooled = self.idle.pop(0)
+                    if pooled.connection.is_open:
+                        return pooled
+                    self.total -= 1 # Died while idle
+                if self.total < self.size:
+                    self.total += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            else:
+                return None
+
+        pooled = self._open()
+        if pooled is None:
+            with self.cond:
+                self.total -= 1
+                self.cond.notify()
+        return pooled
+
+    def release(self, pooled, broken=False):
+        """Returns a lease; broken connections are closed and replaced on demand."""
+        if pooled is None:
+            return
+        if broken or self._closed or not pooled.connection.is_open:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self.cond:
+            self.idle.append(pooled)
+            self.cond.notify()
+
+    def _discard(self, pooled):
+        try:
+            if pooled.connection.is_open:
+                pooled.connection.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.total -= 1
+            self.cond.notify()
+
+    def _maintain(self):
+        interval = max(1.0, self.heartbeat / 4) if self.heartbeat else 5.0
+        while not self._closed:
+            # Keep the pool warm so a failover never waits for a handshake on the publish path
+            with self.cond:
+                missing = self.size - self.total
+                self.total += max(0, missing)
+            for _ in range(max(0, missing)):
+                pooled = self._open()
+                if pooled is None:
+                    with self.cond:
+                        self.total -= 1
+                    continue
+                self.release(pooled)
+
+            # Service heartbeats on connections nobody is using right now
+            with self.cond:
+                idle, self.idle = self.idle, []
+            for pooled in idle:
+                try:
+                    pooled.connection.process_data_events(time_limit=0)
+                    self.release(pooled)
+                except Exception as e:
+                    logger.warning(f"⚠️ Pooled connection to {self.endpoints[pooled.endpoint].host} lost: {e}")
+                    self._discard(pooled)
+
+            time.sleep(interval)
+
+    def close(self):
+        self._closed = True
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                'pool_connections': self.total,
+                'pool_idle': len(self.idle),
+                'pool_opened': self.opened,
+                'pool_failovers': self.failovers,
+            }
+
+
+class _PooledConnection:
+    """One leased connection plus the channels its last user left open on it."""
+    __slots__ = ('connection', 'endpoint', 'channel', 'batch_channel', 'next_tag', 'on_confirm', 'last_used')
+
+    def __init__(self, connection, endpoint):
+        self.connection = connection
+        self.endpoint = endpoint
+        self.channel = None
+        self.batch_channel = None
+        self.next_tag = 0
+        self.on_confirm = None
+        self.last_used = time.monotonic()
+
+    def dispatch_confirm(self, frame, channel_number):
+        # Confirms go to whichever dispatcher holds the lease, tagged with the
+        # channel they came from (delivery tags restart on every channel)
+        if self.on_confirm is not None:
+            self.on_confirm(frame, channel_number)
@@ -0,0 +1,49 @@
+import time
+import threading
+from collections import OrderedDict
+
+class DedupCache:
+    """
+    Shared set of in-flight / recently dispatched files.
+    A file is identified by path plus (mtime, size), so the same upload seen by
+    both the live observer and the catch-up scan is published once, while a
+    file that is rewritten later is published again.
+    Entries expire after `ttl` seconds and the cache never holds more than `max_entries`.
+    """
+    def __init__(self, ttl=1800, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # path -> (mtime, size, claimed_at), oldest first
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def claim(self, file_path, mtime, size):
+        """Returns True if the caller should dispatch the file, False if it is a duplicate."""
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            seen = self.entries.get(file_path)
+            if seen is not None and seen[0] == mtime and seen[1] == size:
+                self.duplicates += 1
+                return False
+            self.entries[file_path] = (mtime, size, now)
+            self.entries.move_to_end(file_path)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def release(self, file_path):
+        """Forgets a claim (e.g. the publish failed) so the file can be dispatched again."""
+        with self.lock:
+            self.entries.pop(file_path, None)
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        while self.entries:
+            path, (_, _, claimed_at) = next(iter(self.entries.items()))
+            if claimed_at >= cutoff:
+                break
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
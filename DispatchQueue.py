@@ -0,0 +1,316 @@
+import os
+import queue
+import threading
+import time
+import logging
+from collections import deque
+from FileRules import DEFAULT_LANE
+import Metrics
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+LIVE, BACKLOG = 0, 1
+
+
+class _Lane:
+    __slots__ = ('name', 'weight', 'items', 'finish')
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.items = (deque(), deque())  # live, backlog
+        self.finish = 0.0  # virtual time at which the lane's last batch finished
+
+
+class LaneQueue:
+    """
+    One FIFO per lane and class (live / backlog) behind a single lock.
+    Live items are always handed out before any backlog. Within a class,
+    lanes share the publishers by weight (start-time fair queuing): each batch
+    advances its lane's virtual time by size / weight, and the lane with the
+    earliest start goes next, so a flood in one lane cannot starve another.
+    Live and backlog are bounded separately, so a catch-up that fills its
+    share never makes live events drop.
+    """
+    def __init__(self, weights, max_size=10000):
+        self.lanes = {name: _Lane(name, weight) for name, weight in weights.items()}
+        self.max_size = max_size
+        self.sizes = [0, 0]
+        self.clock = 0.0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def put(self, lane, item, live, block=True, timeout=None):
+        """Like queue.Queue.put; unknown lanes go to the default lane."""
+        cls = LIVE if live else BACKLOG
+        with self.not_full:
+            if self.sizes[cls] >= self.max_size:
+                if not block:
+                    raise queue.Full
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while self.sizes[cls] >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Full
+                    self.not_full.wait(remaining)
+            target = self.lanes.get(lane) or self.lanes[DEFAULT_LANE]
+            target.items[cls].append(item)
+            self.sizes[cls] += 1
+            self.not_empty.notify()
+
+    def get_batch(self, max_items, timeout=None):
+        """
+        (lane, live, items): up to max_items from the lane due next.
+        Raises queue.Empty after `timeout`.
+        """
+        with self.not_empty:
+            if not self.not_empty.wait_for(lambda: self.sizes[LIVE] or self.sizes[BACKLOG], timeout):
+                raise queue.Empty
+            cls = LIVE if self.sizes[LIVE] else BACKLOG
+            best, best_start = None, 0.0
+            for lane in self.lanes.values():
+                if lane.items[cls]:
+                    # An idle lane restarts at the current clock instead of banking credit
+                    start = lane.finish if lane.finish > self.clock else self.clock
+                    if best is None or start < best_start:
+                        best, best_start = lane, start
+            items = best.items[cls]
+            batch = [items.popleft() for _ in range(min(max_items, len(items)))]
+            self.sizes[cls] -= len(batch)
+            self.clock = best_start
+            best.finish = best_start + len(batch) / best.weight
+            self.not_full.notify_all()
+            return best.name, cls == LIVE, batch
+
+    def qsize(self):
+        return self.sizes[LIVE] + self.sizes[BACKLOG]
+
+    def depths(self):
+        with self.lock:
+            return {name: len(lane.items[LIVE]) + len(lane.items[BACKLOG]) for name, lane in self.lanes.items()}
+
+
+# --- MODULE 4: THE DISPATCH STAGE ---
+class DispatchQueue:
+    """
+    Bounded in-memory queues between FolderMonitor and RemoteDispatcher.
+    The watchdog thread only enqueues; publisher workers drain the queues,
+    each with its own broker connection (pika connections are not thread-safe).
+    With a RuleTable, files queue in their rule's lane and publishers split
+    between busy lanes by weight; live events always go ahead of catch-up.
+    With a FlowController, catch-up batches wait for its tokens; live ones
+    never do.
+    """
+    def __init__(self, dispatcher_factory, num_workers=2, max_size=10000, enqueue_timeout=0.0, batch_size=1,
+                 dedup=None, rules=None, flow=None):
+        self.dispatcher_factory = dispatcher_factory
+        self.dedup = dedup
+        self.num_workers = max(1, num_workers)
+        self.batch_size = max(1, batch_size)
+        self.enqueue_timeout = enqueue_timeout
+        self.rules = rules
+        self.flow = flow
+        self.queue = LaneQueue(rules.lanes() if rules is not None else {DEFAULT_LANE: 1}, max_size=max_size)
+        self.workers = []
+        self._dispatchers = []
+        self._dispatcher_users = {}  # id(dispatcher) -> workers still using it
+        self._stop_event = threading.Event()
+
+        # Backpressure metrics
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.demoted = 0
+        self.dispatched = 0
+        self.failed = 0
+        self.enqueue_wait_total = 0.0
+        self.enqueue_wait_max = 0.0
+        Metrics.QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    def start(self):
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"publisher-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"📬 Dispatch queue started with {self.num_workers} publisher workers.")
+
+    def submit(self, event, watching_dir, state_manager, block=False):
+        """
+        Enqueues a FileEvent for publishing.
+        Returns False if the file was dropped.
+        Live events use block=False so the observer thread never waits on the broker;
+        the catch-up scan uses block=True so it slows down instead of dropping.
+        That also makes block=True submissions backlog, published after live ones.
+        A live event that finds its class full is demoted to the backlog; it is
+        only dropped if that is full too. Nothing is accepted once stop() began;
+        those files are left to the next run's catch-up scan.
+        """
+        if self._stop_event.is_set():
+            return False
+        start = time.perf_counter()
+        item = (event, watching_dir, state_manager, time.monotonic())
+        lane = self.rules.lane_of(event.path) if self.rules is not None else DEFAULT_LANE
+        try:
+            if block:
+                self.queue.put(lane, item, live=False)
+            else:
+                try:
+                    if self.enqueue_timeout > 0:
+                        self.queue.put(lane, item, live=True, timeout=self.enqueue_timeout)
+                    else:
+                        self.queue.put(lane, item, live=True, block=False)
+                except queue.Full:
+                    # Published late rather than never: a newer file in the folder may move its watermark
+                    self.queue.put(lane, item, live=False, block=False)
+                    with self._stats_lock:
+                        self.demoted += 1
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            Metrics.FILES_DROPPED.inc()
+            logger.warning("⚠️ Dispatch queue full, dropped: %s", os.path.basename(event.path))
+            return False
+
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.enqueued += 1
+            self.enqueue_wait_total += waited
+            if waited > self.enqueue_wait_max:
+                self.enqueue_wait_max = waited
+        return True
+
+    def _worker_loop(self):
+        dispatcher = None
+        try:
+            while True:
+                try:
+                    # Whatever is waiting in the lane due next, up to one pipelined batch
+                    _, live, batch = self.queue.get_batch(self.batch_size, timeout=0.5)
+                except queue.Empty:
+                    # Only exit once the queue is drained
+                    if self._stop_event.is_set():
+                        break
+                    continue
+
+                try:
+                    if self.flow is not None:
+                        self.flow.acquire(len(batch), wait=not live)
+
+                    # Connect lazily so a down broker never blocks startup
+                    if dispatcher is None:
+                        dispatcher = self.dispatcher_factory()
+                        with self._stats_lock:
+                            self._dispatchers.append(dispatcher)
+                            users = self._dispatcher_users.get(id(dispatcher), 0)
+                            self._dispatcher_users[id(dispatcher)] = users + 1
+
+                    if len(batch) > 1 and hasattr(dispatcher, 'send_tasks'):
+                        self._dispatch_batch(dispatcher, batch)
+                    else:
+                        for event, watching_dir, state_manager, detected_at in batch:
+                            success = dispatcher.send_task(event, watching_dir)
+                            self._record_result(event, state_manager, detected_at, success)
+                except Exception as e:
+                    if self.dedup is not None:
+                        for event, _, _, _ in batch:
+                            self.dedup.release(event.path)
+                    with self._stats_lock:
+                        self.failed += len(batch)
+                    Metrics.FILES_FAILED.inc(len(batch))
+                    logger.error(f"Error dispatching {len(batch)} file(s): {e}")
+        finally:
+            self._retire(dispatcher)
+
+    def _retire(self, dispatcher):
+        """
+        Run by each worker on exit. Workers may share one dispatcher (e.g. the
+        asyncio backend), so the last one using it closes it; pika connections
+        are not thread-safe, so nothing else ever closes one under a worker.
+        """
+        if dispatcher is None:
+            return
+        with self._stats_lock:
+            self._dispatcher_users[id(dispatcher)] -= 1
+            if self._dispatcher_users[id(dispatcher)]:
+                return
+        try:
+            dispatcher.close()
+        except Exception:
+            pass
+
+    def _dispatch_batch(self, dispatcher, batch):
+        # Dispatchers report back the same FileEvent objects they were given
+        managers = {id(event): (state_manager, detected_at) for event, _, state_manager, detected_at in batch}
+
+        def on_result(event, watching_dir, success):
+            self._record_result(event, *managers[id(event)], success)
+
+        dispatcher.send_tasks(
+            ((event, watching_dir) for event, watching_dir, _, _ in batch),
+            on_result=on_result
+        )
+
+    def _record_result(self, event, state_manager, detected_at, success):
+        # Only update state if the broker confirmed the message
+        if success:
+            Metrics.FILES_DISPATCHED.inc()
+            Metrics.DETECT_TO_PUBLISH.observe(time.monotonic() - detected_at)
+            # The mtime published, not whatever the file has now
+            state_manager.update_state(event.path, event.mtime, size=event.size)
+            with self._stats_lock:
+                self.dispatched += 1
+        else:
+            # Let the next event or scan try this file again
+            if self.dedup is not None:
+                self.dedup.release(event.path)
+            Metrics.FILES_FAILED.inc()
+            with self._stats_lock:
+                self.failed += 1
+
+    def get_stats(self):
+        lanes = self.queue.depths()
+        with self._stats_lock:
+            avg_wait = self.enqueue_wait_total / self.enqueued if self.enqueued else 0.0
+            stats = {
+                'queue_depth': self.queue.qsize(),
+                'live_depth': self.queue.sizes[LIVE],
+                'backlog_depth': self.queue.sizes[BACKLOG],
+                'duplicates': self.dedup.duplicates if self.dedup is not None else 0,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'demoted': self.demoted,
+                'dispatched': self.dispatched,
+                'failed': self.failed,
+                'enqueue_wait_avg_ms': avg_wait * 1000,
+                'enqueue_wait_max_ms': self.enqueue_wait_max * 1000,
+            }
+        for name, depth in lanes.items():
+            stats[f'lane_{name}_depth'] = depth
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logger.info(
+            f"📊 Queue depth={stats['queue_depth']} (live={stats['live_depth']} backlog={stats['backlog_depth']} "
+            f"{' '.join(f'{k[5:-6]}={v}' for k, v in stats.items() if k.startswith('lane_'))}) enqueued={stats['enqueued']} "
+            f"dispatched={stats['dispatched']} failed={stats['failed']} dropped={stats['dropped']} "
+            f"demoted={stats['demoted']} "
+            f"duplicates={stats['duplicates']} "
+            f"wait_avg={stats['enqueue_wait_avg_ms']:.3f}ms wait_max={stats['enqueue_wait_max_ms']:.3f}ms"
+        )
+
+    def stop(self, timeout=10):
+        """Stops accepting work and waits up to `timeout` seconds for the queue to drain."""
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        remaining = self.queue.qsize()
+        if remaining:
+            logger.warning(f"⚠️ Dispatch queue stopped with {remaining} files not sent.")
+        # Each worker closes its own connection once it exits
+        busy = sum(worker.is_alive() for worker in self.workers)
+        if busy:
+            logger.warning(f"⚠️ {busy} publisher workers still busy after {timeout}s; leaving them to finish.")
@@ -0,0 +1,89 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+class EventCoalescer:
+    """
+    Merges the burst of watchdog events a single file produces (created,
+    modified, moved, duplicate created on rescans) into one "file ready" call.
+    The first ready event for a path opens a `window`-second window; further
+    events for that path inside the window are absorbed. The window is the
+    same for every path, so pending paths expire in FIFO order and one thread
+    waiting on the oldest deadline is enough.
+    """
+    def __init__(self, window=0.2):
+        self.window = window
+        self.pending = OrderedDict()  # path -> (deadline, on_ready), oldest first
+        self.cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+        self.events_in = 0
+        self.events_out = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="coalescer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the timer thread and emits whatever is still pending."""
+        with self.cond:
+            self._stopped = True
+            self.cond.notify()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def submit(self, file_path, on_ready):
+        """A 'file may be ready' event; on_ready(file_path) fires once per window."""
+        with self.cond:
+            self.events_in += 1
+            if file_path in self.pending:
+                return
+            self.pending[file_path] = (time.monotonic() + self.window, on_ready)
+            if len(self.pending) == 1:
+                self.cond.notify()
+
+    def absorb(self, file_path):
+        """An event that never triggers a publish by itself (e.g. modified); only counted."""
+        with self.cond:
+            self.events_in += 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self._stopped:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                file_path, (deadline, on_ready) = next(iter(self.pending.items()))
+                delay = deadline - time.monotonic()
+                if delay > 0 and not self._stopped:
+                    self.cond.wait(delay)
+                    continue
+                self.pending.popitem(last=False)
+                self.events_out += 1
+
+            try:
+                on_ready(file_path)
+            except Exception as e:
+                logger.error("Error handling coalesced event for %s: %s", file_path, e)
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                'events_in': self.events_in,
+                'events_out': self.events_out,
+                'pending': len(self.pending),
+                'amplification': self.events_in / self.events_out if self.events_out else 0.0,
+            }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logger.info(
+            f"📊 Events in={stats['events_in']} out={stats['events_out']} pending={stats['pending']} "
+            f"amplification={stats['amplification']:.2f}x"
+        )
@@ -0,0 +1,33 @@
+import os
+
+
+class FileEvent:
+    """
+    A detected file, stat'ed once where it is found (catch-up scan or
+    handle_file). Size, mtime and inode then travel with it through the
+    dispatch queue, the dispatcher (routing and payload) and the state update,
+    so no later stage stats the file again. Behaves as a path for os.* calls.
+    """
+    __slots__ = ('path', 'size', 'mtime', 'inode')
+
+    def __init__(self, path, size, mtime, inode=0):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+
+    @classmethod
+    def from_stat(cls, path, file_stat):
+        return cls(path, file_stat.st_size, file_stat.st_mtime, file_stat.st_ino)
+
+    @classmethod
+    def stat(cls, path):
+        """Raises OSError if the file is gone."""
+        return cls.from_stat(path, os.stat(path))
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"FileEvent({self.path!r}, size={self.size}, mtime={self.mtime})"
+
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import struct
+import bisect
+import hashlib
+import heapq
+import threading
+from array import array
+
+DAY = 86400
+MAGIC = b'FLDG1\n'
+JOURNAL_RECORD = struct.Struct('<dI')  # checkpoint time, keys that follow
+JOURNAL_ENTRY = struct.Struct('<qQ')   # day, key
+MIN_BLOOM_BITS = 1 << 13
+
+class _Bucket:
+    """
+    One day of published files (bucketed by file mtime).
+    Keys are 64-bit hashes held in a sorted array('Q') (8 bytes per file),
+    plus a small set of recent inserts that is merged in once it grows.
+    A bloom filter in front answers most "not published" lookups without
+    touching either. It is sized from the key count (`bits_per_key`) and
+    doubled as the day fills up, so a quiet day costs a few KiB.
+    """
+    def __init__(self, bits_per_key, bloom_bits=MIN_BLOOM_BITS):
+        self.bits_per_key = bits_per_key
+        self.keys = array('Q')
+        self.recent = set()
+        self._size_bloom(bloom_bits)
+
+    def _size_bloom(self, bloom_bits):
+        # Power of two so positions are a mask instead of a modulo
+        self.bloom_bits = 1 << max(3, (bloom_bits - 1).bit_length())
+        self.bloom_mask = self.bloom_bits - 1
+        self.bloom = bytearray(self.bloom_bits // 8)
+
+    def _grow_bloom(self):
+        # Doubling keeps the rebuilds amortised O(1) per insert
+        self._size_bloom(self.bloom_bits * 2)
+        for keys in (self.keys, self.recent):
+            for key in keys:
+                self._set_bloom(self._bloom_positions(key))
+
+    def _set_bloom(self, positions):
+        bloom = self.bloom
+        for pos in positions:
+            bloom[pos >> 3] |= 1 << (pos & 7)
+
+    def _bloom_positions(self, key):
+        # Double hashing with k=3: derive positions from the two halves of the key
+        mask = self.bloom_mask
+        h1 = key & 0xFFFFFFFF
+        h2 = (key >> 32) | 1
+        return (h1 & mask, (h1 + h2) & mask, (h1 + 2 * h2) & mask)
+
+    def _in_bloom(self, positions):
+        bloom = self.bloom
+        for pos in positions:
+            if not bloom[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def _in_keys(self, key):
+        if key in self.recent:
+            return True
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def add(self, key):
+        positions = self._bloom_positions(key)
+        if self._in_bloom(positions) and self._in_keys(key):
+            return
+        self._set_bloom(positions)
+        self.recent.add(key)
+        if len(self) * self.bits_per_key > self.bloom_bits:
+            self._grow_bloom()
+        # Merge when the set is large relative to the array (amortised O(1) per insert)
+        if len(self.recent) > max(65536, len(self.keys) >> 3):
+            self.merge()
+
+    def merge(self):
+        if self.recent:
+            # recent never overlaps keys (add() checks first), so a plain merge keeps them unique
+            self.keys = array('Q', heapq.merge(self.keys, sorted(self.recent)))
+            self.recent = set()
+
+    def contains(self, key):
+        return self._in_bloom(self._bloom_positions(key)) and self._in_keys(key)
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent)
+
+    def memory_bytes(self):
+        # The recent set is bounded by the merge threshold; count ~64 bytes per entry
+        return self.keys.itemsize * len(self.keys) + len(self.bloom) + 64 * len(self.recent)
+
+
+class FileLedger:
+    """
+    Per-file record of published (relpath, size, mtime) tuples for a sliding
+    window of `window_days` of file mtimes. Lets catch-up find exactly the
+    files that were never confirmed, instead of trusting a per-folder
+    high-water mark. Files older than the window (or than the ledger itself)
+    fall back to the watermark.
+
+    With a `checkpoint_interval`, keys added since the last checkpoint are
+    appended to a journal next to the ledger every interval (the state
+    store's cadence), and the journal is folded into a full save once it
+    passes `compact_bytes`. If the process stopped without close(), files
+    confirmed after the last checkpoint are missing, so mtimes between that
+    checkpoint and the next load are recorded as a gap the ledger does not
+    answer for (the watermark does) until they slide out of the window.
+    """
+    def __init__(self, ledger_file, logger, window_days=7, bloom_bits_per_key=10, checkpoint_interval=0,
+                 compact_bytes=16 << 20):
+        self.ledger_file = ledger_file
+        self.journal_file = os.path.splitext(ledger_file)[0] + '_journal.bin'
+        self.logger = logger
+        self.window_days = window_days
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self.checkpoint_interval = checkpoint_interval
+        self.compact_bytes = compact_bytes
+        self.buckets = {}  # day number -> _Bucket
+        self.start_time = time.time()
+        self.gaps = []     # [start, end) mtime ranges whose confirmations may be missing
+        self.lock = threading.Lock()
+        # Serializes journal appends and full saves between the checkpointer and close()
+        self.io_lock = threading.Lock()
+        self.pending = []  # (day, key) added since the last checkpoint
+        self.journal_bytes = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.load()
+
+    @staticmethod
+    def _key(rel_path, size, mtime):
+        raw = f"{rel_path}\0{size}\0{mtime!r}".encode('utf-8', 'surrogateescape')
+        return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'little')
+
+    def window_start(self):
+        return max(self.start_time, time.time() - self.window_days * DAY)
+
+    def covers(self, mtime):
+        """True if the ledger is authoritative for files with this mtime."""
+        if mtime < self.window_start():
+            return False
+        for gap_start, gap_end in self.gaps:
+            if gap_start <= mtime < gap_end:
+                return False
+        return True
+
+    def add(self, rel_path, size, mtime):
+        if not self.covers(mtime):
+            return
+        key = self._key(rel_path, size, mtime)
+        day = int(mtime // DAY)
+        with self.lock:
+            bucket = self.buckets.get(day)
+            if bucket is None:
+                bucket = self.buckets[day] = _Bucket(self.bloom_bits_per_key)
+            bucket.add(key)
+            if self.checkpoint_interval > 0:
+                self.pending.append((day, key))
+
+    def contains(self, rel_path, size, mtime):
+        bucket = self.buckets.get(int(mtime // DAY))
+        if bucket is None:
+            return False
+        key = self._key(rel_path, size, mtime)
+        with self.lock:
+            return bucket.contains(key)
+
+    def expire(self):
+        """Drops whole days (and gaps) that slid out of the window. O(expired buckets)."""
+        cutoff = time.time() - self.window_days * DAY
+        oldest_day = int(cutoff // DAY)
+        with self.lock:
+            expired = [day for day in self.buckets if day < oldest_day]
+            for day in expired:
+                del self.buckets[day]
+            self.gaps = [gap for gap in self.gaps if gap[1] > cutoff]
+        return len(expired)
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets.values())
+
+    def memory_bytes(self):
+        return sum(b.memory_bytes() for b in self.buckets.values())
+
+    # --- Persistence ---
+    def start(self):
+        if not os.path.exists(self.ledger_file):
+            # Persists start_time, so a journal replayed after a crash knows what it covers
+            self.save()
+        if self.checkpoint_interval > 0:
+            self._thread = threading.Thread(target=self._checkpoint_loop, name="ledger-checkpoint", daemon=True)
+            self._thread.start()
+
+    def _checkpoint_loop(self):
+        while not self._stop_event.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+                if self.journal_bytes >= self.compact_bytes:
+                    self.save()
+            except Exception as e:
+                self.logger.error(f"❌ Failed to checkpoint ledger: {e}")
+
+    def checkpoint(self):
+        """Appends the keys added since the last checkpoint as one record; returns how many."""
+        with self.io_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            # Written even when empty: the record's time is how far the ledger is known complete
+            record = JOURNAL_RECORD.pack(time.time(), len(pending))
+            record += b''.join(JOURNAL_ENTRY.pack(day, key) for day, key in pending)
+            with open(self.journal_file, 'ab') as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_bytes += len(record)
+        return len(pending)
+
+    def save(self, clean=False):
+        """
+        Atomic write: temp file + fsync + rename, then the journal it covers
+        is dropped. `clean` marks the file as complete (only close() does).
+        """
+        self.expire()
+        with self.io_lock:
+            with self.lock:
+                for bucket in self.buckets.values():
+                    bucket.merge()
+                # Everything pending is in the buckets written below
+                self.pending = []
+                days = sorted(self.buckets)
+                header = json.dumps({
+                    'start_time': self.start_time,
+                    'saved_at': time.time(),
+                    'clean': clean,
+                    'gaps': self.gaps,
+                    'buckets': [[day, len(self.buckets[day].keys), self.buckets[day].bloom_bits] for day in days],
+                }).encode()
+
+                tmp_path = self.ledger_file + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(MAGIC)
+                    f.write(struct.pack('<I', len(header)))
+                    f.write(header)
+                    for day in days:
+                        bucket = self.buckets[day]
+                        bucket.keys.tofile(f)
+                        f.write(bucket.bloom)
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.ledger_file)
+            try:
+                os.remove(self.journal_file)
+            except FileNotFoundError:
+                pass
+            self.journal_bytes = 0
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.save(clean=True)
+
+    def load(self):
+        saved_at, clean = None, True
+        if os.path.exists(self.ledger_file):
+            try:
+                with open(self.ledger_file, 'rb') as f:
+                    if f.read(len(MAGIC)) != MAGIC:
+                        raise ValueError("bad magic")
+                    (header_len,) = struct.unpack('<I', f.read(4))
+                    header = json.loads(f.read(header_len))
+                    buckets = {}
+                    for day, count, bloom_bits in header['buckets']:
+                        bucket = _Bucket(self.bloom_bits_per_key, bloom_bits)
+                        bucket.keys.fromfile(f, count)
+                        bucket.bloom = bytearray(f.read(bucket.bloom_bits // 8))
+                        buckets[day] = bucket
+                self.start_time = header['start_time']
+                saved_at = header['saved_at']
+                clean = header['clean']
+                self.gaps = header['gaps']
+                self.buckets = buckets
+            except Exception as e:
+                # A fresh ledger only covers files from now on; older ones use the watermark
+                self.logger.error(f"⚠️ Corrupt ledger file, starting fresh: {e}")
+                self.buckets = {}
+                self.gaps = []
+                saved_at, clean = None, True
+        replayed, checkpointed_at = self._replay()
+        if replayed is not None:
+            saved_at, clean = max(saved_at or 0.0, checkpointed_at), False
+        if saved_at is None:
+            return
+        if not clean and saved_at < time.time():
+            # Stopped without close(): confirmations after the last write are lost
+            self.gaps.append([saved_at, time.time()])
+        self.expire()
+        self.logger.info(f"📒 Ledger loaded. Tracking {len(self)} files"
+                         f"{f' ({replayed} from the journal)' if replayed else ''}.")
+
+    def _replay(self):
+        """Adds the journaled keys; returns (keys replayed, last checkpoint time), or (None, None) without one."""
+        if not os.path.exists(self.journal_file):
+            return None, None
+        with open(self.journal_file, 'rb') as f:
+            data = f.read()
+        offset = replayed = 0
+        checkpointed_at = 0.0
+        while offset + JOURNAL_RECORD.size <= len(data):
+            at, count = JOURNAL_RECORD.unpack_from(data, offset)
+            end = offset + JOURNAL_RECORD.size + count * JOURNAL_ENTRY.size
+            if end > len(data):
+                break # Torn last record
+            for day, key in JOURNAL_ENTRY.iter_unpack(data[offset + JOURNAL_RECORD.size:end]):
+                bucket = self.buckets.get(day)
+                if bucket is None:
+                    bucket = self.buckets[day] = _Bucket(self.bloom_bits_per_key)
+                bucket.add(key)
+            replayed += count
+            checkpointed_at = at
+            offset = end
+        if offset < len(data):
+            # Cut the torn tail so later appends are not read as part of it
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(offset)
+        self.journal_bytes = offset
+        return replayed, checkpointed_at
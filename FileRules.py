@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import logging
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+# Dispatch lane for files no rule takes
+DEFAULT_LANE = 'default'
+
+
+class FileRule:
+    """
+    One entry of the rule table: which files it takes (final extensions,
+    optional regex on the file name, optional size limits in bytes), where
+    they are published (routing key, optional AMQP priority) and the dispatch
+    lane they queue in (defaults to the rule name; the lane weight is its
+    share of the publishers when several lanes have work).
+    """
+    __slots__ = ('name', 'extensions', 'regex', 'min_size', 'max_size', 'routing_key', 'priority', 'lane', 'weight',
+                 'plain')
+
+    def __init__(self, name, extensions, routing_key, regex=None, min_size=None, max_size=None, priority=None,
+                 lane=None, weight=1):
+        self.name = name
+        self.extensions = tuple(ext.lower() if ext.startswith('.') else '.' + ext.lower() for ext in extensions)
+        self.regex = re.compile(regex) if regex else None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.routing_key = routing_key
+        self.priority = priority
+        self.lane = lane or name
+        self.weight = weight
+        # Decided by the extension alone
+        self.plain = self.regex is None and min_size is None and max_size is None
+
+    def accepts(self, path, size):
+        if self.regex is not None and not self.regex.search(path[max(path.rfind('/'), path.rfind('\\')) + 1:]):
+            return False
+        if size is not None:
+            if self.min_size is not None and size < self.min_size:
+                return False
+            if self.max_size is not None and size > self.max_size:
+                return False
+        return True
+
+    def __repr__(self):
+        return f"{self.name}({' '.join(self.extensions) or '*'})->{self.routing_key} lane={self.lane}:{self.weight}"
+
+
+class RuleTable:
+    """
+    Rules compiled into a dict keyed by final extension, so classifying a path
+    is one slice and one dict lookup instead of a pass over glob patterns.
+    Rules are tried in the order given; a rule without extensions applies to
+    every extension. Size limits are only enforced when the caller passes the
+    size (the file has been stat'ed); without it the name decides.
+    """
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.sized = any(rule.min_size is not None or rule.max_size is not None for rule in self.rules)
+        wildcard = tuple(rule for rule in self.rules if not rule.extensions)
+
+        self._candidates = {}  # '.ext' -> rules to try, in table order
+        for ext in {ext for rule in self.rules for ext in rule.extensions}:
+            self._candidates[ext] = tuple(rule for rule in self.rules if ext in rule.extensions or not rule.extensions)
+        self._wildcard = wildcard
+        # Extensions settled by their first rule: the common case is a single lookup
+        self._plain = {ext: rules[0] for ext, rules in self._candidates.items() if rules[0].plain}
+
+    def match(self, path, size=None):
+        """Returns the first rule taking `path` (a full path or a file name), or None."""
+        # Never a key when the last dot is in a directory name or missing
+        ext = path[path.rfind('.'):]
+        rule = self._plain.get(ext)
+        if rule is not None:
+            return rule
+        ext = ext.lower()
+        rule = self._plain.get(ext)
+        if rule is not None:
+            return rule
+        for rule in self._candidates.get(ext, self._wildcard):
+            if rule.accepts(path, size):
+                return rule
+        return None
+
+    def lane_of(self, path):
+        """Dispatch lane for a file name; unmatched files go to DEFAULT_LANE."""
+        rule = self.match(path)
+        return rule.lane if rule is not None else DEFAULT_LANE
+
+    def lanes(self):
+        """{lane: weight} in table order; a lane's weight comes from its first rule."""
+        lanes = {}
+        for rule in self.rules:
+            lanes.setdefault(rule.lane, rule.weight)
+        lanes.setdefault(DEFAULT_LANE, 1)
+        return lanes
+
+    def describe(self):
+        return ', '.join(repr(rule) for rule in self.rules)
+
+    @classmethod
+    def from_extensions(cls, extensions, routing_key=None):
+        """A single rule for a plain extension set (the old VALID_EXTENSIONS)."""
+        return cls([FileRule('default', extensions, routing_key)])
+
+    @classmethod
+    def default(cls, rabbit_dict):
+        """The historical routing (.dav to the video key, images to the image key), one lane each."""
+        return cls([
+            FileRule('video', ['.dav'], rabbit_dict['routing_key_vid']),
+            FileRule('image', ['.jpg', '.jpeg', '.png'], rabbit_dict['routing_key_img']),
+        ])
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Builds the table from a list of dicts:
+            {"name": "video", "ext": [".dav"], "routing_key": "received.video",
+             "regex": "^ch\\d+_", "min_size": 1024, "max_size": null, "priority": 5,
+             "lane": "video", "weight": 3}
+        `ext` may also be a space or comma separated string.
+        """
+        if not isinstance(spec, list):
+            raise ValueError("file rules must be a JSON list")
+        rules = []
+        for index, entry in enumerate(spec):
+            name = entry.get('name', f"rule{index}")
+            extensions = entry.get('ext', [])
+            if isinstance(extensions, str):
+                extensions = extensions.replace(',', ' ').split()
+            if not entry.get('routing_key'):
+                raise ValueError(f"file rule {name!r} has no routing_key")
+            if not isinstance(entry.get('weight', 1), (int, float)) or entry.get('weight', 1) <= 0:
+                raise ValueError(f"file rule {name!r} needs a positive weight")
+            try:
+                rules.append(FileRule(name, extensions, entry['routing_key'], regex=entry.get('regex'),
+                                      min_size=entry.get('min_size'), max_size=entry.get('max_size'),
+                                      priority=entry.get('priority'), lane=entry.get('lane'),
+                                      weight=entry.get('weight', 1)))
+            except re.error as e:
+                raise ValueError(f"file rule {name!r} has an invalid regex: {e}")
+        if not rules:
+            raise ValueError("file rules are empty")
+        return cls(rules)
+
+    @classmethod
+    def from_env(cls, rabbit_dict, variable='FILE_RULES'):
+        """
+        FILE_RULES holds the JSON list (see from_spec) or the path of a JSON
+        file containing it; unset keeps the default table.
+        """
+        value = os.getenv(variable, '').strip()
+        if not value:
+            return cls.default(rabbit_dict)
+        if value.startswith('['):
+            try:
+                spec = json.loads(value)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{variable} is not valid JSON: {e}")
+        else:
+            try:
+                with open(value, 'r') as f:
+                    spec = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                raise ValueError(f"cannot load {variable} from {value}: {e}")
+        return cls.from_spec(spec)
+
+
+def as_rule_table(rules):
+    """Accepts a RuleTable or a plain extension set."""
+    return rules if isinstance(rules, RuleTable) else RuleTable.from_extensions(rules)
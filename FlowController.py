@@ -0,0 +1,213 @@
+import time
+import threading
+import logging
+import pika
+import Metrics
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+
+class FlowController:
+    """
+    Token bucket in front of the publishers, shared by every worker, whose
+    rate is tuned by AIMD (additive increase, multiplicative decrease):
+
+    - Once per `adjust_interval` the rate is multiplied by `decrease` if the
+      broker looked congested during the interval: mean confirm latency over
+      `target_latency`, a connection.blocked notification, or (with a depth
+      probe) a downstream queue deeper than `max_depth`. Otherwise, if the
+      bucket actually held publishers back, the rate grows by `increase`.
+    - While the broker blocks publishing, backlog publishers wait outright;
+      the rate restarts from `min_rate` once it is unblocked. Alarms are
+      cluster-wide, so one connection's notification stands for all; a block
+      is forgotten after `blocked_timeout` in case its connection died.
+    - Live batches take their tokens without waiting (the bucket may go into
+      debt, up to one burst), so they stay fast and it is the catch-up backlog
+      that slows down.
+    """
+    def __init__(self, max_rate=2000.0, min_rate=20.0, initial_rate=None, target_latency=0.25, increase=None,
+                 decrease=0.5, adjust_interval=1.0, burst_seconds=0.5, max_depth=0, depth_probe=None,
+                 probe_interval=5.0, blocked_timeout=60.0):
+        if min_rate <= 0 or max_rate <= 0:
+            # The bucket refills at the rate; it must never reach 0
+            raise ValueError(f"flow rates must be positive (min_rate={min_rate}, max_rate={max_rate})")
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = initial_rate or max(self.min_rate, max_rate / 2)
+        self.target_latency = target_latency
+        self.increase = increase or max_rate / 20
+        self.decrease = decrease
+        self.adjust_interval = adjust_interval
+        self.burst_seconds = burst_seconds
+        # Optional callable returning the deepest downstream queue (see queue_depth_probe)
+        self.max_depth = max_depth
+        self.depth_probe = depth_probe
+        self.probe_interval = probe_interval
+        self.blocked_timeout = blocked_timeout
+
+        self.cond = threading.Condition()
+        self.tokens = self.rate * burst_seconds
+        self.last_refill = time.monotonic()
+        self.blocked = False
+        self.blocked_since = 0.0
+        self.depth = None
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self._limited = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.decreases = 0
+        self.increases = 0
+        self.blocked_events = 0
+        self.wait_total = 0.0
+        Metrics.PUBLISH_RATE_LIMIT.set_function(lambda: self.rate)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._adjust_loop, name="flow-control", daemon=True)
+        self._thread.start()
+        logger.info(f"🚦 Flow control on: {self.rate:.0f}/s (range {self.min_rate:.0f}-{self.max_rate:.0f}/s, "
+                    f"target confirm latency {self.target_latency * 1000:.0f}ms"
+                    f"{f', max queue depth {self.max_depth}' if self.depth_probe else ''})")
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    # --- Publisher side ---
+    def acquire(self, count, wait=True):
+        """
+        Takes `count` tokens; returns the seconds spent waiting. Callers with
+        wait=True block while the bucket is in debt or the broker is blocking.
+        """
+        with self.cond:
+            self._refill()
+            if not wait:
+                # Debt is capped at one burst so a live spike cannot starve the backlog for long
+                self.tokens = max(self.tokens - count, -self.rate * self.burst_seconds)
+                return 0.0
+            start = time.monotonic()
+            while (self.tokens < 0 or self.blocked) and not self._stop_event.is_set():
+                self._limited = True
+                # Until the debt is paid off at the current rate; woken early on unblock or rate changes
+                self.cond.wait(self.adjust_interval if self.blocked else -self.tokens / self.rate + 0.001)
+                self._refill()
+            self.tokens -= count
+            waited = time.monotonic() - start
+            self.wait_total += waited
+        return waited
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate * self.burst_seconds, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    # --- Feedback ---
+    def observe_confirm(self, latency):
+        """Publish-to-confirm time of one message, from the dispatchers."""
+        with self.cond:
+            self._latency_sum += latency
+            self._latency_count += 1
+
+    def on_blocked(self, reason=''):
+        """connection.blocked: the broker hit a memory or disk alarm."""
+        with self.cond:
+            self.blocked = True
+            self.blocked_since = time.monotonic()
+            self.blocked_events += 1
+            self.rate = self.min_rate
+        logger.warning(f"⛔ Broker blocked publishing ({reason or 'resource alarm'}); holding back catch-up")
+
+    def on_unblocked(self):
+        with self.cond:
+            if not self.blocked:
+                return
+            self.blocked = False
+            self.cond.notify_all()
+        logger.info(f"✅ Broker unblocked publishing; resuming at {self.rate:.0f}/s")
+
+    def _adjust_loop(self):
+        next_probe = 0.0
+        while not self._stop_event.wait(self.adjust_interval):
+            if self.depth_probe is not None and time.monotonic() >= next_probe:
+                next_probe = time.monotonic() + self.probe_interval
+                try:
+                    self.depth = self.depth_probe()
+                except Exception as e:
+                    logger.warning(f"⚠️ Queue depth probe failed: {e}")
+            self._adjust()
+
+    def _adjust(self):
+        with self.cond:
+            if self.blocked and time.monotonic() - self.blocked_since > self.blocked_timeout:
+                # pika drops a connection blocked this long; a live alarm blocks the next one again
+                self.blocked = False
+            latency = self._latency_sum / self._latency_count if self._latency_count else None
+            congested = (self.blocked or (latency is not None and latency > self.target_latency)
+                         or (self.max_depth and self.depth is not None and self.depth > self.max_depth))
+            if congested:
+                rate = max(self.min_rate, self.rate * self.decrease)
+                self.decreases += rate < self.rate
+            elif self._limited:
+                # Only grow while the limit is what holds publishers back
+                rate = min(self.max_rate, self.rate + self.increase)
+                self.increases += rate > self.rate
+            else:
+                rate = self.rate
+            if rate != self.rate:
+                logger.debug("🚦 Publish rate %.0f/s -> %.0f/s (latency=%s depth=%s blocked=%s)", self.rate, rate,
+                             f"{latency * 1000:.0f}ms" if latency is not None else '-', self.depth, self.blocked)
+                self._refill()
+                self.rate = rate
+                self.cond.notify_all()
+            self._latency_sum = 0.0
+            self._latency_count = 0
+            self._limited = False
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                'flow_rate': round(self.rate, 1),
+                'flow_blocked': self.blocked,
+                'flow_blocked_events': self.blocked_events,
+                'flow_decreases': self.decreases,
+                'flow_increases': self.increases,
+                'flow_wait_s': round(self.wait_total, 3),
+                'flow_queue_depth': self.depth,
+            }
+
+
+def watch_connection(connection, flow):
+    """Forwards a pika connection's blocked/unblocked notifications to `flow`."""
+    connection.add_on_connection_blocked_callback(
+        lambda conn, frame: flow.on_blocked(getattr(frame.method, 'reason', '')))
+    connection.add_on_connection_unblocked_callback(lambda conn, frame: flow.on_unblocked())
+
+
+def queue_depth_probe(pool, queues):
+    """
+    Depth probe for FlowController: the deepest of `queues` (e.g. the
+    video/image worker queues), read with passive queue_declare on a
+    connection leased from `pool`.
+    """
+    def probe():
+        lease = pool.acquire(timeout=5)
+        if lease is None:
+            return None
+        broken = False
+        try:
+            channel = lease.connection.channel()
+            try:
+                return max(channel.queue_declare(queue=name, passive=True).method.message_count for name in queues)
+            finally:
+                if channel.is_open:
+                    channel.close()
+        except pika.exceptions.AMQPConnectionError:
+            broken = True
+            raise
+        finally:
+            pool.release(lease, broken=broken)
+    return probe
@@ -1,78 +1,206 @@
-from watchdog.events import PatternMatchingEventHandler
+from watchdog.events import FileSystemEventHandler
 import os
+import time
+import threading
+from CatchupScanner import CatchupScanner
+from FileEvent import FileEvent
+from FileRules import as_rule_table
+import Metrics
 
 # --- MODULE 3: THE MONITOR ---
-class FolderMonitor(PatternMatchingEventHandler):
-    def __init__(self, state_manager, dispatcher, valid_ext, logger, watching_dir):
-        super().__init__(
-            patterns=['*.jpeg', '*.dav', '*.jpg', '*.png', '*.dav_'], 
-            ignore_directories=True, 
-            case_sensitive=False
-        )
+class FolderMonitor(FileSystemEventHandler):
+    # Seconds before folders of dropped live events are rescanned (the queue needs room first)
+    DROP_RESCAN_DELAY = 30
+
+    def __init__(self, state_manager, dispatcher, rules, logger, watching_dir, dispatch_queue=None, dedup=None,
+                 settle=None, coalescer=None):
+        super().__init__()
         self.state_manager = state_manager
         self.dispatcher = dispatcher
-        self.valid_ext = valid_ext
+        # RuleTable (or a plain extension set): decides which files are published
+        self.rules = as_rule_table(rules)
         self.logger = logger
         self.watching_dir = watching_dir
+        self.dispatch_queue = dispatch_queue
+        self.dedup = dedup
+        # Optional SettleTracker: hold direct-write files until the upload finished
+        self.settle = settle
+        # Optional EventCoalescer: one publish per burst of events for a path
+        self.coalescer = coalescer
+        self._dropped_dirs = set()
+        self._drop_rescan = None
+        self._drop_lock = threading.Lock()
 
-    def handle_file(self, file_path):
-        """Common logic for handling a detected file"""
+    def dispatch(self, event):
+        """
+        Replaces watchdog's pattern filter: one rule table lookup per event.
+        Moves pass if either side is wanted (.dav_ -> .dav, or a tracked file renamed away).
+        """
+        if event.is_directory:
+            return
+        if event.event_type == 'moved':
+            rule = self.rules.match(event.dest_path)
+            if rule is None and self.rules.match(event.src_path) is None:
+                return
+            self.on_moved(event, rule)
+            return
+        rule = self.rules.match(event.src_path)
+        if rule is None:
+            return
+        if event.event_type == 'created':
+            self.on_created(event, rule)
+        else:
+            getattr(self, f"on_{event.event_type}")(event)
+
+    def handle_file(self, file, block=False):
+        """
+        Common logic for handling a detected file (already matched by name).
+        `file` is a FileEvent from the catch-up scan, or a path, stat'ed here
+        once; everything downstream reuses that stat.
+        """
+        file_path = file.path if isinstance(file, FileEvent) else file
         try:
-            # 1. Check extension (double check to avoid .dav_)
-            _, ext = os.path.splitext(file_path)
-            if ext.lower() not in self.valid_ext:
+            event = file if isinstance(file, FileEvent) else FileEvent.stat(file_path)
+
+            # 1. Size limits are checked here, where the stat is known, rather than per event
+            if self.rules.sized and self.rules.match(file_path, event.size) is None:
+                return
+
+            # 2. Skip files the live observer and catch-up scan both found
+            if self.dedup is not None:
+                if not self.dedup.claim(file_path, event.mtime, event.size):
+                    Metrics.FILES_DUPLICATE.inc()
+                    return
+
+            # 3a. Hand off to the publisher workers (keeps the observer thread free)
+            if self.dispatch_queue is not None:
+                if not self.dispatch_queue.submit(event, self.watching_dir, self.state_manager, block=block):
+                    self._release(file_path)
+                    if not block:
+                        self._rescan_later(os.path.dirname(file_path))
                 return
 
-            # 2. Dispatch to Remote System
-            success = self.dispatcher.send_task(file_path, self.watching_dir)
+            # 3b. Dispatch to Remote System inline
+            success = self.dispatcher.send_task(event, self.watching_dir)
             # print('send to queue')
 
-            # 3. Only update state if dispatch succeeded
+            # 4. Only update state if dispatch succeeded
+            (Metrics.FILES_DISPATCHED if success else Metrics.FILES_FAILED).inc()
             if success:
-                mtime = os.path.getmtime(file_path)
-                self.state_manager.update_state(file_path, mtime)
+                self.state_manager.update_state(file_path, event.mtime, size=event.size)
+            else:
+                self._release(file_path)
 
         except Exception as e:
-            self.logger.error(f"Error handling file {file_path}: {e}")
+            self.logger.error("Error handling file %s: %s", file_path, e)
 
-    def on_moved(self, event):
+    def _release(self, file_path):
+        if self.dedup is not None:
+            self.dedup.release(file_path)
+
+    def on_moved(self, event, rule=None):
         # Triggered when .dav_ becomes .dav
-        if any(event.dest_path.lower().endswith(ext) for ext in self.valid_ext):
-            self.logger.info(f"🔄 File Ready (Renamed): {os.path.basename(event.dest_path)}")
-            self.handle_file(event.dest_path)
+        Metrics.EVENTS_RECEIVED.labels('moved').inc()
+        if self.settle is not None:
+            self.settle.forget(event.src_path)
+        if rule is None:
+            rule = self.rules.match(event.dest_path)
+        if rule is not None:
+            self.logger.info("🔄 File Ready (Renamed): %s", os.path.basename(event.dest_path))
+            self._file_ready(event.dest_path)
 
-    def on_created(self, event):
+    def on_created(self, event, rule=None):
         # Triggered for direct .jpg / .dav creation
-        if any(event.src_path.lower().endswith(ext) for ext in self.valid_ext):
-            self.logger.info(f"📁 File Ready (Created): {os.path.basename(event.src_path)}")
-            self.handle_file(event.src_path)
+        Metrics.EVENTS_RECEIVED.labels('created').inc()
+        if rule is None:
+            rule = self.rules.match(event.src_path)
+        if rule is not None:
+            if self.settle is not None:
+                # May still be mid-upload; dispatched once it settles or is closed
+                self.settle.track(event.src_path, self._on_settled)
+                return
+            self.logger.info("📁 File Ready (Created): %s", os.path.basename(event.src_path))
+            self._file_ready(event.src_path)
+
+    def on_modified(self, event):
+        # Never publishes on its own; counted so the amplification factor is visible
+        Metrics.EVENTS_RECEIVED.labels('modified').inc()
+        if self.coalescer is not None:
+            self.coalescer.absorb(event.src_path)
 
-    def run_catchup_scan(self, src_path):
+    def _file_ready(self, file_path):
+        if self.coalescer is not None:
+            self.coalescer.submit(file_path, self.handle_file)
+        else:
+            self.handle_file(file_path)
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE (Linux): the writer is done with the file
+        Metrics.EVENTS_RECEIVED.labels('closed').inc()
+        if self.settle is not None:
+            self.settle.closed(event.src_path)
+
+    def on_deleted(self, event):
+        Metrics.EVENTS_RECEIVED.labels('deleted').inc()
+        if self.settle is not None:
+            self.settle.forget(event.src_path)
+
+    def _on_settled(self, file_path):
+        self.logger.info("📁 File Ready (Settled): %s", os.path.basename(file_path))
+        self._file_ready(file_path)
+
+    def run_catchup_scan(self, src_path, num_threads=8, paths=None, flat_paths=()):
         """
         Scans for files missed while the script was down.
-        Uses os.walk but checks timestamps against the JSON state.
+        Uses the parallel CatchupScanner and checks timestamps against the JSON state.
+        Missed files are queued as they are found. `paths` limits the scan to
+        those subtrees (e.g. the hot partitions of a HotWindow); `flat_paths`
+        adds the files directly inside other directories (its structural dirs).
         """
         self.logger.info("🕵️  Starting Catch-up Scan...")
+        start = time.monotonic()
+        scanner = CatchupScanner(self.state_manager, self.rules, self._on_missed_file, num_threads=num_threads)
+        scan_paths = paths if paths is not None else [src_path]
+        # scan() returns what each call found, so the subtrees add up
+        count = sum(scanner.scan(path) for path in scan_paths)
+        count += sum(scanner.scan(path, recursive=False) for path in flat_paths)
+        # Live events may now move the watermarks again
+        self.state_manager.release_baseline()
+        Metrics.CATCHUP_DURATION.labels(src_path).observe(time.monotonic() - start)
+        self.logger.info(f"✅ Catch-up complete. Dispatched {count} missed files from {len(scan_paths)} "
+                         f"{'subtree' if len(scan_paths) == 1 else 'subtrees'}.")
+
+    def rescan(self, dir_paths, num_threads=4):
+        """
+        Targeted catch-up for subtrees whose live events were lost (e.g. an
+        inotify queue overflow). Leaves the startup baseline alone.
+        """
+        scanner = CatchupScanner(self.state_manager, self.rules, self._on_missed_file, num_threads=num_threads)
         count = 0
-        
-        for root, dirs, files in os.walk(src_path):
-            # Get the last processed time for THIS specific folder
-            # This handles the complex directory structure perfectly
-            last_known_time = self.state_manager.get_last_timestamp(root)
-            
-            for file in files:
-                ext = os.path.splitext(file)[1].lower()
-                if ext in self.valid_ext:
-                    file_path = os.path.join(root, file)
-                    try:
-                        file_mtime = os.path.getmtime(file_path)
-                        
-                        # If file is newer than what we recorded for this folder
-                        if file_mtime > last_known_time:
-                            self.logger.info(f"🔎 Found missed file: {file}")
-                            self.handle_file(file_path)
-                            count += 1
-                    except OSError:
-                        pass # File might be locked/deleted
-
-        self.logger.info(f"✅ Catch-up complete. Dispatched {count} missed files.")
+        for dir_path in dir_paths:
+            count += scanner.scan(dir_path)
+        self.logger.info(f"✅ Rescan of {len(dir_paths)} directories dispatched {count} missed files.")
+
+    def _rescan_later(self, dir_path):
+        """
+        A dropped live event is not covered by the next catch-up once a newer
+        file moves its folder's watermark, so its folder gets a rescan of its own.
+        """
+        with self._drop_lock:
+            self._dropped_dirs.add(dir_path)
+            if self._drop_rescan is not None:
+                return
+            self._drop_rescan = threading.Timer(self.DROP_RESCAN_DELAY, self._rescan_dropped)
+            self._drop_rescan.daemon = True
+            self._drop_rescan.start()
+
+    def _rescan_dropped(self):
+        with self._drop_lock:
+            dir_paths, self._dropped_dirs = sorted(self._dropped_dirs), set()
+            self._drop_rescan = None
+        self.logger.warning(f"⚠️ Rescanning {len(dir_paths)} directories with dropped live events.")
+        self.rescan(dir_paths)
+
+    def _on_missed_file(self, event):
+        self.logger.info("🔎 Found missed file: %s", os.path.basename(event.path))
+        self.handle_file(event, block=True)
@@ -0,0 +1,200 @@
+import os
+import re
+import threading
+import time
+import logging
+from datetime import date, timedelta
+from watchdog.events import FileSystemEventHandler
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+# Directory names carrying a date: 2025-11-14, 20251114, FWD20251114... Matched against the
+# whole name, so a digit run inside a camera id (CAM1202501150007) is not taken for a date
+DEFAULT_PATTERN = r'\D*(?P<y>(?:19|20)\d{2})[-_]?(?P<m>[01]\d)[-_]?(?P<d>[0-3]\d)\D*'
+
+
+class HotWindow:
+    """
+    Watches and scans only the "hot" part of a date-partitioned root.
+
+    The tree is split into partitions and the structural directories above
+    them (e.g. root/camera). A partition is either
+    - a directory whose whole name matches `pattern` (named groups y, m, d; two
+      digit years mean 20xx), hot while its date is within the last `days` days, or
+    - with `depth` instead, any directory `depth` levels below the root, hot
+      while its mtime is within the last `days` days.
+    Structural directories get a non-recursive watch (files placed directly in
+    them, and new partitions appearing); hot partitions get a recursive watch.
+    A background task promotes new partitions as soon as they are created
+    (and rescans them, since files may land before the watch) and retires
+    partitions that have aged out every `refresh_interval` seconds. Cold
+    history is never descended into, so watches, startup and memory follow
+    the active data rather than the archive.
+    """
+    def __init__(self, root, monitor, observer, pattern=None, depth=None, days=2, refresh_interval=300):
+        if pattern is None and depth is None:
+            pattern = DEFAULT_PATTERN
+        self.root = os.path.abspath(root)
+        self.monitor = monitor
+        self.observer = observer
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.depth = depth
+        self.days = max(1, days)
+        self.refresh_interval = refresh_interval
+
+        self.structural = {}  # dir path -> watch
+        self.hot = {}         # partition path -> watch
+        self.lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._promoter = _PartitionCreated(self._wake)
+
+        self.promoted = 0
+        self.retired = 0
+
+    # --- Layout ---
+    def _partition_date(self, name):
+        match = self.pattern.fullmatch(name)
+        if not match:
+            return None
+        year = int(match.group('y'))
+        try:
+            return date(year + 2000 if year < 100 else year, int(match.group('m')), int(match.group('d')))
+        except ValueError:
+            return None
+
+    def _is_hot(self, path, partition_date):
+        if partition_date is not None:
+            return partition_date >= date.today() - timedelta(days=self.days - 1)
+        try:
+            return os.stat(path).st_mtime >= time.time() - self.days * 86400
+        except OSError:
+            return False
+
+    def layout(self):
+        """Walks the structural directories only; returns (structural dirs, hot partitions)."""
+        structural, hot = [], []
+        stack = [(self.root, 0)]
+        while stack:
+            dir_path, level = stack.pop()
+            structural.append(dir_path)
+            try:
+                with os.scandir(dir_path) as entries:
+                    subdirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+            except OSError:
+                continue
+            for path in subdirs:
+                if self.depth is not None:
+                    if level + 1 < self.depth:
+                        stack.append((path, level + 1))
+                    elif self._is_hot(path, None):
+                        hot.append(path)
+                    continue
+                partition_date = self._partition_date(os.path.basename(path))
+                if partition_date is None:
+                    stack.append((path, level + 1))
+                elif self._is_hot(path, partition_date):
+                    hot.append(path)
+        return structural, hot
+
+    def hot_paths(self):
+        with self.lock:
+            return list(self.hot)
+
+    def structural_paths(self):
+        """Structural directories; catch-up scans their own files, not their subdirectories."""
+        with self.lock:
+            return list(self.structural)
+
+    # --- Watches ---
+    def start(self):
+        """Schedules the initial watches; call before the startup catch-up scan."""
+        start = time.monotonic()
+        self.refresh(rescan_new=False)
+        logger.info(f"🔥 Hot window for {self.root}: {len(self.hot)} hot partitions, "
+                    f"{len(self.structural)} structural dirs ({time.monotonic() - start:.2f}s)")
+        self._thread = threading.Thread(target=self._run, name=f"hot-window-{os.path.basename(self.root)}",
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            woken = self._wake.wait(self.refresh_interval)
+            if self._stop_event.is_set():
+                break
+            if woken:
+                # Let a burst of directory creations settle into one refresh
+                time.sleep(1)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing hot window for {self.root}: {e}")
+
+    def refresh(self, rescan_new=True):
+        """Promotes new hot partitions and retires the ones that have aged out."""
+        structural, hot = self.layout()
+        promoted = []
+        with self.lock:
+            for dir_path in structural:
+                if dir_path not in self.structural:
+                    watch = self.observer.schedule(self.monitor, dir_path, recursive=False)
+                    self.observer.add_handler_for_watch(self._promoter, watch)
+                    self.structural[dir_path] = watch
+            for dir_path in set(self.structural) - set(structural):
+                self._unschedule(self.structural.pop(dir_path))
+
+            for dir_path in hot:
+                if dir_path not in self.hot:
+                    self.hot[dir_path] = self.observer.schedule(self.monitor, dir_path, recursive=True)
+                    promoted.append(dir_path)
+            retired = set(self.hot) - set(hot)
+            for dir_path in retired:
+                self._unschedule(self.hot.pop(dir_path))
+
+        if rescan_new:
+            self.promoted += len(promoted)
+            self.retired += len(retired)
+            if promoted or retired:
+                logger.info(f"🔥 Hot window {self.root}: promoted {len(promoted)}, retired {len(retired)}")
+            if promoted:
+                # Files may have landed before the watch existed
+                self.monitor.rescan(promoted)
+
+    def _unschedule(self, watch):
+        try:
+            self.observer.unschedule(watch)
+        except (KeyError, OSError):
+            pass # Already gone with its directory
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'hot_partitions': len(self.hot),
+                'structural_dirs': len(self.structural),
+                'promoted': self.promoted,
+                'retired': self.retired,
+            }
+
+
+class _PartitionCreated(FileSystemEventHandler):
+    """Wakes the refresh task when a directory appears under a structural directory."""
+    def __init__(self, wake):
+        super().__init__()
+        self.wake = wake
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.wake.set()
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.wake.set()
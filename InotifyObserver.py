@@ -0,0 +1,306 @@
+import os
+import re
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import logging
+from watchdog.events import (
+    FileCreatedEvent, FileClosedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+)
+from HotWindow import DEFAULT_PATTERN
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+DATED = re.compile(DEFAULT_PATTERN)
+
+
+class InotifyObserver:
+    """
+    Linux-only replacement for watchdog's Observer with the same
+    schedule/start/stop/join/is_alive surface.
+
+    - One inotify descriptor for every root, drained with large reads so a
+      burst costs one syscall per `buffer_size` bytes of events.
+    - Watches are added lazily: at startup, old subtrees (dated partitions
+      and leaf directories not modified within `watch_days`; 0 = watch all)
+      are left out. Roots and the structural directories above the
+      partitions are always watched, so a new dated directory in a quiet
+      camera directory is still seen. New directories are watched the moment
+      they appear, and files that landed before the watch was added are
+      emitted as created events.
+    - On IN_Q_OVERFLOW the kernel has dropped events. Watched directories whose
+      mtime moved since the last clean batch are handed to the handler's
+      rescan() (FolderMonitor runs them through the catch-up scanner), so
+      only the affected subtrees are scanned.
+
+    IN_MODIFY is not watched unless `modify_events` is set: FolderMonitor
+    never publishes on it, and it fires once per write.
+    """
+    def __init__(self, buffer_size=1 << 20, watch_days=0, modify_events=False, overflow_slack=5):
+        if not sys.platform.startswith('linux'):
+            raise OSError("the inotify observer is only available on Linux")
+        self.buffer_size = buffer_size
+        self.watch_days = watch_days
+        self.overflow_slack = overflow_slack
+        self.mask = WATCH_MASK | (IN_MODIFY if modify_events else 0)
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.roots = []       # (root path, handler)
+        self.watches = {}     # wd -> directory path
+        self.paths = {}       # directory path -> wd
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_clean = time.time()
+        self._limit_warned = False
+
+        self.events_read = 0
+        self.reads = 0
+        self.overflows = 0
+        self.rescanned_dirs = 0
+
+    # --- Watch management ---
+    def schedule(self, handler, path, recursive=True):
+        path = os.path.abspath(path)
+        self.roots.append((path, handler))
+        return path
+
+    def _handler_for(self, path):
+        best = None
+        for root, handler in self.roots:
+            if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and \
+                    (best is None or len(root) > len(best[0])):
+                best = (root, handler)
+        return best[1] if best else None
+
+    def _add_watch(self, dir_path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.mask | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self._limit_warned:
+                self._limit_warned = True
+                logger.error("❌ inotify watch limit reached (fs.inotify.max_user_watches); "
+                             "unwatched directories are only covered by catch-up scans")
+            return None
+        with self.lock:
+            self.watches[wd] = dir_path
+            self.paths[dir_path] = wd
+        return wd
+
+    def _watch_tree(self, top, cutoff=0, emit=None):
+        """
+        Watches `top` and the directories below it. A directory not modified
+        since `cutoff` is skipped with its subtree if it is a dated partition
+        or has no subdirectories; an old structural directory is still watched.
+        With `emit`, files found are reported as created (they may predate the watch).
+        """
+        stack = [(top, False)]
+        while stack:
+            dir_path, old = stack.pop()
+            if dir_path in self.paths:
+                continue
+            if not old:
+                # Before listing, so nothing created meanwhile is missed
+                self._add_watch(dir_path)
+            subdirs = []
+            try:
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry)
+                            elif emit is not None:
+                                emit(FileCreatedEvent(entry.path))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            if old:
+                if not subdirs:
+                    continue # A quiet leaf; catch-up scans cover it
+                self._add_watch(dir_path)
+            for entry in subdirs:
+                try:
+                    if not cutoff or entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                        stack.append((entry.path, False))
+                    elif not DATED.fullmatch(entry.name):
+                        stack.append((entry.path, True))
+                except OSError:
+                    continue
+
+    # --- Event loop ---
+    def start(self):
+        cutoff = time.time() - self.watch_days * 86400 if self.watch_days > 0 else 0
+        start = time.monotonic()
+        for root, _ in self.roots:
+            self._watch_tree(root, cutoff)
+        logger.info(f"👀 inotify watching {len(self.watches)} directories "
+                    f"(set up in {time.monotonic() - start:.1f}s)")
+        self._thread = threading.Thread(target=self._run, name="inotify", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        while not self._stop_event.is_set():
+            if not poller.poll(500):
+                continue
+            try:
+                data = os.read(self.fd, self.buffer_size)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logger.error(f"❌ inotify read failed: {e}")
+                break
+            self.reads += 1
+            try:
+                self._process(data)
+            except Exception as e:
+                logger.error(f"Error processing inotify events: {e}")
+
+    def _process(self, data):
+        moves = {}  # cookie -> source path, paired within one read
+        overflowed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            self.events_read += 1
+
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                self._forget(wd)
+                continue
+
+            path = os.path.join(dir_path, os.fsdecode(name)) if name else dir_path
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # New (e.g. dated) directory: watch it and report what is already inside
+                    self._watch_tree(path, emit=self._emit)
+                continue
+
+            if mask & IN_MOVED_FROM:
+                moves[cookie] = path
+            elif mask & IN_MOVED_TO:
+                src_path = moves.pop(cookie, None)
+                self._emit(FileMovedEvent(src_path, path) if src_path else FileCreatedEvent(path))
+            elif mask & IN_CREATE:
+                self._emit(FileCreatedEvent(path))
+            elif mask & IN_CLOSE_WRITE:
+                self._emit(FileClosedEvent(path))
+            elif mask & IN_MODIFY:
+                self._emit(FileModifiedEvent(path))
+            elif mask & IN_DELETE:
+                self._emit(FileDeletedEvent(path))
+
+        for src_path in moves.values():
+            # Moved out of the watched tree
+            self._emit(FileDeletedEvent(src_path))
+
+        if overflowed:
+            self._on_overflow()
+        else:
+            self._last_clean = time.time()
+
+    def _emit(self, event):
+        handler = self._handler_for(event.src_path)
+        if handler is not None:
+            handler.dispatch(event)
+
+    def _forget(self, wd):
+        with self.lock:
+            dir_path = self.watches.pop(wd, None)
+            if dir_path is not None and self.paths.get(dir_path) == wd:
+                del self.paths[dir_path]
+
+    def _on_overflow(self):
+        """Rescans the watched directories that changed since the last clean batch."""
+        self.overflows += 1
+        since = self._last_clean - self.overflow_slack
+        self._last_clean = time.time()
+        with self.lock:
+            watched = list(self.paths)
+
+        affected = []
+        for dir_path in watched:
+            try:
+                if os.stat(dir_path).st_mtime >= since:
+                    affected.append(dir_path)
+            except OSError:
+                continue
+        # Subtrees are scanned recursively, so drop directories under another affected one
+        affected.sort()
+        roots = []
+        for dir_path in affected:
+            if not roots or not dir_path.startswith(roots[-1].rstrip(os.sep) + os.sep):
+                roots.append(dir_path)
+        self.rescanned_dirs += len(roots)
+        logger.warning(f"⚠️ inotify queue overflowed; rescanning {len(roots)} of {len(watched)} watched directories")
+
+        by_handler = {}
+        for dir_path in roots:
+            handler = self._handler_for(dir_path)
+            if handler is not None and hasattr(handler, 'rescan'):
+                by_handler.setdefault(id(handler), (handler, []))[1].append(dir_path)
+        for handler, dirs in by_handler.values():
+            # Off the reader thread, which must keep draining the queue
+            threading.Thread(target=handler.rescan, args=(dirs,), name="inotify-rescan", daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def get_stats(self):
+        return {
+            'watches': len(self.watches),
+            'inotify_reads': self.reads,
+            'inotify_events': self.events_read,
+            'overflows': self.overflows,
+            'rescanned_dirs': self.rescanned_dirs,
+        }
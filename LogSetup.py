@@ -0,0 +1,168 @@
+import sys
+import json
+import time
+import queue
+import threading
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, thread, msg (+ exc)."""
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimiter:
+    """
+    Token bucket per message template (the msg before % formatting), so the
+    per-file lines ("Sent to MQ: %s") are capped at `rate` per second each while
+    rare messages always pass. Suppressed lines are counted for summarize().
+    A bucket left idle long enough to refill is no different from a new one,
+    so those are dropped (f-string messages make a template per call).
+    """
+    def __init__(self, rate=20, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.idle_after = self.burst / self.rate
+        self.buckets = {}  # (logger name, template) -> [tokens, last refill, suppressed]
+        self.lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.idle_after
+
+    def allow(self, name, template):
+        now = time.monotonic()
+        with self.lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            bucket = self.buckets.get((name, template))
+            if bucket is None:
+                bucket = self.buckets[(name, template)] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True
+            bucket[2] += 1
+            return False
+
+    def _sweep(self, now):
+        # Buckets with suppressed lines wait for summarize() to report them
+        cutoff = now - self.idle_after
+        idle = [key for key, bucket in self.buckets.items() if bucket[1] <= cutoff and not bucket[2]]
+        for key in idle:
+            del self.buckets[key]
+        self._next_sweep = now + self.idle_after
+
+    def summarize(self):
+        """Returns {(logger name, template): suppressed count} since the last call."""
+        with self.lock:
+            counts = {key: bucket[2] for key, bucket in self.buckets.items() if bucket[2]}
+            for key in counts:
+                self.buckets[key][2] = 0
+        return counts
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Applies the rate limiter to INFO/DEBUG records on the front handler, before
+    they are queued or formatted. Warnings and errors, summaries (extra
+    'summary') and the root logger always pass.
+    """
+    def __init__(self, limiter):
+        super().__init__()
+        self.limiter = limiter
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or record.name == 'root' or getattr(record, 'summary', False):
+            return True
+        return self.limiter.allow(record.name, record.msg)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them first
+    (QueueHandler.prepare would format in the caller), so the % merge, the
+    formatter and the stream write all happen off the event thread.
+    Only safe for an in-process queue, which is all this is used for.
+    """
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks refer to frames that may be gone by the time the listener runs
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogSetup:
+    """
+    Installs the root handlers. 'sync' mode is the classic basicConfig setup;
+    'async' mode routes every record through a QueueHandler to one listener
+    thread. Either mode can emit text or JSON lines and rate-limit INFO lines
+    per template; the root logger itself (logging.info) is not rate limited.
+    """
+    def __init__(self, mode='sync', fmt='text', rate=0, summary_interval=60, stream=None):
+        self.mode = mode
+        self.summary_interval = summary_interval
+        self.listener = None
+        self.limiter = RateLimiter(rate) if rate > 0 else None
+        self._stop_event = threading.Event()
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+        if mode == 'async':
+            # Documented logging optimizations: no caller stack walk or process info per record
+            logging._srcfile = None
+            logging.logProcesses = False
+            logging.logMultiprocessing = False
+            self.queue = queue.SimpleQueue()
+            front = LazyQueueHandler(self.queue)
+            self.listener = QueueListener(self.queue, output, respect_handler_level=True)
+        else:
+            front = output
+        if self.limiter is not None:
+            front.addFilter(RateLimitFilter(self.limiter))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(front)
+        root.setLevel(logging.INFO)
+
+    def start(self):
+        if self.listener is not None:
+            self.listener.start()
+        if self.limiter is not None and self.summary_interval > 0:
+            threading.Thread(target=self._summary_loop, name="log-summary", daemon=True).start()
+        return self
+
+    def _summary_loop(self):
+        while not self._stop_event.wait(self.summary_interval):
+            self.log_summary()
+
+    def log_summary(self):
+        if self.limiter is None:
+            return
+        for (name, template), count in self.limiter.summarize().items():
+            logging.getLogger(name).info("📉 Suppressed %d lines like %r in the last %ds",
+                                         count, template, self.summary_interval, extra={'summary': True})
+
+    def stop(self):
+        """Reports what is still suppressed and drains the queue to the stream."""
+        self._stop_event.set()
+        self.log_summary()
+        if self.listener is not None:
+            self.listener.stop()
@@ -0,0 +1,230 @@
+import bisect
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 1800, 3600, 7200)
+
+
+class _Metric:
+    """One metric family; labelled children are created on first use and cached."""
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.label_names:
+            # Unlabelled metrics call their single child's methods directly
+            child = self.children[()] = self._new_child()
+            for attr in ('inc', 'set', 'set_function', 'observe'):
+                if hasattr(child, attr):
+                    setattr(self, attr, getattr(child, attr))
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._label_text(values)} {child.value}"]
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Evaluated only at scrape time, so the hot path pays nothing."""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return float('nan')
+        return self.value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._label_text(values)} {child.get()}"]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child):
+        with child.lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            lines.append(f"{self.name}_bucket{self._label_text(values, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {total}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- Listener metrics ---
+EVENTS_RECEIVED = REGISTRY.register(Counter(
+    'listener_events_received_total', 'Filesystem events received, by type', ['type']))
+FILES_DISPATCHED = REGISTRY.register(Counter(
+    'listener_files_dispatched_total', 'Files confirmed by the broker'))
+FILES_FAILED = REGISTRY.register(Counter(
+    'listener_files_failed_total', 'Files the broker nacked or that could not be published'))
+FILES_DUPLICATE = REGISTRY.register(Counter(
+    'listener_files_duplicate_total', 'Files skipped because they were already dispatched'))
+FILES_DROPPED = REGISTRY.register(Counter(
+    'listener_files_dropped_total', 'Files dropped because the dispatch queue was full'))
+STATE_UPDATES = REGISTRY.register(Counter(
+    'listener_state_updates_total', 'Watermark updates, by root', ['root']))
+DETECT_TO_PUBLISH = REGISTRY.register(Histogram(
+    'listener_detect_to_publish_seconds', 'From hand-off to the dispatch stage until the broker confirmed'))
+PUBLISH_CONFIRM = REGISTRY.register(Histogram(
+    'listener_publish_confirm_seconds', 'From basic_publish until the broker confirmed'))
+PUBLISH_RATE_LIMIT = REGISTRY.register(Gauge(
+    'listener_publish_rate_limit', 'Current flow control limit in files per second'))
+CATCHUP_DURATION = REGISTRY.register(Histogram(
+    'listener_catchup_duration_seconds', 'Catch-up scan duration, by root', ['root'], buckets=DURATION_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'listener_queue_depth', 'Files waiting to be published'))
+OUTBOX_BYTES = REGISTRY.register(Gauge(
+    'listener_outbox_pending_bytes', 'Bytes of the on-disk outbox not yet published'))
+STATE_KEYS = REGISTRY.register(Gauge(
+    'listener_state_keys', 'Directories tracked in the state, by root', ['root']))
+STATE_BYTES = REGISTRY.register(Gauge(
+    'listener_state_bytes', 'Approximate memory held by the state dicts and keys, by root', ['root']))
+STATE_PRUNED = REGISTRY.register(Counter(
+    'listener_state_pruned_total', 'Directories dropped from the state, by root and reason (age, cap)',
+    ['root', 'reason']))
+
+
+class MetricsServer:
+    """Serves REGISTRY in the Prometheus text format on a local port from a daemon thread."""
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scrapes would otherwise flood the log
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"📈 Metrics on http://{host}:{port}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
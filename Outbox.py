@@ -0,0 +1,376 @@
+import os
+import mmap
+import json
+import time
+import zlib
+import struct
+import threading
+import logging
+from FileEvent import FileEvent
+import Metrics
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<II')  # record length, crc32 of the record body
+
+
+def _encode_record(event, watching_dir):
+    record = [event.path, watching_dir, event.size, event.mtime, event.inode]
+    return json.dumps(record).encode('utf-8', 'surrogateescape')
+
+
+def _decode_record(body):
+    """(FileEvent, watching_dir)"""
+    path, watching_dir, size, mtime, inode = json.loads(body.decode('utf-8', 'surrogateescape'))
+    return FileEvent(path, size, mtime, inode), watching_dir
+
+
+class Outbox:
+    """
+    Disk-backed replacement for DispatchQueue.
+
+    Every detected file is appended to a segmented, memory-mapped log before
+    anything talks to the broker, and the log is fsync'ed in batches every
+    `sync_interval` seconds. A single drainer thread reads the log in order,
+    publishes batches with the dispatcher's pipelined send_tasks, and advances
+    a persisted cursor once a batch is resolved. Fully consumed segments are
+    deleted. Detection therefore never waits on RabbitMQ, and after an outage
+    the backlog drains at batch speed instead of through a rescan.
+
+    Same submit()/start()/stop()/get_stats() contract as DispatchQueue. The log
+    is drained in order, so with a FlowController every batch waits for its
+    tokens; nothing is lost meanwhile, it only stays on disk longer.
+    """
+    def __init__(self, outbox_dir, dispatcher_factory, segment_size=16 * 2**20, batch_size=500,
+                 sync_interval=0.05, dedup=None, flow=None, max_orphans=100000):
+        self.outbox_dir = outbox_dir
+        self.dispatcher_factory = dispatcher_factory
+        self.segment_size = segment_size
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.dedup = dedup
+        self.flow = flow
+        self.cursor_file = os.path.join(outbox_dir, 'cursor')
+        self.managers = {}  # watching_dir -> StateManager
+        self._orphans = {}  # watching_dir -> events confirmed before their root registered
+        self._orphan_count = 0
+        self.max_orphans = max_orphans
+
+        self.lock = threading.Lock()
+        self.data_ready = threading.Condition(self.lock)
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._dispatcher = None
+
+        self.appended = 0
+        self.dispatched = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+
+        os.makedirs(outbox_dir, exist_ok=True)
+        self._recover()
+        Metrics.OUTBOX_BYTES.set_function(self.pending_bytes)
+
+    # --- Segment files ---
+    def _segment_path(self, seq):
+        return os.path.join(self.outbox_dir, f"seg_{seq:010d}.log")
+
+    def _segments(self):
+        return sorted(int(name[4:14]) for name in os.listdir(self.outbox_dir)
+                      if name.startswith('seg_') and name.endswith('.log'))
+
+    def _open_segment(self, seq):
+        path = self._segment_path(seq)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.truncate(self.segment_size) # Preallocated; zero length marks the end
+        f = open(path, 'r+b')
+        return f, mmap.mmap(f.fileno(), self.segment_size)
+
+    def _scan_end(self, mm):
+        """Offset just past the last intact record (recovery after a crash)."""
+        offset = 0
+        while offset + HEADER.size <= len(mm):
+            length, crc = HEADER.unpack_from(mm, offset)
+            end = offset + HEADER.size + length
+            if length == 0 or end > len(mm) or zlib.crc32(mm[offset + HEADER.size:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    def _recover(self):
+        segments = self._segments()
+        self.read_seq, self.read_offset = segments[0] if segments else 0, 0
+        if os.path.exists(self.cursor_file):
+            try:
+                with open(self.cursor_file, 'r') as f:
+                    seq, offset = (int(x) for x in f.read().split())
+                if not segments or seq >= segments[0]:
+                    self.read_seq, self.read_offset = seq, offset
+            except (OSError, ValueError) as e:
+                logger.error(f"⚠️ Corrupt outbox cursor, replaying from the oldest segment: {e}")
+
+        self.write_seq = segments[-1] if segments else self.read_seq
+        self._write_file, self._write_map = self._open_segment(self.write_seq)
+        self.write_offset = self._scan_end(self._write_map)
+        if self.write_seq > self.read_seq or self.write_offset > self.read_offset:
+            logger.info(f"📦 Outbox recovered with {self.pending_bytes()} bytes pending.")
+
+    def pending_bytes(self):
+        return (self.write_seq - self.read_seq) * self.segment_size + self.write_offset - self.read_offset
+
+    # --- Producer side ---
+    def register(self, watching_dir, state_manager):
+        """Lets the drainer update state for entries recovered from a previous run."""
+        with self.lock:
+            self.managers[watching_dir] = state_manager
+            orphans = self._orphans.pop(watching_dir, ())
+            self._orphan_count -= len(orphans)
+        for event in orphans:
+            state_manager.update_state(event.path, event.mtime, size=event.size)
+
+    def submit(self, event, watching_dir, state_manager, block=False):
+        """Appends a FileEvent to the log; never waits on the broker. Returns False only if the disk write failed."""
+        with self.lock:
+            self.managers[watching_dir] = state_manager
+        try:
+            self._append(_encode_record(event, watching_dir))
+        except (OSError, ValueError) as e:
+            self.dropped += 1
+            Metrics.FILES_DROPPED.inc()
+            logger.error("❌ Outbox append failed, dropped %s: %s", os.path.basename(event.path), e)
+            return False
+        return True
+
+    def _append(self, body):
+        record_len = HEADER.size + len(body)
+        if record_len > self.segment_size:
+            raise ValueError("record larger than a segment")
+        with self.lock:
+            if self.write_offset + record_len > self.segment_size:
+                # Seal the full segment and roll over
+                self._write_map.flush()
+                self._write_map.close()
+                self._write_file.close()
+                self.write_seq += 1
+                self._write_file, self._write_map = self._open_segment(self.write_seq)
+                self.write_offset = 0
+            mm = self._write_map
+            mm[self.write_offset + HEADER.size:self.write_offset + record_len] = body
+            HEADER.pack_into(mm, self.write_offset, len(body), zlib.crc32(body))
+            self.write_offset += record_len
+            self.appended += 1
+            self.data_ready.notify()
+
+    def _sync_loop(self):
+        # Batched durability: one msync per interval instead of one per file
+        while not self._stop_event.wait(self.sync_interval):
+            try:
+                with self.lock:
+                    self._write_map.flush()
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Outbox sync failed: {e}")
+
+    # --- Drainer side ---
+    def _read_batch(self):
+        """Reads up to batch_size records from the cursor; returns (records, end position)."""
+        records = []
+        seq, offset = self.read_seq, self.read_offset
+        f = None
+        try:
+            while len(records) < self.batch_size:
+                with self.lock:
+                    limit = self.write_offset if seq == self.write_seq else self.segment_size
+                    past_end = seq > self.write_seq
+                if past_end:
+                    break
+                if offset + HEADER.size > limit:
+                    if seq == self.write_seq:
+                        break
+                    seq, offset = seq + 1, 0 # Sealed segment fully read
+                    if f:
+                        f.close()
+                        f = None
+                    continue
+                if f is None:
+                    f = open(self._segment_path(seq), 'rb')
+                f.seek(offset)
+                length, crc = HEADER.unpack(f.read(HEADER.size))
+                if length == 0:
+                    if seq == self.write_seq:
+                        break
+                    seq, offset = seq + 1, 0 # Unused tail of a sealed segment
+                    f.close()
+                    f = None
+                    continue
+                body = f.read(length)
+                offset += HEADER.size + length
+                if zlib.crc32(body) != crc:
+                    logger.error(f"⚠️ Skipping corrupt outbox record in segment {seq}")
+                    continue
+                records.append(_decode_record(body))
+        finally:
+            if f:
+                f.close()
+        return records, (seq, offset)
+
+    def _commit(self, position):
+        seq, offset = position
+        tmp_path = self.cursor_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f"{seq} {offset}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.cursor_file)
+
+        # Truncate: drop every segment the cursor has moved past
+        for old_seq in range(self.read_seq, seq):
+            try:
+                os.remove(self._segment_path(old_seq))
+            except OSError:
+                pass
+        self.read_seq, self.read_offset = seq, offset
+
+    def _drain_loop(self):
+        try:
+            self._drain()
+        finally:
+            # The drainer owns the dispatcher; pika connections are not thread-safe
+            if self._dispatcher is not None:
+                try:
+                    self._dispatcher.close()
+                except Exception:
+                    pass
+
+    def _drain(self):
+        backoff = 1
+        while True:
+            with self.lock:
+                while (self.read_seq, self.read_offset) == (self.write_seq, self.write_offset):
+                    if self._stop_event.is_set():
+                        return
+                    self.data_ready.wait(0.5)
+
+            records, position = self._read_batch()
+            if not records:
+                # Only empty/corrupt space was read; move past it
+                self._commit(position)
+                continue
+
+            results = self._publish(records)
+            # Dispatchers report back the same objects; one never reported must not be committed past
+            reported = {id(file): ok for file, _, ok in results}
+            for file, watching_dir in records:
+                if id(file) not in reported:
+                    self._record_result(file, watching_dir, False)
+            failed = [(file, wdir) for file, wdir in records if not reported.get(id(file))]
+            if len(failed) == len(records):
+                # Files deleted since they were logged are not worth a message; don't let them hold the head
+                gone = [(file, wdir) for file, wdir in failed if not os.path.exists(file.path)]
+                if gone:
+                    self.dropped += len(gone)
+                    Metrics.FILES_DROPPED.inc(len(gone))
+                    logger.warning(f"⚠️ Dropped {len(gone)} outbox entries whose files are gone")
+                    failed = [(file, wdir) for file, wdir in failed if os.path.exists(file.path)]
+
+            if failed and len(failed) == len(records):
+                # Broker unreachable: keep the cursor and retry the same batch later
+                if self._stop_event.is_set():
+                    return
+                logger.warning(f"⚠️ Outbox batch failed, retrying in {backoff}s...")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            backoff = 1
+            # Individual nacks go to the back of the log instead of blocking the head
+            for file, watching_dir in failed:
+                self._append(_encode_record(file, watching_dir))
+                self.retried += 1
+            self._commit(position)
+
+    def _publish(self, records):
+        """(file, watching_dir, success) for every record reported; the caller fails the rest."""
+        results = []
+
+        def on_result(file, watching_dir, success):
+            results.append((file, watching_dir, success))
+            self._record_result(file, watching_dir, success)
+
+        try:
+            if self.flow is not None:
+                self.flow.acquire(len(records))
+            if self._dispatcher is None:
+                self._dispatcher = self.dispatcher_factory()
+            if hasattr(self._dispatcher, 'send_tasks'):
+                self._dispatcher.send_tasks(records, on_result=on_result)
+            else:
+                for file, watching_dir in records:
+                    on_result(file, watching_dir, self._dispatcher.send_task(file, watching_dir))
+        except Exception as e:
+            logger.error(f"Error dispatching {len(records)} outbox entries: {e}")
+        return results
+
+    def _record_result(self, file, watching_dir, success):
+        # Only update state if the broker confirmed the message
+        if not success:
+            self.failed += 1
+            Metrics.FILES_FAILED.inc()
+            return
+        self.dispatched += 1
+        Metrics.FILES_DISPATCHED.inc()
+        with self.lock:
+            state_manager = self.managers.get(watching_dir)
+            if state_manager is None:
+                # Recovered entry whose root has not been set up yet. Bounded, since a root
+                # dropped from the config never registers; past the cap a later scan re-publishes.
+                if self._orphan_count < self.max_orphans:
+                    self._orphans.setdefault(watching_dir, []).append(file)
+                    self._orphan_count += 1
+                return
+        state_manager.update_state(file.path, file.mtime, size=file.size)
+
+    # --- Lifecycle / metrics ---
+    def start(self):
+        for target, name in ((self._drain_loop, "outbox-drainer"), (self._sync_loop, "outbox-sync")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"📬 Outbox started in {self.outbox_dir}")
+
+    def stop(self, timeout=10):
+        """Waits up to `timeout` seconds for the drainer; whatever is left stays on disk for next time."""
+        self._stop_event.set()
+        with self.lock:
+            self.data_ready.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        with self.lock:
+            self._write_map.flush()
+        if self.pending_bytes():
+            logger.warning(f"⚠️ Outbox stopped with {self.pending_bytes()} bytes pending; they drain on restart.")
+        # The drainer closes its own dispatcher once it exits
+        if any(thread.is_alive() for thread in self._threads):
+            logger.warning(f"⚠️ Outbox drainer still busy after {timeout}s; leaving it to finish.")
+
+    def get_stats(self):
+        return {
+            'queue_depth_bytes': self.pending_bytes(),
+            'enqueued': self.appended,
+            'dispatched': self.dispatched,
+            'failed': self.failed,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'duplicates': self.dedup.duplicates if self.dedup is not None else 0,
+        }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logger.info(
+            f"📊 Outbox pending={stats['queue_depth_bytes']}B appended={stats['enqueued']} "
+            f"dispatched={stats['dispatched']} failed={stats['failed']} retried={stats['retried']} "
+            f"dropped={stats['dropped']} duplicates={stats['duplicates']}"
+        )
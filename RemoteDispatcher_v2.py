@@ -1,110 +1,337 @@
 import pika
-import json
 import os
 import logging
 import time
-from datetime import datetime
+from collections import OrderedDict
+from ConnectionPool import ConnectionPool
+from Serializer import JsonSerializer, BATCH_PARAM, MAX_ENVELOPE
+from FileRules import FileRule, RuleTable
+import Metrics
 
 # Configure Logging
 logger = logging.getLogger(__name__)
 
 class RemoteDispatcher:
-    def __init__(self, rabbit_dict):
+    def __init__(self, rabbit_dict, max_in_flight=500, flush_interval=0.05, confirm_timeout=30, pool=None,
+                 serializer=None, envelope_size=1, rules=None, flow=None):
         self.rabbit_dict = rabbit_dict
-        print("\n ...................................", self.rabbit_dict['user'], self.rabbit_dict['pass'], self.rabbit_dict['host'], self.rabbit_dict['port'],
-            self.rabbit_dict['vhost'])
-        self.credentials = pika.PlainCredentials(self.rabbit_dict['user'], self.rabbit_dict['pass'])
-        self.parameters = pika.ConnectionParameters(
-            host=self.rabbit_dict['host'],
-            port=self.rabbit_dict['port'],
-            virtual_host=self.rabbit_dict['vhost'],
-            credentials=self.credentials
-        )
+        # Routing key and priority per file; anything unmatched goes to the image key as before
+        self.rules = rules or RuleTable.default(self.rabbit_dict)
+        self._fallback = FileRule('fallback', [], self.rabbit_dict['routing_key_img'])
+        # Batch publishing settings (see send_tasks)
+        self.max_in_flight = max_in_flight
+        self.flush_interval = flush_interval
+        self.confirm_timeout = confirm_timeout
+        # Message encoding; envelope_size > 1 packs that many files into one message (send_tasks only)
+        self.serializer = serializer or JsonSerializer(self.rabbit_dict['server_id'])
+        self.envelope_size = max(1, min(envelope_size, MAX_ENVELOPE))
+        # Optional FlowController fed with confirm latencies (it also paces the callers)
+        self.flow = flow
+        logger.info("🐇 Publishing as %s to %s:%s vhost %s", self.rabbit_dict['user'], self.rabbit_dict['host'],
+                    self.rabbit_dict['port'], self.rabbit_dict['vhost'])
+        # Connections come from a pool (shared between workers, or private) that handles failover
+        self._own_pool = pool is None
+        self.pool = pool if pool is not None else ConnectionPool(self.rabbit_dict, size=1, flow=flow)
+        self._lease = None
         self.connection = None
         self.channel = None
-        self._connect()
+        self.batch_channel = None
+        self._pending = OrderedDict()  # delivery_tag -> ([(file_path, watching_dir), ...], published_at)
+        self._confirmed = []
+        self._next_tag = 0
+        self._last_flush = 0.0
+        if self._own_pool:
+            self._checkout()
+            self._checkin()
+            self.pool.start() # Keeps heartbeats going between sends
 
     def _connect(self):
-        """Attempts to connect with a retry loop."""
-        while True:
+        """Drops the current connection as broken and fails over to another one from the pool."""
+        if self._lease is not None:
+            self._checkin(broken=True)
+        self._checkout()
+
+    def _checkout(self):
+        """Leases a connection for the duration of one send, with a confirm-mode channel on it."""
+        while self._lease is None:
+            lease = self.pool.acquire()
+            if lease is None:
+                raise pika.exceptions.AMQPConnectionError("connection pool closed")
+            self._lease = lease
+            self.connection = lease.connection
+            self.channel = lease.channel
+            self.batch_channel = lease.batch_channel
+            self._next_tag = lease.next_tag
+            lease.on_confirm = self._on_batch_confirm
             try:
-                self.connection = pika.BlockingConnection(self.parameters)
-                self.channel = self.connection.channel()
-                
-                # Enable Publisher Confirms (Critical for Data Safety)
-                self.channel.confirm_delivery()
-                
-                # self.channel.exchange_declare(
-                #     exchange=self.rabbit_dict['exchange'], 
-                #     exchange_type='direct', 
-                #     durable=True
-                # )
-                logger.info("✅ Connected to RabbitMQ with Publisher Confirms")
-                return
-            except pika.exceptions.AMQPConnectionError as e:
-                logger.error(f"❌ Connection failed: {e}. Retrying in 5 seconds...")
-                time.sleep(5)
-
-    def send_task(self, file_path, watching_dir):
-        """
-        Sends message with retry logic and confirmation checking.
-        """
-        payload = self._create_payload(file_path, watching_dir)
-        if not payload: return False
+                if self.channel is None or not self.channel.is_open:
+                    self.channel = self.connection.channel()
 
-        message_body = json.dumps(payload)
+                    # Enable Publisher Confirms (Critical for Data Safety)
+                    self.channel.confirm_delivery()
 
-        if file_path.lower().endswith('.dav'):
-            target_routing_key = self.rabbit_dict['routing_key_vid']
-        else:
-            # Assumes everything else allowed (jpg, png) is an image
-            target_routing_key = self.rabbit_dict['routing_key_img']
+                    # self.channel.exchange_declare(
+                    #     exchange=self.rabbit_dict['exchange'],
+                    #     exchange_type='direct',
+                    #     durable=True
+                    # )
+                    logger.info("✅ Connected to RabbitMQ with Publisher Confirms")
+            except pika.exceptions.AMQPError as e:
+                logger.error(f"❌ Channel setup failed: {e}. Trying another connection...")
+                self._checkin(broken=True)
+
+    def _checkin(self, broken=False):
+        """Hands the leased connection (and its open channels) back to the pool."""
+        lease, self._lease = self._lease, None
+        if lease is None:
+            return
+        lease.channel = self.channel
+        lease.batch_channel = self.batch_channel
+        lease.next_tag = self._next_tag
+        lease.on_confirm = None
+        self.connection = self.channel = self.batch_channel = None
+        self.pool.release(lease, broken=broken)
+
+    def send_task(self, event, watching_dir):
+        """
+        Sends message for one FileEvent with retry logic and confirmation checking.
+        """
+        message_body, rule = self._create_payload(event, watching_dir)
         
         # Retry loop for sending
         retries = 3
         for attempt in range(retries):
             try:
+                self._checkout()
                 if self.connection is None or self.connection.is_closed:
                     logger.warning("⚠️ Connection lost. Reconnecting...")
                     self._connect()
 
-                # Publish
+                # Publish (blocks until the broker confirms)
+                published_at = time.monotonic()
                 self.channel.basic_publish(
                     exchange=self.rabbit_dict['exchange'],
-                    routing_key=target_routing_key,
+                    routing_key=rule.routing_key,
                     body=message_body,
                     properties=pika.BasicProperties(
                         delivery_mode=2, # Persistent
-                        content_type='application/json'
+                        content_type=self.serializer.content_type,
+                        priority=rule.priority
                     )
                 )
                 
-                logger.info(f"🚀 Sent to MQ: {os.path.basename(file_path)}")
+                latency = time.monotonic() - published_at
+                Metrics.PUBLISH_CONFIRM.observe(latency)
+                if self.flow is not None:
+                    self.flow.observe_confirm(latency)
+                logger.info("🚀 Sent to MQ: %s", os.path.basename(event.path))
+                self._checkin()
                 return True # Success
 
             except (pika.exceptions.UnroutableError, pika.exceptions.AMQPError) as e:
                 logger.warning(f"⚠️ Publish failed (Attempt {attempt+1}/{retries}): {e}")
-                time.sleep(2) # Wait before retry
-                self._connect() # Force reconnect
+                self._connect() # Fail over; the pool backs off only if every node is down
 
-        logger.error(f"❌ FAILED to send {file_path} after {retries} attempts.")
+        logger.error("❌ FAILED to send %s after %d attempts.", event.path, retries)
+        self._checkin()
         return False
 
-    def _create_payload(self, file_path, watching_dir):
+    def send_tasks(self, tasks, on_result=None):
+        """
+        Publishes many (FileEvent, watching_dir) tasks without waiting for a
+        broker round trip per message. Confirms are collected asynchronously by
+        delivery tag, with at most `max_in_flight` unconfirmed messages.
+        Calls on_result(event, watching_dir, success) as each message is
+        acked/nacked and returns the list of (event, watching_dir, success).
+        """
+        results = []
+
+        def report(file_path, watching_dir, success):
+            results.append((file_path, watching_dir, success))
+            if on_result:
+                on_result(file_path, watching_dir, success)
+
+        for items, body, rule in self._messages(tasks, report):
+            queued = False
+            try:
+                self._ensure_batch_channel(report)
+
+                # Respect the in-flight window before publishing more
+                while len(self._pending) >= self.max_in_flight:
+                    self._process_confirms(report, self.flush_interval)
+
+                self._next_tag += 1
+                self._pending[self._next_tag] = (items, time.monotonic())
+                queued = True
+                if self.envelope_size > 1:
+                    properties = pika.BasicProperties(
+                        delivery_mode=2, # Persistent
+                        content_type=self.serializer.content_type + BATCH_PARAM,
+                        priority=rule.priority,
+                        headers={'x-event-count': len(items)}
+                    )
+                else:
+                    properties = pika.BasicProperties(
+                        delivery_mode=2, # Persistent
+                        content_type=self.serializer.content_type,
+                        priority=rule.priority
+                    )
+                self.batch_channel.basic_publish(
+                    exchange=self.rabbit_dict['exchange'],
+                    routing_key=rule.routing_key,
+                    body=body,
+                    properties=properties
+                )
+
+                # Periodically pull in confirms without blocking
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._process_confirms(report, 0)
+
+            except pika.exceptions.AMQPError as e:
+                logger.warning(f"⚠️ Batch publish failed, {len(self._pending)} in flight: {e}")
+                self._fail_pending(report)
+                if not queued:
+                    # Failed before it was tracked by a delivery tag; _fail_pending cannot see it
+                    for file_path, watching_dir in items:
+                        report(file_path, watching_dir, False)
+                self._connect()
+
+        # Wait for the tail of the batch to be confirmed
+        deadline = time.monotonic() + self.confirm_timeout
         try:
-            file_stat = os.stat(file_path)
-            event_time = datetime.now().astimezone().isoformat()
-            payload = {
-                "FilePath": file_path,
-                "WatchingDir": watching_dir,
-                "EventTime": event_time,
-                "EventSrc": "shell",
-                "ServerId": self.rabbit_dict['server_id']
-                }
-            return payload
-        except OSError:
-            return None
+            while self._pending and time.monotonic() < deadline:
+                self._process_confirms(report, self.flush_interval)
+        except pika.exceptions.AMQPError as e:
+            logger.warning(f"⚠️ Connection lost while waiting for confirms: {e}")
+            self._connect()
+        if self._pending:
+            logger.error(f"❌ {len(self._pending)} messages not confirmed in time.")
+            self._fail_pending(report)
+
+        self._checkin()
+
+        sent = sum(1 for r in results if r[2])
+        logger.info("🚀 Sent batch to MQ: %d/%d confirmed", sent, len(results))
+        return results
+
+    def _messages(self, tasks, report):
+        """
+        Yields (tasks, body, rule) per message to publish. One file per
+        message by default; with an envelope, files sharing a rule are
+        packed together.
+        """
+        if self.envelope_size <= 1:
+            for event, watching_dir in tasks:
+                body, rule = self._create_payload(event, watching_dir)
+                yield [(event, watching_dir)], body, rule
+            return
+
+        groups = {}  # rule -> ([(event, watching_dir), ...], [(path, watching_dir, event_time, size, mtime), ...])
+        for event, watching_dir in tasks:
+            rule = self._route(event.path, event.size)
+            items, events = groups.setdefault(rule, ([], []))
+            # Results are reported with the caller's own objects
+            items.append((event, watching_dir))
+            events.append((event.path, watching_dir, time.time(), event.size, event.mtime))
+            if len(items) >= self.envelope_size:
+                del groups[rule]
+                yield items, self.serializer.encode_batch(events), rule
+        for rule, (items, events) in groups.items():
+            yield items, self.serializer.encode_batch(events), rule
+
+    def _ensure_batch_channel(self, report):
+        """
+        Opens a channel whose confirms arrive as callbacks instead of blocking
+        each publish. Uses the channel implementation underneath the blocking
+        adapter so confirms are dispatched from process_data_events.
+        """
+        self._checkout()
+        if self.connection is None or self.connection.is_closed:
+            logger.warning("⚠️ Connection lost. Reconnecting...")
+            self._connect()
+        if self.batch_channel is not None and self.batch_channel.is_open:
+            return
+
+        # Tags restart on a new channel, so anything unconfirmed is lost
+        self._fail_pending(report)
+        self._next_tag = 0
+        self._last_flush = time.monotonic()
+
+        channel = self.connection.channel()
+        lease = self._lease
+        select_ok = []
+        channel._impl.confirm_delivery(
+            ack_nack_callback=lambda frame, number=channel._impl.channel_number: lease.dispatch_confirm(frame, number),
+            callback=lambda frame: select_ok.append(frame)
+        )
+        deadline = time.monotonic() + self.confirm_timeout
+        while not select_ok:
+            if time.monotonic() >= deadline:
+                raise pika.exceptions.AMQPChannelError(
+                    f"no Confirm.SelectOk within {self.confirm_timeout}s")
+            self.connection.process_data_events(time_limit=self.flush_interval)
+        self.batch_channel = channel._impl
+
+    def _on_batch_confirm(self, frame, channel_number):
+        """Collects Basic.Ack / Basic.Nack frames; a multiple flag covers all lower tags."""
+        if self.batch_channel is None or channel_number != self.batch_channel.channel_number:
+            # A late confirm from a channel given up on; its tags are not ours
+            logger.debug("Ignoring confirm from abandoned channel %s", channel_number)
+            return
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = []
+            for tag in self._pending:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self._pending else []
+        now = time.monotonic()
+        for tag in tags:
+            items, published_at = self._pending.pop(tag)
+            Metrics.PUBLISH_CONFIRM.observe(now - published_at)
+            if self.flow is not None:
+                self.flow.observe_confirm(now - published_at)
+            self._confirmed.append((items, acked))
+
+    def _process_confirms(self, report, time_limit):
+        self.connection.process_data_events(time_limit=time_limit)
+        self._last_flush = time.monotonic()
+        confirmed, self._confirmed = self._confirmed, []
+        for items, acked in confirmed:
+            for file_path, watching_dir in items:
+                if not acked:
+                    logger.warning("⚠️ Broker nacked: %s", os.path.basename(file_path))
+                report(file_path, watching_dir, acked)
+
+    def _fail_pending(self, report):
+        """Reports every unconfirmed message as failed and closes the batch channel."""
+        confirmed, self._confirmed = self._confirmed, []
+        for items, acked in confirmed:
+            for file_path, watching_dir in items:
+                report(file_path, watching_dir, acked)
+        pending, self._pending = self._pending, OrderedDict()
+        for items, _ in pending.values():
+            for file_path, watching_dir in items:
+                report(file_path, watching_dir, False)
+        channel, self.batch_channel = self.batch_channel, None
+        if channel is not None and channel.is_open:
+            try:
+                channel.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+    def _route(self, file_path, size):
+        return self.rules.match(file_path, size) or self._fallback
+
+    def _create_payload(self, event, watching_dir):
+        """(encoded message body, rule) for one FileEvent, from the size and mtime it carries."""
+        body = self.serializer.encode(event.path, watching_dir, time.time(), event.size, event.mtime)
+        return body, self._route(event.path, event.size)
             
     def close(self):
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
\ No newline at end of file
+        self._checkin()
+        if self._own_pool:
+            self.pool.close()
\ No newline at end of file
@@ -0,0 +1,209 @@
+import json
+import struct
+import logging
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError: # optional, only needed for --serializer msgpack
+    msgpack = None
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+# Content types; batch envelopes add "; envelope=batch" so consumers can tell them apart
+JSON_TYPE = 'application/json'
+MSGPACK_TYPE = 'application/msgpack'
+STRUCT_TYPE = 'application/x-file-event'
+BATCH_PARAM = '; envelope=batch'
+
+STRUCT_MAGIC = b'FEV2'
+STRUCT_HEADER = struct.Struct('<4sHH')   # magic, interned strings, events
+STRUCT_STRING = struct.Struct('<H')      # byte length, then utf-8
+STRUCT_EVENT = struct.Struct('<dQdHHHH') # event time, size, mtime, server, source, watching dir, directory; then name
+# String counts and indices are uint16. An event interns at most two strings (watching dir,
+# directory) next to the two shared ones, so this many events per envelope always fit
+MAX_ENVELOPE = (0xFFFF - 2) // 2
+
+
+class JsonSerializer:
+    """
+    The original payload: one JSON object per file, EventTime as a local ISO
+    string. FileSize (bytes) and FileMtime (epoch seconds) come from the stat
+    taken at detection.
+    """
+    content_type = JSON_TYPE
+
+    def __init__(self, server_id, event_src="shell"):
+        self.server_id = server_id
+        self.event_src = event_src
+
+    def encode(self, file_path, watching_dir, event_time, size=None, mtime=None):
+        return json.dumps({
+            "FilePath": file_path,
+            "WatchingDir": watching_dir,
+            "EventTime": datetime.fromtimestamp(event_time).astimezone().isoformat(),
+            "EventSrc": self.event_src,
+            "ServerId": self.server_id,
+            "FileSize": size,
+            "FileMtime": mtime
+        }).encode('utf-8')
+
+    def encode_batch(self, events):
+        """events: (file_path, watching_dir, event_time, size, mtime); the fields shared by all files are hoisted."""
+        return json.dumps({
+            "ServerId": self.server_id,
+            "EventSrc": self.event_src,
+            "Events": [
+                {"FilePath": fp, "WatchingDir": wd,
+                 "EventTime": datetime.fromtimestamp(t).astimezone().isoformat(),
+                 "FileSize": size, "FileMtime": mtime}
+                for fp, wd, t, size, mtime in events
+            ]
+        }).encode('utf-8')
+
+
+class MsgpackSerializer:
+    """Same shape as JSON, msgpack encoded, EventTime as epoch seconds."""
+    content_type = MSGPACK_TYPE
+
+    def __init__(self, server_id, event_src="shell"):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed (pip install msgpack)")
+        self.server_id = server_id
+        self.event_src = event_src
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def encode(self, file_path, watching_dir, event_time, size=None, mtime=None):
+        return self._packer.pack({
+            "FilePath": file_path,
+            "WatchingDir": watching_dir,
+            "EventTime": event_time,
+            "EventSrc": self.event_src,
+            "ServerId": self.server_id,
+            "FileSize": size,
+            "FileMtime": mtime
+        })
+
+    def encode_batch(self, events):
+        return self._packer.pack({
+            "ServerId": self.server_id,
+            "EventSrc": self.event_src,
+            "Events": [list(event) for event in events]
+        })
+
+
+class StructSerializer:
+    """
+    Fixed binary schema. Every message starts with a table of interned strings
+    (server id, source, watching dirs, parent directories), and each event
+    refers to them by index, so a batch of files from one camera folder spells
+    the folder out once. Encoded strings are cached across messages.
+    """
+    content_type = STRUCT_TYPE
+
+    def __init__(self, server_id, event_src="shell", cache_size=4096):
+        self.server_id = server_id
+        self.event_src = event_src
+        self.cache_size = cache_size
+        self._encoded = {}  # str -> length-prefixed utf-8
+
+    def _intern(self, text):
+        encoded = self._encoded.get(text)
+        if encoded is None:
+            raw = text.encode('utf-8', 'surrogateescape')
+            encoded = STRUCT_STRING.pack(len(raw)) + raw
+            if len(self._encoded) >= self.cache_size:
+                self._encoded.clear()
+            self._encoded[text] = encoded
+        return encoded
+
+    def encode(self, file_path, watching_dir, event_time, size=None, mtime=None):
+        return self.encode_batch(((file_path, watching_dir, event_time, size, mtime),))
+
+    def encode_batch(self, events):
+        table = {}  # str -> index
+        strings = []
+        body = []
+
+        def index(text):
+            i = table.get(text)
+            if i is None:
+                if len(strings) == 0xFFFF:
+                    raise ValueError(f"too many distinct strings for one envelope (max {MAX_ENVELOPE} events)")
+                i = table[text] = len(strings)
+                strings.append(self._intern(text))
+            return i
+
+        server = index(self.server_id)
+        source = index(self.event_src)
+        for file_path, watching_dir, event_time, size, mtime in events:
+            # Split on either separator so Windows paths decode exactly on any consumer
+            cut = max(file_path.rfind('\\'), file_path.rfind('/')) + 1
+            directory, name = file_path[:cut], file_path[cut:]
+            # Unknown size / mtime go out as 0
+            body.append(STRUCT_EVENT.pack(event_time, size or 0, mtime or 0.0, server, source,
+                                          index(watching_dir), index(directory)))
+            raw = name.encode('utf-8', 'surrogateescape') # Unique per file, not worth caching
+            body.append(STRUCT_STRING.pack(len(raw)))
+            body.append(raw)
+        return b''.join([STRUCT_HEADER.pack(STRUCT_MAGIC, len(strings), len(events))] + strings + body)
+
+
+SERIALIZERS = {
+    'json': JsonSerializer,
+    'msgpack': MsgpackSerializer,
+    'struct': StructSerializer,
+}
+
+
+def create_serializer(name, server_id, event_src="shell"):
+    return SERIALIZERS[name](server_id, event_src)
+
+
+def decode(body, content_type):
+    """
+    Consumer side: returns a list of event dicts in the JSON payload shape for
+    any format, single or batch (EventTime stays epoch seconds for binary formats).
+    """
+    base = content_type.split(';')[0].strip()
+    if base == JSON_TYPE or base == MSGPACK_TYPE:
+        message = json.loads(body) if base == JSON_TYPE else msgpack.unpackb(body, raw=False)
+        if "Events" not in message:
+            return [message]
+        shared = {"EventSrc": message["EventSrc"], "ServerId": message["ServerId"]}
+        if base == JSON_TYPE:
+            return [dict(event, **shared) for event in message["Events"]]
+        return [dict({"FilePath": fp, "WatchingDir": wd, "EventTime": t, "FileSize": size, "FileMtime": mtime},
+                     **shared)
+                for fp, wd, t, size, mtime in message["Events"]]
+
+    if base == STRUCT_TYPE:
+        magic, num_strings, num_events = STRUCT_HEADER.unpack_from(body, 0)
+        if magic != STRUCT_MAGIC:
+            raise ValueError("not a file event message")
+        offset = STRUCT_HEADER.size
+
+        def read_string():
+            nonlocal offset
+            (length,) = STRUCT_STRING.unpack_from(body, offset)
+            offset += STRUCT_STRING.size + length
+            return bytes(body[offset - length:offset]).decode('utf-8', 'surrogateescape')
+
+        strings = [read_string() for _ in range(num_strings)]
+        events = []
+        for _ in range(num_events):
+            event_time, size, mtime, server, source, watching_dir, directory = STRUCT_EVENT.unpack_from(body, offset)
+            offset += STRUCT_EVENT.size
+            events.append({
+                "FilePath": strings[directory] + read_string(),
+                "WatchingDir": strings[watching_dir],
+                "EventTime": event_time,
+                "EventSrc": strings[source],
+                "ServerId": strings[server],
+                "FileSize": size,
+                "FileMtime": mtime
+            })
+        return events
+
+    raise ValueError(f"unknown content type {content_type}")
@@ -0,0 +1,142 @@
+import os
+import math
+import time
+import threading
+import logging
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+class SettleTracker:
+    """
+    Holds back files that may still be uploading until they have settled:
+    size and mtime unchanged for `quiet_period` seconds, or the writer closed
+    the file (IN_CLOSE_WRITE via watchdog's on_closed, Linux only).
+
+    All candidates share one timer wheel driven by a single thread: each slot
+    is `tick` seconds wide and a file is re-checked once per quiet period, so
+    thousands of concurrent uploads cost one thread and one stat per file per period.
+    """
+    def __init__(self, quiet_period=2.0, tick=0.25):
+        self.quiet_period = quiet_period
+        self.tick = tick
+        self.delay_ticks = max(1, int(math.ceil(quiet_period / tick)))
+        self.slots = [set() for _ in range(self.delay_ticks + 1)]
+        self.current = 0
+        self.entries = {}  # path -> _Candidate
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.settled = 0
+        self.closed_early = 0
+        self.abandoned = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="settle-wheel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def track(self, file_path, on_ready):
+        """Starts watching a candidate; on_ready(file_path) fires once it has settled."""
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return
+        with self.lock:
+            if file_path in self.entries:
+                return # Already scheduled; the wheel re-checks it anyway
+            candidate = _Candidate(file_stat.st_size, file_stat.st_mtime, on_ready)
+            self._schedule(file_path, candidate)
+            self.entries[file_path] = candidate
+
+    def closed(self, file_path):
+        """The writer closed the file: dispatch now instead of waiting out the quiet period."""
+        with self.lock:
+            candidate = self.entries.pop(file_path, None)
+        if candidate is not None:
+            self.closed_early += 1
+            self._fire(file_path, candidate)
+
+    def forget(self, file_path):
+        """Stops tracking a path (e.g. it was renamed or deleted)."""
+        with self.lock:
+            self.entries.pop(file_path, None)
+
+    def _schedule(self, file_path, candidate):
+        slot = (self.current + self.delay_ticks) % len(self.slots)
+        candidate.slot = slot
+        self.slots[slot].add(file_path)
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while not self._stop_event.is_set():
+            delay = next_tick - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+            next_tick += self.tick
+            try:
+                self._advance()
+            except Exception as e:
+                logger.error(f"Error in settle wheel: {e}")
+
+    def _advance(self):
+        with self.lock:
+            self.current = (self.current + 1) % len(self.slots)
+            due = self.slots[self.current]
+            self.slots[self.current] = set()
+            # Entries re-scheduled into a later slot leave stale names behind; skip them
+            candidates = [(p, self.entries[p]) for p in due
+                          if p in self.entries and self.entries[p].slot == self.current]
+
+        # Stat outside the lock so the observer thread never waits on the disk
+        observed = []
+        for file_path, candidate in candidates:
+            try:
+                file_stat = os.stat(file_path)
+                observed.append((file_path, candidate, file_stat.st_size, file_stat.st_mtime))
+            except OSError:
+                observed.append((file_path, candidate, None, None))
+
+        ready = []
+        with self.lock:
+            for file_path, candidate, size, mtime in observed:
+                if self.entries.get(file_path) is not candidate:
+                    continue # Closed or forgotten meanwhile
+                if size is None:
+                    del self.entries[file_path]
+                    self.abandoned += 1
+                elif size == candidate.size and mtime == candidate.mtime:
+                    del self.entries[file_path]
+                    ready.append((file_path, candidate))
+                else:
+                    # Still being written: wait another quiet period
+                    candidate.size, candidate.mtime = size, mtime
+                    self._schedule(file_path, candidate)
+
+        for file_path, candidate in ready:
+            self.settled += 1
+            self._fire(file_path, candidate)
+
+    def _fire(self, file_path, candidate):
+        try:
+            candidate.on_ready(file_path)
+        except Exception as e:
+            logger.error("Error dispatching settled file %s: %s", file_path, e)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class _Candidate:
+    __slots__ = ('size', 'mtime', 'on_ready', 'slot')
+
+    def __init__(self, size, mtime, on_ready):
+        self.size = size
+        self.mtime = mtime
+        self.on_ready = on_ready
+        self.slot = None
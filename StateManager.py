@@ -1,48 +1,218 @@
 import os
-import json
+import sys
+import heapq
+import threading
 from datetime import datetime, timedelta
+from StateStore import JsonStateStore
+import Metrics
+
+DAY = 86400
+
+
+class _AgeIndex:
+    """
+    Keys bucketed by the day of their value, oldest day on a heap, so expiry
+    touches only the expired keys and the oldest key is found without a scan.
+    The owner passes the previous value on every change, so each key sits in
+    exactly one bucket.
+    """
+    __slots__ = ('buckets', 'days')
+
+    def __init__(self):
+        self.buckets = {}  # day number -> set of keys
+        self.days = []     # heap of day numbers with a bucket
+
+    def add(self, key, value, old_value=None):
+        day = int(value // DAY)
+        if old_value is not None:
+            old_day = int(old_value // DAY)
+            if old_day == day:
+                return
+            self.buckets[old_day].discard(key)
+        bucket = self.buckets.get(day)
+        if bucket is None:
+            bucket = self.buckets[day] = set()
+            heapq.heappush(self.days, day)
+        bucket.add(key)
+
+    def remove(self, key, value):
+        bucket = self.buckets.get(int(value // DAY))
+        if bucket is not None:
+            bucket.discard(key)
+
+    def pop_before(self, cutoff):
+        """Removes and returns every key whose whole day lies before `cutoff`."""
+        expired = []
+        cutoff_day = int(cutoff // DAY)
+        while self.days and self.days[0] < cutoff_day:
+            expired.extend(self.buckets.pop(heapq.heappop(self.days)))
+        return expired
+
+    def pop_oldest(self):
+        """Removes and returns a key of the oldest day, or None."""
+        while self.days:
+            bucket = self.buckets[self.days[0]]
+            if bucket:
+                return bucket.pop()
+            del self.buckets[heapq.heappop(self.days)]
+        return None
+
 
 class StateManager:
     """
     Manages persistence of the last processed timestamp per folder.
-    Uses relative paths to save memory.
+    Uses relative paths to save memory; keys are interned so the state, the
+    dir marks, the age index and catch-up baselines share one string each.
+    Storage is delegated to a backend from StateStore (JSON by default).
+    With `max_keys`, the folders with the oldest watermarks are evicted once
+    the state tracks more than that many.
     """
-    def __init__(self, state_file, root_dir, logger):
+    def __init__(self, state_file, root_dir, logger, store=None, ledger=None, max_keys=0):
         self.state_file = state_file
         self.root_dir = root_dir
+        self.store = store or JsonStateStore(state_file, logger)
+        # Optional per-file FileLedger on top of the per-folder watermark
+        self.ledger = ledger
+        self.max_keys = max_keys
         self.state = {}
+        # Directory mtime seen by the last catch-up scan that found nothing new
+        self.dir_marks = {}
+        self._state_index = _AgeIndex()
+        self._mark_index = _AgeIndex()
+        self._key_bytes = 0
+        self.evicted = 0
+        # Watermarks frozen for a catch-up scan running alongside live events
+        self.baseline = None
         self.logger = logger
+        self.lock = threading.Lock()
+        self._updates = Metrics.STATE_UPDATES.labels(root_dir)
+        self._expired = Metrics.STATE_PRUNED.labels(root_dir, 'age')
+        self._evicted = Metrics.STATE_PRUNED.labels(root_dir, 'cap')
         self.load_state()
+        # Lets the store checkpoint in the background (see JsonStateStore); the ledger keeps the same cadence
+        self.store.start(self.snapshot)
+        if self.ledger is not None:
+            self.ledger.start()
+        Metrics.STATE_KEYS.labels(root_dir).set_function(lambda: len(self.state))
+        Metrics.STATE_BYTES.labels(root_dir).set_function(self.memory_estimate)
 
     def load_state(self):
-        if os.path.exists(self.state_file):
-            try:
-                with open(self.state_file, 'r') as f:
-                    self.state = json.load(f)
-                self.logger.info(f"📖 State loaded. Tracking {len(self.state)} directories.")
-            except Exception as e:
-                self.logger.error(f"⚠️ Corrupt state file, starting fresh: {e}")
+        state, dir_marks = self.store.load()
+        self.state = {sys.intern(k): v for k, v in state.items()}
+        self.dir_marks = {sys.intern(k): v for k, v in dir_marks.items()}
+        self._state_index = _AgeIndex()
+        self._mark_index = _AgeIndex()
+        for rel_path, ts in self.state.items():
+            self._state_index.add(rel_path, ts)
+        for rel_path, dir_mtime in self.dir_marks.items():
+            self._mark_index.add(rel_path, dir_mtime)
+        self._key_bytes = sum(sys.getsizeof(k) for k in self.state)
+        if self.max_keys and len(self.state) > self.max_keys:
+            with self.lock:
+                evicted = self._evict()
+            self.store.delete(evicted, [])
 
     def get_last_timestamp(self, file_dir):
         """Returns the last timestamp for a specific directory (relative path)."""
         rel_path = os.path.relpath(file_dir, self.root_dir)
         return self.state.get(rel_path, 0.0)
 
-    def update_state(self, file_path, timestamp):
+    def freeze_baseline(self):
+        """
+        Snapshots the watermarks for a concurrent catch-up scan. Otherwise a live
+        event could raise a folder's watermark past older files the scan has
+        not reached yet, and those files would never be dispatched.
+        """
+        with self.lock:
+            self.baseline = dict(self.state)
+
+    def release_baseline(self):
+        self.baseline = None
+
+    def get_catchup_timestamp(self, file_dir):
+        """Like get_last_timestamp, but reads the frozen baseline while one is set."""
+        baseline = self.baseline
+        if baseline is None:
+            return self.get_last_timestamp(file_dir)
+        rel_path = os.path.relpath(file_dir, self.root_dir)
+        return baseline.get(rel_path, 0.0)
+
+    def update_state(self, file_path, timestamp, size=None):
         """Updates the timestamp for the folder containing the file."""
         file_dir = os.path.dirname(file_path)
         rel_path = os.path.relpath(file_dir, self.root_dir)
+
+        if self.ledger is not None and size is not None:
+            self.ledger.add(os.path.relpath(file_path, self.root_dir), size, timestamp)
         
+        self._updates.inc()
+        evicted = None
         # Only update if newer to prevent regression during async processing
-        if timestamp > self.state.get(rel_path, 0.0):
-            self.state[rel_path] = timestamp
-            # self._save_state()
+        with self.lock:
+            previous = self.state.get(rel_path)
+            if previous is None:
+                rel_path = sys.intern(rel_path)
+                self.state[rel_path] = timestamp
+                self._state_index.add(rel_path, timestamp)
+                self._key_bytes += sys.getsizeof(rel_path)
+                self.store.record(rel_path, timestamp)
+                if self.max_keys and len(self.state) > self.max_keys:
+                    evicted = self._evict()
+            elif timestamp > previous:
+                self.state[rel_path] = timestamp
+                self._state_index.add(rel_path, timestamp, previous)
+                self.store.record(rel_path, timestamp)
+        if evicted:
+            self.store.delete(evicted, [])
+
+    def _evict(self):
+        """Drops the oldest watermarks down to max_keys. Caller holds the lock."""
+        evicted = []
+        while len(self.state) > self.max_keys:
+            rel_path = self._state_index.pop_oldest()
+            if rel_path is None:
+                break
+            del self.state[rel_path]
+            self._key_bytes -= sys.getsizeof(rel_path)
+            evicted.append(rel_path)
+        self.evicted += len(evicted)
+        self._evicted.inc(len(evicted))
+        return evicted
+
+    def is_missed(self, file_path, size, mtime, last_known_time):
+        """
+        Catch-up decision for one file. Inside the ledger window a file is missed
+        exactly when it was never confirmed; elsewhere it falls back to the watermark.
+        """
+        if self.ledger is not None and self.ledger.covers(mtime):
+            return not self.ledger.contains(os.path.relpath(file_path, self.root_dir), size, mtime)
+        return mtime > last_known_time
+
+    def get_dir_mark(self, dir_path):
+        """Returns the directory mtime recorded by the last clean catch-up scan, or None."""
+        rel_path = os.path.relpath(dir_path, self.root_dir)
+        return self.dir_marks.get(rel_path)
+
+    def set_dir_mark(self, dir_path, dir_mtime):
+        rel_path = sys.intern(os.path.relpath(dir_path, self.root_dir))
+        with self.lock:
+            self._mark_index.add(rel_path, dir_mtime, self.dir_marks.get(rel_path))
+            self.dir_marks[rel_path] = dir_mtime
+            self.store.record_mark(rel_path, dir_mtime)
+
+    def memory_estimate(self):
+        """Approximate bytes held by the state and dir mark dicts and their keys."""
+        return sys.getsizeof(self.state) + sys.getsizeof(self.dir_marks) + self._key_bytes
+
+    def snapshot(self):
+        """Consistent copies of (state, dir_marks)."""
+        with self.lock:
+            return dict(self.state), dict(self.dir_marks)
 
     def _save_state(self):
-        """Atomic write to JSON"""
+        """Atomic write through the state store"""
         try:
-            with open(self.state_file, 'w') as f:
-                json.dump(self.state, f, indent=2)
+            self.store.save(*self.snapshot())
         except Exception as e:
             self.logger.error(f"❌ Failed to save state: {e}")
 
@@ -50,14 +220,40 @@ class StateManager:
         """Called only upon program exit."""
         self.logger.info("💾 Flushing state to disk...")
         self._save_state()
+        self.store.close()
+        if self.ledger is not None:
+            try:
+                # Stops its checkpointer and marks the ledger complete for the next start
+                self.ledger.close()
+            except Exception as e:
+                self.logger.error(f"❌ Failed to save ledger: {e}")
 
     def prune_old_keys(self, days_to_keep=7):
-        """Maintenance: Remove folders older than X days from JSON to save memory."""
+        """
+        Maintenance: Remove folders older than X days (to the day) to save memory.
+        Cheap enough to run periodically: only expired keys are touched, and the
+        store persists the deletions on its own schedule.
+        """
         cutoff = (datetime.now() - timedelta(days=days_to_keep)).timestamp()
-        keys_to_remove = [k for k, v in self.state.items() if v < cutoff]
-        for k in keys_to_remove:
-            del self.state[k]
+        with self.lock:
+            keys_to_remove = self._state_index.pop_before(cutoff)
+            for k in keys_to_remove:
+                del self.state[k]
+                self._key_bytes -= sys.getsizeof(k)
+            marks_to_remove = self._mark_index.pop_before(cutoff)
+            for k in marks_to_remove:
+                del self.dir_marks[k]
+            evicted, self.evicted = self.evicted, 0
+        if keys_to_remove or marks_to_remove:
+            self.store.delete(keys_to_remove, marks_to_remove)
+            self._expired.inc(len(keys_to_remove))
         if keys_to_remove:
-            self._save_state()
             self.logger.info(f"🧹 Pruned {len(keys_to_remove)} old directories from state.")
+        if self.ledger is not None:
+            expired_days = self.ledger.expire()
+            if expired_days:
+                self.logger.info(f"🧹 Dropped {expired_days} days from the ledger.")
+        if evicted:
+            self.logger.warning(f"⚠️ State over {self.max_keys} directories: evicted the {evicted} oldest "
+                                f"(catch-up treats them as never seen)")
 
@@ -0,0 +1,481 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+class JsonStateStore:
+    """
+    Default backend: the whole state is rewritten as JSON on every save.
+    Writes go to a temp file that is fsync'ed and renamed over the target,
+    so a crash mid-write leaves the previous file intact.
+
+    With a `checkpoint_interval`, changed keys are tracked between saves and
+    a background thread appends them every interval as one compact JSON line
+    to a journal next to the state file (null = deleted), so a checkpoint
+    costs what changed rather than the whole state. Once the journal passes
+    `compact_bytes` the same thread folds it into a fresh snapshot and drops
+    it. Loading replays the journal over the snapshot; a torn last line is
+    ignored.
+    """
+    def __init__(self, state_file, logger, checkpoint_interval=0, compact_bytes=4 << 20):
+        self.state_file = state_file
+        # Directory mtimes seen by clean catch-up scans (see CatchupScanner)
+        self.dir_marks_file = os.path.splitext(state_file)[0] + '_dirs.json'
+        self.journal_file = os.path.splitext(state_file)[0] + '_journal.jsonl'
+        self.logger = logger
+        self.checkpoint_interval = checkpoint_interval
+        self.compact_bytes = compact_bytes
+
+        self.lock = threading.Lock()
+        # Serializes snapshot and journal writes between the checkpointer and save()
+        self.io_lock = threading.Lock()
+        self.dirty = {}        # rel_path -> timestamp, or None once deleted
+        self.dirty_marks = {}
+        self.journal_bytes = 0
+        self._snapshot = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.checkpoints = 0
+        self.compactions = 0
+
+    def load(self):
+        state = self._read(self.state_file, "state")
+        marks = self._read(self.dir_marks_file, "dir marks")
+        replayed = self._replay(state, marks)
+        if state:
+            self.logger.info(f"📖 State loaded. Tracking {len(state)} directories"
+                             f"{f' ({replayed} journal checkpoints replayed)' if replayed else ''}.")
+        return state, marks
+
+    def _replay(self, state, marks):
+        if not os.path.exists(self.journal_file):
+            return 0
+        replayed = 0
+        good_bytes = 0
+        with open(self.journal_file, 'rb+') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn by a crash mid-append: cut it off so new checkpoints are not appended behind it
+                    self.logger.warning(f"⚠️ Dropping a torn state journal tail ({os.path.getsize(self.journal_file) - good_bytes} bytes)")
+                    f.truncate(good_bytes)
+                    break
+                good_bytes += len(line)
+                for rel_path, ts in entry.get('s', {}).items():
+                    if ts is None:
+                        state.pop(rel_path, None)
+                    elif ts > state.get(rel_path, 0.0):
+                        # The journal may predate a snapshot saved after it; watermarks only move forward
+                        state[rel_path] = ts
+                for rel_path, dir_mtime in entry.get('m', {}).items():
+                    # A stale mark only costs a rescan of that directory
+                    if dir_mtime is None:
+                        marks.pop(rel_path, None)
+                    else:
+                        marks[rel_path] = dir_mtime
+                replayed += 1
+        self.journal_bytes = good_bytes
+        return replayed
+
+    def start(self, snapshot):
+        """`snapshot()` returns consistent copies of (state, dir_marks) for compaction."""
+        self._snapshot = snapshot
+        if self.checkpoint_interval > 0:
+            self._thread = threading.Thread(target=self._checkpoint_loop, name="state-checkpoint", daemon=True)
+            self._thread.start()
+
+    def _checkpoint_loop(self):
+        while not self._stop_event.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+                if self.journal_bytes >= self.compact_bytes:
+                    self._compact()
+            except Exception as e:
+                self.logger.error(f"❌ Failed to checkpoint state: {e}")
+
+    def checkpoint(self):
+        """Appends the keys changed since the last checkpoint; returns how many."""
+        with self.io_lock:
+            with self.lock:
+                if not self.dirty and not self.dirty_marks:
+                    return 0
+                dirty, self.dirty = self.dirty, {}
+                dirty_marks, self.dirty_marks = self.dirty_marks, {}
+            line = json.dumps({'s': dirty, 'm': dirty_marks}, separators=(',', ':')).encode('utf-8') + b'\n'
+            try:
+                with open(self.journal_file, 'ab') as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                # Keep the changes for the next checkpoint (anything recorded since is newer)
+                with self.lock:
+                    for rel_path, ts in dirty.items():
+                        self.dirty.setdefault(rel_path, ts)
+                    for rel_path, dir_mtime in dirty_marks.items():
+                        self.dirty_marks.setdefault(rel_path, dir_mtime)
+                # and cut off a partial line, which would hide every later one from replay
+                try:
+                    os.truncate(self.journal_file, self.journal_bytes)
+                except OSError:
+                    pass
+                raise
+            self.journal_bytes += len(line)
+            self.checkpoints += 1
+        return len(dirty) + len(dirty_marks)
+
+    def _compact(self):
+        """
+        Snapshot taken after the journal's last append, so it covers every
+        journaled change; changes made since stay dirty for the next checkpoint.
+        """
+        start = time.monotonic()
+        journal_bytes = self.journal_bytes
+        state, dir_marks = self._snapshot()
+        with self.io_lock:
+            self._write_snapshot(state, dir_marks)
+            try:
+                os.remove(self.journal_file)
+            except FileNotFoundError:
+                pass
+            self.journal_bytes = 0
+        self.compactions += 1
+        self.logger.info(f"💾 Folded {journal_bytes // 1024} KiB of state journal into a snapshot "
+                         f"({time.monotonic() - start:.2f}s)")
+
+    def _read(self, path, name):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.error(f"⚠️ Corrupt {name} file, starting fresh: {e}")
+            return {}
+
+    def record(self, rel_path, timestamp):
+        if self.checkpoint_interval > 0:
+            with self.lock:
+                self.dirty[rel_path] = timestamp
+
+    def record_mark(self, rel_path, dir_mtime):
+        if self.checkpoint_interval > 0:
+            with self.lock:
+                self.dirty_marks[rel_path] = dir_mtime
+
+    def delete(self, rel_paths, mark_paths):
+        if self.checkpoint_interval > 0:
+            with self.lock:
+                self.dirty.update(dict.fromkeys(rel_paths))
+                self.dirty_marks.update(dict.fromkeys(mark_paths))
+
+    def save(self, state, dir_marks):
+        # A running checkpointer may have journaled changes newer than this
+        # snapshot, so only it (or close) drops the journal
+        with self.io_lock:
+            self._write_snapshot(state, dir_marks)
+
+    def _write_snapshot(self, state, dir_marks):
+        _atomic_write_json(self.state_file, state, indent=2)
+        _atomic_write_json(self.dir_marks_file, dir_marks)
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.checkpoint()
+        # Nothing changes any more: leave a single snapshot behind
+        if self.journal_bytes and self._snapshot is not None:
+            self._compact()
+
+
+def _atomic_write_json(path, data, indent=None):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SqliteStateStore:
+    """
+    Incremental backend: SQLite in WAL mode.
+    update_state only buffers the change; a background thread commits the buffer
+    as one transaction every `flush_interval` seconds, or as soon as
+    `flush_every` updates are pending. At most that window is lost on kill -9
+    or power loss, and restart is a single SELECT.
+    """
+    def __init__(self, db_file, logger, flush_every=100, flush_interval=0.2, import_json=None, busy_timeout=5.0):
+        self.db_file = db_file
+        self.logger = logger
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        is_new = not os.path.exists(db_file)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        # Wait out another writer (e.g. a second process on the same file) instead of failing at once
+        self.conn.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (rel_path TEXT PRIMARY KEY, ts REAL NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS dir_marks (rel_path TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+        self.conn.commit()
+
+        self.db_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.pending_marks = {}
+
+        # One-time migration from the JSON state file
+        if is_new and import_json and os.path.exists(import_json):
+            state, marks = JsonStateStore(import_json, logger).load()
+            with self.pending_lock:
+                self.pending.update(state)
+                self.pending_marks.update(marks)
+            self.flush()
+            self.logger.info(f"📦 Imported {len(state)} directories from {import_json}")
+
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="state-flusher", daemon=True)
+        self._flusher.start()
+
+    def start(self, snapshot):
+        pass # Commits on its own flusher thread
+
+    def load(self):
+        with self.db_lock:
+            state = dict(self.conn.execute("SELECT rel_path, ts FROM state"))
+            marks = dict(self.conn.execute("SELECT rel_path, mtime FROM dir_marks"))
+        self.logger.info(f"📖 State loaded. Tracking {len(state)} directories.")
+        return state, marks
+
+    def record(self, rel_path, timestamp):
+        with self.pending_lock:
+            self.pending[rel_path] = timestamp
+            if len(self.pending) >= self.flush_every:
+                self._wake.set()
+
+    def record_mark(self, rel_path, dir_mtime):
+        with self.pending_lock:
+            self.pending_marks[rel_path] = dir_mtime
+
+    def delete(self, rel_paths, mark_paths):
+        # Under db_lock, so no flush holds a batch with these keys in flight
+        with self.db_lock:
+            with self.pending_lock:
+                for rel_path in rel_paths:
+                    self.pending.pop(rel_path, None)
+                for rel_path in mark_paths:
+                    self.pending_marks.pop(rel_path, None)
+            self.conn.executemany("DELETE FROM state WHERE rel_path = ?", ((k,) for k in rel_paths))
+            self.conn.executemany("DELETE FROM dir_marks WHERE rel_path = ?", ((k,) for k in mark_paths))
+            self.conn.commit()
+
+    def save(self, state, dir_marks):
+        # Everything already lives in the database; just commit what is buffered
+        self.flush()
+
+    def flush(self):
+        with self.db_lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, {}
+                marks, self.pending_marks = self.pending_marks, {}
+            if not pending and not marks:
+                return
+            try:
+                self.conn.executemany(
+                    "INSERT INTO state (rel_path, ts) VALUES (?, ?) "
+                    "ON CONFLICT(rel_path) DO UPDATE SET ts = excluded.ts WHERE excluded.ts > state.ts",
+                    pending.items()
+                )
+                self.conn.executemany(
+                    "INSERT INTO dir_marks (rel_path, mtime) VALUES (?, ?) "
+                    "ON CONFLICT(rel_path) DO UPDATE SET mtime = excluded.mtime",
+                    marks.items()
+                )
+                self.conn.commit()
+            except sqlite3.Error:
+                try:
+                    self.conn.rollback()
+                except sqlite3.Error:
+                    pass
+                # Put the batch back for the next flush; newer updates recorded meanwhile win
+                with self.pending_lock:
+                    for rel_path, ts in pending.items():
+                        if ts > self.pending.get(rel_path, 0.0):
+                            self.pending[rel_path] = ts
+                    for rel_path, dir_mtime in marks.items():
+                        self.pending_marks.setdefault(rel_path, dir_mtime)
+                raise
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"❌ Failed to save state: {e}")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
+
+
+class SharedStateStore:
+    """
+    One store for every watch root of the process: a single load at startup,
+    one checkpoint journal (or one SQLite transaction) and one exit save for
+    all roots. Each root gets a partition(), which StateManager uses like any
+    other store; its save() and close() are deferred to close() on the shared
+    store. Keys are '<root>\\0<rel_path>' in the underlying store, so
+    roots cannot collide however similar their names.
+    Reads never touch it: each StateManager serves them from its own dicts.
+    Every root the store has seen keeps an empty dir mark ('<root>\\0'), so
+    legacy files are imported once, never again once its state is empty.
+    """
+    SEP = '\0'
+
+    def __init__(self, store, logger):
+        self.store = store
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.partitions = {}   # root -> _RootPartition
+        self._loaded = None    # root -> (state, dir_marks) until each partition claims its own
+        self._started = False
+        self._closed = False
+
+    def partition(self, root_dir, legacy=()):
+        """
+        Store view for one root. `legacy` lists old per-root state files to
+        import from when the shared store has nothing for this root yet.
+        """
+        root = os.path.normcase(os.path.abspath(root_dir))
+        with self.lock:
+            if root in self.partitions:
+                raise ValueError(f"root {root_dir} is already registered with the state store")
+            part = self.partitions[root] = _RootPartition(self, root, legacy)
+        return part
+
+    def _load(self, root):
+        with self.lock:
+            if self._loaded is None:
+                self._loaded = _split_roots(*self.store.load())
+            return self._loaded.pop(root, None)
+
+    def _start(self):
+        with self.lock:
+            if self._started:
+                return
+            self._started = True
+        self.store.start(self._snapshot)
+
+    def _snapshot(self):
+        state, marks = {}, {}
+        with self.lock:
+            # Roots not watched this run are carried over untouched
+            parts = [(root, lambda loaded=loaded: loaded) for root, loaded in (self._loaded or {}).items()]
+            parts += [(root, part.snapshot) for root, part in self.partitions.items() if part.snapshot is not None]
+        for root, snapshot in parts:
+            part_state, part_marks = snapshot()
+            prefix = root + self.SEP
+            state.update((prefix + k, v) for k, v in part_state.items())
+            marks.update((prefix + k, v) for k, v in part_marks.items())
+            marks[prefix] = 0.0 # Seen; see _RootPartition.load
+        return state, marks
+
+    def close(self):
+        """Writes every root in one go; call once, after all the StateManagers have flushed."""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.store.save(*self._snapshot())
+        self.store.close()
+
+
+class _RootPartition:
+    """One root's slice of a SharedStateStore, with the store interface StateManager expects."""
+    def __init__(self, shared, root, legacy):
+        self.shared = shared
+        self.root = root
+        self.prefix = root + SharedStateStore.SEP
+        self.legacy = legacy
+        self.snapshot = None
+
+    def load(self):
+        loaded = self.shared._load(self.root)
+        if loaded is not None:
+            state, marks = loaded
+            # Any key at all, or the empty mark, means legacy files were already imported
+            marks.pop('', None)
+            self.shared.logger.info(f"📖 State loaded for {self.root}. Tracking {len(state)} directories.")
+            return state, marks
+        self.record_mark('', 0.0)
+        state, marks, source = self._load_legacy()
+        if source is not None:
+            # Queue the import so the next checkpoint (or the exit save) persists it
+            for rel_path, ts in state.items():
+                self.record(rel_path, ts)
+            for rel_path, dir_mtime in marks.items():
+                self.record_mark(rel_path, dir_mtime)
+            self.shared.logger.info(f"📦 Imported {len(state)} directories for {self.root} from {source}")
+        return state, marks
+
+    def _load_legacy(self):
+        """(state, dir_marks, source) from the first legacy file that exists."""
+        for path in self.legacy:
+            if not os.path.exists(path):
+                continue
+            legacy_store = _open_legacy(path, self.shared.logger)
+            state, marks = legacy_store.load()
+            legacy_store.close()
+            return state, marks, path
+        return {}, {}, None
+
+    def start(self, snapshot):
+        self.snapshot = snapshot
+        self.shared._start()
+
+    def record(self, rel_path, timestamp):
+        self.shared.store.record(self.prefix + rel_path, timestamp)
+
+    def record_mark(self, rel_path, dir_mtime):
+        self.shared.store.record_mark(self.prefix + rel_path, dir_mtime)
+
+    def delete(self, rel_paths, mark_paths):
+        self.shared.store.delete([self.prefix + k for k in rel_paths], [self.prefix + k for k in mark_paths])
+
+    def save(self, state, dir_marks):
+        pass # Written with every other root by SharedStateStore.close()
+
+    def close(self):
+        pass
+
+
+def _split_roots(state, marks):
+    """Shared-store keys -> {root: (state, dir_marks)} with the root prefix stripped."""
+    roots = {}
+    for target, index in ((state, 0), (marks, 1)):
+        for key, value in target.items():
+            root, _, rel_path = key.partition(SharedStateStore.SEP)
+            roots.setdefault(root, ({}, {}))[index][rel_path] = value
+    return roots
+
+
+def _open_legacy(path, logger):
+    if path.endswith('.db'):
+        return SqliteStateStore(path, logger)
+    return JsonStateStore(path, logger)
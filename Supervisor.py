@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+import logging
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_TIMEOUT = 60  # seconds without a stats heartbeat before a worker is considered hung
+STABLE_AFTER = 300      # seconds a worker must stay up before its restart backoff resets
+
+
+class Supervisor:
+    """
+    Runs one listener worker process per shard of watch roots, so hashing,
+    encoding, logging and publishing for different roots no longer share a GIL.
+    Each worker has its own StateManager, observer and broker connection and
+    writes a JSON stats heartbeat the supervisor uses for health checks and
+    aggregated metrics. Crashed or hung workers are restarted with backoff;
+    SIGTERM/SIGINT is forwarded so every worker flushes its state.
+    """
+    def __init__(self, shards, worker_args, stats_dir, stats_interval=60, shutdown_timeout=30, metrics_port=0):
+        self.shards = shards
+        self.worker_args = worker_args
+        self.stats_dir = stats_dir
+        self.stats_interval = stats_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.metrics_port = metrics_port
+        self.workers = [_Worker(i, roots) for i, roots in enumerate(shards)]
+        self._stopping = False
+
+    @staticmethod
+    def shard_roots(roots, num_shards):
+        """Round-robin, so the assignment is stable for a given argument order."""
+        num_shards = max(1, min(num_shards, len(roots)))
+        return [roots[i::num_shards] for i in range(num_shards)]
+
+    def _launcher(self):
+        # A PyInstaller build is its own interpreter
+        if getattr(sys, 'frozen', False):
+            return [sys.executable]
+        return [sys.executable, os.path.abspath(sys.argv[0])]
+
+    def _start(self, worker):
+        stats_file = os.path.join(self.stats_dir, f"worker_{worker.index}.json")
+        cmd = self._launcher() + worker.roots + self.worker_args + ["--stats-file", stats_file]
+        if self.metrics_port:
+            # Each worker serves its own registry on the next ports up
+            cmd += ["--metrics-port", str(self.metrics_port + 1 + worker.index)]
+        kwargs = {}
+        if os.name == 'nt':
+            # Own process group so CTRL_BREAK_EVENT reaches only this worker
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        worker.process = subprocess.Popen(cmd, **kwargs)
+        worker.stats_file = stats_file
+        worker.started_at = time.time()
+        logger.info(f"🚚 Worker {worker.index} (pid {worker.process.pid}) watching {len(worker.roots)} roots")
+
+    def run(self):
+        os.makedirs(self.stats_dir, exist_ok=True)
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+
+        for worker in self.workers:
+            self._start(worker)
+
+        last_stats = time.monotonic()
+        while not self._stopping:
+            time.sleep(1)
+            for worker in self.workers:
+                self._check(worker)
+            if time.monotonic() - last_stats >= self.stats_interval:
+                self.log_stats()
+                last_stats = time.monotonic()
+
+        self.shutdown()
+
+    def _check(self, worker):
+        now = time.time()
+        if worker.restart_at:
+            if now >= worker.restart_at:
+                worker.restart_at = 0
+                self._start(worker)
+            return
+
+        code = worker.process.poll()
+        if code is None:
+            # Alive; hung only if it has heartbeated before and then went quiet
+            heartbeat = worker.last_heartbeat()
+            if heartbeat > worker.started_at and now - heartbeat > HEARTBEAT_TIMEOUT:
+                logger.error(f"❌ Worker {worker.index} missed heartbeats for {now - heartbeat:.0f}s, killing")
+                worker.process.kill()
+                worker.process.wait()
+                code = 'hung'
+            else:
+                return
+
+        # Crashed or hung: restart with exponential backoff
+        if now - worker.started_at > STABLE_AFTER:
+            worker.backoff = 1
+        logger.error(f"🔥 Worker {worker.index} exited ({code}). Restarting in {worker.backoff}s...")
+        worker.restart_at = now + worker.backoff
+        worker.restarts += 1
+        worker.backoff = min(worker.backoff * 2, 60)
+
+    def _on_signal(self, signum=None, frame=None):
+        logger.info("\n🛑 Stop signal received. Stopping workers...")
+        self._stopping = True
+
+    def shutdown(self):
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                try:
+                    if os.name == 'nt':
+                        worker.process.send_signal(signal.CTRL_BREAK_EVENT)
+                    else:
+                        worker.process.send_signal(signal.SIGTERM)
+                except OSError:
+                    pass
+
+        # Give every worker time to drain its queue and flush its state
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker in self.workers:
+            if not worker.process:
+                continue
+            try:
+                worker.process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.error(f"❌ Worker {worker.index} did not stop in time, killing")
+                worker.process.kill()
+        self.log_stats()
+        logger.info("👋 Supervisor exited.")
+
+    def log_stats(self):
+        """Sums the numeric fields of every worker's last heartbeat."""
+        totals = {}
+        alive = 0
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                alive += 1
+            for key, value in worker.read_stats().items():
+                if not isinstance(value, (int, float)) or 'avg' in key or key == 'amplification':
+                    continue # Averages and ratios don't add up across workers
+                if key.endswith('_max_ms'):
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        restarts = sum(w.restarts for w in self.workers)
+        summary = " ".join(f"{k}={v:.0f}" if isinstance(v, float) else f"{k}={v}" for k, v in sorted(totals.items()))
+        logger.info(f"📊 Workers alive={alive}/{len(self.workers)} restarts={restarts} {summary}")
+
+
+class _Worker:
+    def __init__(self, index, roots):
+        self.index = index
+        self.roots = roots
+        self.process = None
+        self.stats_file = None
+        self.started_at = 0
+        self.restart_at = 0
+        self.backoff = 1
+        self.restarts = 0
+
+    def last_heartbeat(self):
+        try:
+            return os.path.getmtime(self.stats_file)
+        except (OSError, TypeError):
+            return 0
+
+    def read_stats(self):
+        try:
+            with open(self.stats_file, 'r') as f:
+                return json.load(f)
+        except (OSError, TypeError, ValueError):
+            return {}
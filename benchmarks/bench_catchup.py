@@ -0,0 +1,122 @@
+"""
+Catch-up scan benchmark.
+
+Generates a synthetic camera tree of N dirs x M files, then compares the old
+os.walk + getmtime scan with CatchupScanner on a cold run (empty state) and a
+warm run (everything already dispatched). Reports files/sec and syscalls
+(directory listings + stat calls).
+
+    python benchmarks/bench_catchup.py --dirs 500 --files 200 --threads 8
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from StateManager import StateManager
+from CatchupScanner import CatchupScanner
+from FileEvent import FileEvent
+
+VALID_EXTENSIONS = {'.dav', '.jpg', '.jpeg', '.png'}
+logger = logging.getLogger("bench")
+
+
+def build_tree(root, num_dirs, files_per_dir):
+    """root/camXX/YYYY-MM-DD/NNN/*.dav|*.jpg, mtimes set an hour in the past."""
+    old = time.time() - 3600
+    for d in range(num_dirs):
+        leaf = os.path.join(root, f"cam{d % 16:02d}", f"2025-11-{d % 28 + 1:02d}", f"{d:04d}")
+        os.makedirs(leaf, exist_ok=True)
+        for f in range(files_per_dir):
+            ext = '.dav' if f % 4 == 0 else '.jpg'
+            path = os.path.join(leaf, f"{f:05d}{ext}")
+            with open(path, 'wb'):
+                pass
+            os.utime(path, (old, old))
+    # Directory mtimes too, so they are past the dir_mtime_slack
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (old, old))
+
+
+def legacy_scan(state_mgr, src_path, on_file):
+    """The original FolderMonitor.run_catchup_scan loop, instrumented."""
+    listings = stats = count = 0
+    for root, dirs, files in os.walk(src_path):
+        listings += 1
+        last_known_time = state_mgr.get_last_timestamp(root)
+        for file in files:
+            ext = os.path.splitext(file)[1].lower()
+            if ext in VALID_EXTENSIONS:
+                file_path = os.path.join(root, file)
+                try:
+                    file_mtime = os.path.getmtime(file_path)
+                    stats += 1
+                    if file_mtime > last_known_time:
+                        on_file(file_path)
+                        count += 1
+                except OSError:
+                    pass
+    return count, listings + stats
+
+
+def report(name, total_files, elapsed, found, syscalls):
+    rate = total_files / elapsed if elapsed else float('inf')
+    print(f"{name:<24} {elapsed:8.3f}s {rate:12,.0f} files/s  found={found:<8} syscalls={syscalls:,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catch-up scan benchmark")
+    parser.add_argument("--dirs", type=int, default=500)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tree")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_catchup_")
+    try:
+        build_tree(root, args.dirs, args.files)
+        total = args.dirs * args.files
+        print(f"Tree: {args.dirs} dirs x {args.files} files = {total:,} files in {root}")
+
+        def dispatched(state_mgr):
+            # Simulate a confirmed publish; the scanner hands over FileEvents carrying its stat, the legacy scan paths
+            return lambda file: state_mgr.update_state(os.fspath(file), file.mtime if isinstance(file, FileEvent)
+                                                       else os.stat(file).st_mtime)
+
+        # Cold: nothing dispatched yet, every file is "missed"
+        legacy_state = StateManager(os.path.join(root, "legacy.json"), root, logger)
+        start = time.perf_counter()
+        found, syscalls = legacy_scan(legacy_state, root, dispatched(legacy_state))
+        report("legacy cold", total, time.perf_counter() - start, found, syscalls)
+
+        state = StateManager(os.path.join(root, "scanner.json"), root, logger)
+        scanner = CatchupScanner(state, VALID_EXTENSIONS, dispatched(state), num_threads=args.threads)
+        start = time.perf_counter()
+        found = scanner.scan(root)
+        report("scanner cold", total, time.perf_counter() - start, found,
+               scanner.dirs_scanned + scanner.stat_calls)
+
+        # Warm: restart after everything was dispatched
+        start = time.perf_counter()
+        found, syscalls = legacy_scan(legacy_state, root, dispatched(legacy_state))
+        report("legacy warm", total, time.perf_counter() - start, found, syscalls)
+
+        for run in ("scanner warm (marking)", "scanner warm (marked)"):
+            scanner.reset_stats()
+            start = time.perf_counter()
+            found = scanner.scan(root)
+            report(run, total, time.perf_counter() - start, found,
+                   scanner.dirs_scanned + scanner.stat_calls)
+    finally:
+        if args.keep:
+            print(f"Tree kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+inotify observer stress benchmark.
+
+Creates files across dated directories faster than the kernel queue
+(fs.inotify.max_queued_events, 16384 by default) can hold while the handler
+is slow, so the queue overflows. Reports how many files arrived as live
+events, how many the overflow rescans recovered, and how many were missed.
+
+    python benchmarks/bench_inotify.py --files 60000 --handler-delay-us 50
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from InotifyObserver import InotifyObserver
+
+
+class CountingHandler:
+    """Stands in for FolderMonitor: records live events, rescans by listing the subtrees."""
+    def __init__(self, delay):
+        self.delay = delay
+        self.live = set()
+        self.rescanned = set()
+        self.lock = threading.Lock()
+
+    def dispatch(self, event):
+        if event.event_type in ('created', 'moved'):
+            path = getattr(event, 'dest_path', '') or event.src_path
+            with self.lock:
+                self.live.add(path)
+            if self.delay:
+                time.sleep(self.delay)
+
+    def rescan(self, dir_paths):
+        found = set()
+        for dir_path in dir_paths:
+            for top, _, files in os.walk(dir_path):
+                found.update(os.path.join(top, name) for name in files)
+        with self.lock:
+            self.rescanned |= found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="inotify overflow stress benchmark")
+    parser.add_argument("--files", type=int, default=60_000)
+    parser.add_argument("--dirs", type=int, default=20, help="Dated directories created during the run")
+    parser.add_argument("--old-dirs", type=int, default=200, help="Idle directories present at startup")
+    parser.add_argument("--handler-delay-us", type=int, default=50, help="Simulated per-event handler cost")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_inotify_")
+    for i in range(args.old_dirs):
+        os.makedirs(os.path.join(root, "archive", f"2024-01-{i:04d}"))
+
+    handler = CountingHandler(args.handler_delay_us / 1e6)
+    observer = InotifyObserver()
+    observer.schedule(handler, root)
+    start = time.perf_counter()
+    observer.start()
+    print(f"watch setup {time.perf_counter() - start:.3f}s for {observer.get_stats()['watches']} directories")
+
+    created = []
+    start = time.perf_counter()
+    for i in range(args.files):
+        dir_path = os.path.join(root, "cam01", f"2025-11-{i % args.dirs:02d}")
+        if i < args.dirs:
+            os.makedirs(dir_path)
+        path = os.path.join(dir_path, f"{i:08d}.jpg")
+        with open(path, 'wb'):
+            pass
+        created.append(path)
+    elapsed = time.perf_counter() - start
+    print(f"created     {args.files:,} files in {elapsed:.2f}s ({args.files / elapsed:,.0f}/s)")
+
+    # Let the reader and any rescans finish
+    last = -1
+    while True:
+        time.sleep(1)
+        with handler.lock:
+            seen = len(handler.live | handler.rescanned)
+        if seen == last:
+            break
+        last = seen
+    observer.stop()
+    observer.join()
+
+    expected = set(created)
+    live = handler.live & expected
+    recovered = (handler.rescanned & expected) - live
+    stats = observer.get_stats()
+    print(f"live events {len(live):,}  reads={stats['inotify_reads']:,} "
+          f"({stats['inotify_events'] / max(1, stats['inotify_reads']):.0f} events/read)")
+    print(f"overflows   {stats['overflows']}  rescanned dirs={stats['rescanned_dirs']}  recovered={len(recovered):,}")
+    print(f"missed      {len(expected - live - recovered):,}")
+
+
+if __name__ == "__main__":
+    main()
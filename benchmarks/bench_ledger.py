@@ -0,0 +1,74 @@
+"""
+FileLedger benchmark.
+
+Fills a ledger with N published files spread over the window, then measures
+lookup cost for hits (already published) and misses (never published), plus
+memory per entry and save/load time.
+
+    python benchmarks/bench_ledger.py --entries 10000000
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from FileLedger import FileLedger, DAY
+
+logger = logging.getLogger("bench")
+
+
+def fake_file(i, now, days):
+    mtime = now - (i % (days * 1000)) * (DAY / 1000.0) - 1
+    rel_path = f"cam{i % 64:02d}\\2025-11-{i % 28 + 1:02d}\\{i // 1000:06d}\\{i:09d}.jpg"
+    return rel_path, 100000 + i % 5000, mtime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FileLedger lookup benchmark")
+    parser.add_argument("--entries", type=int, default=10_000_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--bloom-bits-per-key", type=int, default=10, help="Bloom bits per ledger entry")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_ledger_"), "ledger.bin")
+    ledger = FileLedger(path, logger, window_days=args.days, bloom_bits_per_key=args.bloom_bits_per_key)
+    ledger.start_time = 0 # cover the whole window
+    now = time.time()
+
+    start = time.perf_counter()
+    for i in range(args.entries):
+        ledger.add(*fake_file(i, now, args.days))
+    elapsed = time.perf_counter() - start
+    print(f"insert   {args.entries:,} entries in {elapsed:.1f}s ({elapsed / args.entries * 1e6:.2f} us/insert)")
+
+    with ledger.lock:
+        for bucket in ledger.buckets.values():
+            bucket.merge()
+    mem = ledger.memory_bytes()
+    print(f"memory   {mem / 2**20:.1f} MiB ({mem / args.entries:.1f} bytes/entry incl. bloom)")
+
+    hits = [fake_file(random.randrange(args.entries), now, args.days) for _ in range(args.lookups)]
+    misses = [(p + ".missing", s, m) for p, s, m in hits]
+
+    for name, probes, expected in (("hit", hits, True), ("miss", misses, False)):
+        start = time.perf_counter()
+        wrong = sum(1 for probe in probes if ledger.contains(*probe) != expected)
+        elapsed = time.perf_counter() - start
+        print(f"lookup   {name:<4} {elapsed / len(probes) * 1e9:8.0f} ns/lookup  wrong={wrong}")
+
+    start = time.perf_counter()
+    ledger.save()
+    print(f"save     {time.perf_counter() - start:.2f}s, {os.path.getsize(path) / 2**20:.1f} MiB on disk")
+    start = time.perf_counter()
+    FileLedger(path, logger, window_days=args.days)
+    print(f"load     {time.perf_counter() - start:.2f}s")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Logging overhead benchmark.
+
+Feeds synthetic "created" events through FolderMonitor into a DispatchQueue
+whose dispatcher confirms instantly, and measures events/sec on the event
+thread with logging off, classic synchronous logging, and the async JSON
+mode with per-message rate limiting. Log output goes to a temp file, as in a
+service whose stderr is redirected.
+
+    python benchmarks/bench_logging.py --events 50000
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LogSetup import LogSetup
+from FolderMonitor import FolderMonitor
+from DispatchQueue import DispatchQueue
+from StateManager import StateManager
+
+
+class InstantDispatcher:
+    def send_task(self, file_path, watching_dir):
+        logging.getLogger("RemoteDispatcher_v2").info("🚀 Sent to MQ: %s", os.path.basename(file_path))
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeEvent:
+    def __init__(self, src_path):
+        self.src_path = src_path
+
+
+def run(mode, root, paths, log_file):
+    logger = logging.getLogger("bench")
+    with open(log_file, 'a', encoding='utf-8') as stream:
+        if mode == 'off':
+            setup = LogSetup('sync', 'text', stream=stream)
+            logging.getLogger().setLevel(logging.CRITICAL)
+        elif mode == 'sync':
+            setup = LogSetup('sync', 'text', stream=stream)
+        else:
+            setup = LogSetup('async', 'json', rate=20, summary_interval=0, stream=stream)
+        setup.start()
+
+        state = StateManager(os.path.join(root, f"state_{mode}.json"), root, logger)
+        dispatch_queue = DispatchQueue(InstantDispatcher, num_workers=2, max_size=len(paths) + 1)
+        dispatch_queue.start()
+        monitor = FolderMonitor(state, None, {'.jpg'}, logger, root, dispatch_queue=dispatch_queue)
+
+        start = time.perf_counter()
+        for path in paths:
+            monitor.on_created(FakeEvent(path))
+        detect = time.perf_counter() - start
+        dispatch_queue.stop(timeout=60)
+        total = time.perf_counter() - start
+        setup.stop()
+    return len(paths) / detect, len(paths) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logging overhead benchmark")
+    parser.add_argument("--events", type=int, default=50_000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_logging_")
+    paths = []
+    for i in range(args.events):
+        path = os.path.join(root, f"{i:08d}.jpg")
+        open(path, 'wb').close()
+        paths.append(path)
+    log_file = os.path.join(root, "listener.log")
+
+    results = {mode: run(mode, root, paths, log_file) for mode in ('off', 'sync', 'async')}
+    print(f"{'logging':<28}{'event thread ev/s':>20}{'end-to-end ev/s':>18}")
+    labels = {'off': 'off', 'sync': 'sync text (baseline)', 'async': 'async json, 20 lines/s/msg'}
+    for mode, (detect, total) in results.items():
+        print(f"{labels[mode]:<28}{detect:20,.0f}{total:18,.0f}")
+
+
+if __name__ == "__main__":
+    main()
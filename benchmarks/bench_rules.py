@@ -0,0 +1,98 @@
+"""
+File rule evaluation benchmark.
+
+Classifies N synthetic paths (camera-style Windows paths, a mix of .dav,
+.jpg, upper-case extensions, .dav_ temp files and unrelated files) with
+- the old chain: watchdog's fnmatch over the glob patterns, the endswith()
+  loop in on_created and the splitext()/lower() check in handle_file, plus
+  the endswith('.dav') routing branch in the dispatcher,
+- the compiled RuleTable with the default rules,
+- a RuleTable with regex and size-limited rules (name-only evaluation).
+Reports ns per path and checks the default table agrees with the old chain.
+
+    python benchmarks/bench_rules.py --paths 100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from watchdog.utils.patterns import match_any_paths
+from FileRules import RuleTable
+
+PATTERNS = ['*.jpeg', '*.dav', '*.jpg', '*.png', '*.dav_']
+VALID_EXTENSIONS = {'.dav', '.jpg', '.jpeg', '.png'}
+RABBIT_DICT = {'routing_key_vid': 'received.video', 'routing_key_img': 'received.image'}
+SUFFIXES = ['.jpg'] * 40 + ['.dav'] * 20 + ['.dav_'] * 10 + ['.JPG'] * 5 + ['.png'] * 5 + \
+           ['.txt', '.tmp', '.idx', '', '.log'] * 4
+
+
+def make_paths(count, seed=1):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        suffix = rng.choice(SUFFIXES)
+        paths.append(f"C:\\SFTP_Root\\Site{i % 40:02d}\\cam{i % 16:02d}\\2025-11-{i % 28 + 1:02d}"
+                     f"\\{i % 24:02d}\\ch{i % 8}_{i:08d}{suffix}")
+    return paths
+
+
+def legacy(path):
+    """Returns the routing key the old code would publish under, or None."""
+    if not match_any_paths([path], included_patterns=PATTERNS, case_sensitive=False):
+        return None
+    if not any(path.lower().endswith(ext) for ext in VALID_EXTENSIONS):
+        return None
+    if os.path.splitext(path)[1].lower() not in VALID_EXTENSIONS:
+        return None
+    return RABBIT_DICT['routing_key_vid'] if path.lower().endswith('.dav') else RABBIT_DICT['routing_key_img']
+
+
+def rules_only(table):
+    def classify(path):
+        rule = table.match(path)
+        return rule.routing_key if rule is not None else None
+    return classify
+
+
+def run(name, classify, paths):
+    start = time.perf_counter()
+    for path in paths:
+        classify(path)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed * 1000:9.1f} ms {elapsed / len(paths) * 1e9:9.0f} ns/path")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File rule evaluation benchmark")
+    parser.add_argument("--paths", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N runs")
+    args = parser.parse_args()
+
+    paths = make_paths(args.paths)
+    default = RuleTable.default(RABBIT_DICT)
+    custom = RuleTable.from_spec([
+        {"name": "clip", "ext": ".dav", "regex": r"^ch[0-3]_", "routing_key": "received.video.priority", "priority": 5},
+        {"name": "video", "ext": ".dav", "routing_key": "received.video"},
+        {"name": "image", "ext": ".jpg .jpeg .png", "max_size": 50 << 20, "routing_key": "received.image"},
+    ])
+
+    mismatches = sum(1 for path in paths if legacy(path) != rules_only(default)(path))
+    wanted = sum(1 for path in paths if default.match(path) is not None)
+    print(f"{len(paths):,} paths, {wanted:,} wanted, {mismatches} disagreements with the old chain")
+
+    results = {}
+    for name, classify in (("old fnmatch + endswith", legacy),
+                           ("RuleTable (default)", rules_only(default)),
+                           ("RuleTable (regex + size)", rules_only(custom))):
+        results[name] = min(run(name, classify, paths) for _ in range(args.repeat))
+    base = results["old fnmatch + endswith"]
+    for name, elapsed in results.items():
+        print(f"{name:<28} {base / elapsed:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
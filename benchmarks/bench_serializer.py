@@ -0,0 +1,64 @@
+"""
+Message encoding benchmark.
+
+Encodes synthetic camera file events with every available serializer, one
+message per file and in batch envelopes, and reports encode cost and bytes
+per event. Each format is decoded once to check it round-trips.
+
+    python benchmarks/bench_serializer.py --events 100000 --envelope 100
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Serializer import SERIALIZERS, BATCH_PARAM, create_serializer, decode
+
+
+def fake_events(count):
+    now = time.time()
+    watching_dir = "C:\\SFTP_Root\\BatchA"
+    events = []
+    for i in range(count):
+        camera = f"cam{i % 16:02d}"
+        file_path = f"{watching_dir}\\{camera}\\2025-11-{i % 28 + 1:02d}\\001\\jpg\\{i // 60 % 24:02d}\\{i:09d}[M][0@0][0].jpg"
+        events.append((file_path, watching_dir, now + i * 0.001, 180_000 + i % 50_000, now - 5 + i * 0.001))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serializer encode benchmark")
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--envelope", type=int, default=100, help="Files per batch envelope")
+    args = parser.parse_args()
+
+    events = fake_events(args.events)
+    # Envelopes hold one camera folder's files, as grouped by routing key in send_tasks
+    chunks = [events[i:i + args.envelope] for i in range(0, len(events), args.envelope)]
+
+    print(f"{'format':<10}{'mode':<10}{'us/event':>10}{'bytes/event':>13}")
+    for name in sorted(SERIALIZERS):
+        try:
+            serializer = create_serializer(name, "ftp213")
+        except ImportError as e:
+            print(f"{name:<10}skipped: {e}")
+            continue
+
+        start = time.perf_counter()
+        size = sum(len(serializer.encode(*event)) for event in events)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10}{'single':<10}{elapsed / len(events) * 1e6:10.2f}{size / len(events):13.1f}")
+
+        start = time.perf_counter()
+        size = sum(len(serializer.encode_batch(chunk)) for chunk in chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10}{'batch':<10}{elapsed / len(events) * 1e6:10.2f}{size / len(events):13.1f}")
+
+        decoded = decode(serializer.encode_batch(chunks[0]), serializer.content_type + BATCH_PARAM)
+        assert [(e["FilePath"], e["FileSize"]) for e in decoded] == [(e[0], e[3]) for e in chunks[0]], \
+            f"{name} does not round-trip"
+
+
+if __name__ == "__main__":
+    main()
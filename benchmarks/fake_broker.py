@@ -0,0 +1,196 @@
+"""
+In-process stand-in for a RabbitMQ node, for benchmarks.
+
+Implements the slice of pika's BlockingConnection that ConnectionPool and
+RemoteDispatcher_v2 use (channel(), confirm_delivery(), basic_publish(), the
+underlying channel's callback-style confirms and process_data_events()), so
+the real publishing code runs unchanged:
+
+    broker = FakeBroker(confirm_latency=0.001)
+    pool = ConnectionPool(rabbit_dict, connection_factory=broker.connect)
+
+Every publish is confirmed `confirm_latency` seconds later, several at a
+time with the multiple flag like a real broker. Nothing is queued; the
+broker only counts messages, events (x-event-count for envelopes) and bytes.
+set_blocked() plays a resource alarm (connection.blocked / unblocked) and
+passive queue_declare reports `consume_rate` short of what was received.
+"""
+import time
+import threading
+from collections import deque
+import pika
+
+
+class FakeBroker:
+    def __init__(self, confirm_latency=0.001, consume_rate=None):
+        self.confirm_latency = confirm_latency
+        self.consume_rate = consume_rate # Messages/sec taken off each queue (None = all)
+        self.started = time.monotonic()
+        self.blocked = False
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.events = 0
+        self.bytes = 0
+        self.by_routing_key = {}
+        self.open_connections = []
+
+    def connect(self, params=None):
+        connection = FakeConnection(self)
+        with self.lock:
+            self.connections += 1
+            self.open_connections.append(connection)
+        return connection
+
+    def set_blocked(self, blocked, reason='low on memory'):
+        """Sends connection.blocked (or unblocked) to every connection, like a broker alarm."""
+        with self.lock:
+            self.blocked = blocked
+            connections = list(self.open_connections)
+        method = pika.spec.Connection.Blocked(reason=reason) if blocked else pika.spec.Connection.Unblocked()
+        for connection in connections:
+            for callback in connection.blocked_callbacks if blocked else connection.unblocked_callbacks:
+                callback(connection, _Frame(method))
+
+    def queue_depth(self, queue):
+        with self.lock:
+            received = self.by_routing_key.get(queue, 0)
+        if self.consume_rate is None:
+            return 0
+        return max(0, received - int((time.monotonic() - self.started) * self.consume_rate))
+
+    def _receive(self, routing_key, body, properties):
+        events = 1
+        if properties is not None and properties.headers:
+            events = properties.headers.get('x-event-count', 1)
+        with self.lock:
+            self.messages += 1
+            self.events += events
+            self.bytes += len(body)
+            self.by_routing_key[routing_key] = self.by_routing_key.get(routing_key, 0) + events
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'connections': self.connections,
+                'messages': self.messages,
+                'events': self.events,
+                'bytes': self.bytes,
+                'by_routing_key': dict(self.by_routing_key),
+            }
+
+
+class _Frame:
+    __slots__ = ('method',)
+
+    def __init__(self, method):
+        self.method = method
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.channels = []
+        self.blocked_callbacks = []
+        self.unblocked_callbacks = []
+
+    def add_on_connection_blocked_callback(self, callback):
+        self.blocked_callbacks.append(callback)
+
+    def add_on_connection_unblocked_callback(self, callback):
+        self.unblocked_callbacks.append(callback)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self):
+        channel = FakeChannel(self, len(self.channels) + 1)
+        self.channels.append(channel._impl)
+        return channel
+
+    def process_data_events(self, time_limit=0):
+        """Delivers the confirms that are due, waiting up to time_limit for the next one."""
+        if not self._deliver_due() and time_limit:
+            due = [impl.pending[0][0] for impl in self.channels if impl.pending]
+            if due:
+                time.sleep(max(0.0, min(time_limit, min(due) - time.monotonic())))
+                self._deliver_due()
+            else:
+                time.sleep(time_limit)
+
+    def _deliver_due(self):
+        delivered = False
+        now = time.monotonic()
+        for impl in self.channels:
+            last = None
+            while impl.pending and impl.pending[0][0] <= now:
+                last = impl.pending.popleft()[1]
+            if last is not None and impl.on_confirm is not None:
+                impl.on_confirm(_Frame(pika.spec.Basic.Ack(delivery_tag=last, multiple=True)))
+                delivered = True
+        return delivered
+
+    def close(self):
+        self.is_open = False
+        with self.broker.lock:
+            if self in self.broker.open_connections:
+                self.broker.open_connections.remove(self)
+
+
+class FakeChannel:
+    """BlockingChannel surface: basic_publish waits for the confirm."""
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self._impl = _FakeChannelImpl(connection, channel_number)
+
+    @property
+    def is_open(self):
+        return self.connection.is_open
+
+    def confirm_delivery(self):
+        pass
+
+    def queue_declare(self, queue, passive=False, **kwargs):
+        return _Frame(pika.spec.Queue.DeclareOk(queue=queue, message_count=self.connection.broker.queue_depth(queue)))
+
+    def close(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if not self.connection.is_open:
+            raise pika.exceptions.ChannelWrongStateError("channel is closed")
+        self.connection.broker._receive(routing_key, body, properties)
+        time.sleep(self.connection.broker.confirm_latency)
+
+
+class _FakeChannelImpl:
+    """The pika.channel.Channel underneath: confirms arrive through a callback."""
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.channel_number = channel_number
+        self.closed = False
+        self.on_confirm = None
+        self.pending = deque()  # (due, delivery tag), oldest first
+        self.next_tag = 0
+
+    @property
+    def is_open(self):
+        return self.connection.is_open and not self.closed
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+
+    def confirm_delivery(self, ack_nack_callback, callback=None):
+        self.on_confirm = ack_nack_callback
+        if callback is not None:
+            callback(None) # Confirm.SelectOk
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError("channel is closed")
+        self.connection.broker._receive(routing_key, body, properties)
+        self.next_tag += 1
+        self.pending.append((time.monotonic() + self.connection.broker.confirm_latency, self.next_tag))
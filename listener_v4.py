@@ -2,14 +2,33 @@ import sys
 import time
 import os
 import json
+import hashlib
 import argparse
 import logging
 from watchdog.observers import Observer
 from StateManager import StateManager
+from StateStore import JsonStateStore, SqliteStateStore, SharedStateStore
+from FileLedger import FileLedger
 from FolderMonitor import FolderMonitor
 from RemoteDispatcher_v2 import RemoteDispatcher
+from AsyncRemoteDispatcher import AsyncRemoteDispatcher
+from ConnectionPool import ConnectionPool
+from FlowController import FlowController, queue_depth_probe
+from DispatchQueue import DispatchQueue
+from Outbox import Outbox
+from Serializer import SERIALIZERS, create_serializer
+from FileRules import RuleTable
+from DedupCache import DedupCache
+from SettleTracker import SettleTracker
+from EventCoalescer import EventCoalescer
+from Supervisor import Supervisor
+from InotifyObserver import InotifyObserver
+from HotWindow import HotWindow, DEFAULT_PATTERN
+from Metrics import MetricsServer
+from LogSetup import LogSetup
 # Register the signal handler for Ctrl+C and termination signals
 import signal
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,7 +39,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 # Constants from .env
-RABBIT_HOST = os.getenv('RABBIT_HOST', 'localhost')
+RABBIT_HOST = os.getenv('RABBIT_HOST', 'localhost') # comma separated for a cluster: mq1,mq2:5673,mq3
 RABBIT_PORT = int(os.getenv('RABBIT_PORT', 5672))
 RABBIT_USER = os.getenv('RABBIT_USER', 'guest')
 RABBIT_PASS = os.getenv('RABBIT_PASS', 'guest')
@@ -43,24 +62,74 @@ rabbit_dict = {
      'server_id':SERVER_ID
 }
 
-VALID_EXTENSIONS = {'.dav', '.jpg', '.jpeg', '.png'}
+STATS_INTERVAL = 60 # seconds between dispatch queue stat lines
+HEARTBEAT_INTERVAL = 10 # seconds between stats-file writes in supervised workers
+PRUNE_INTERVAL = 300 # seconds between state expiry passes
 
-def initialize_state_manager(root_path):
-    """Generates a unique state file name for the given root path."""
+def open_state_store(backend='json', name='state', flush_every=100, flush_interval=0.2,
+                     checkpoint_interval=0, compact_bytes=4 << 20):
+    """
+    The state store, next to the script, shared by every root this process
+    watches (and with the sqlite backend by every supervised worker too).
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if backend == 'sqlite':
+        state_path = os.path.join(script_dir, f"{name}.db")
+        # Switching from json keeps its state (imported when the database is created)
+        store = SqliteStateStore(state_path, logger, flush_every=flush_every, flush_interval=flush_interval,
+                                 import_json=os.path.join(script_dir, f"{name}.json"))
+    else:
+        state_path = os.path.join(script_dir, f"{name}.json")
+        store = JsonStateStore(state_path, logger, checkpoint_interval=checkpoint_interval,
+                               compact_bytes=compact_bytes)
+    logger.info(f"💾 Using state file: {state_path}")
+    return SharedStateStore(store, logger)
+
+
+def initialize_state_manager(root_path, state_store, ledger_days=0, max_keys=0, checkpoint_interval=0):
+    """Creates the StateManager for one root on the shared state store."""
     
-    # 1. Clean the path string (remove invalid file characters)
-    #    Example: C:\SFTP_Root\BatchA -> C_SFTP_Root_BatchA
+    # 1. Earlier versions kept one file per root, named after the cleaned path
+    #    Example: C:\SFTP_Root\BatchA -> state_C_SFTP_Root_BatchA.json
     sanitized_path = root_path.replace(os.sep, '_').replace(':', '')
-
-    # 2. Define the unique state file name
-    unique_state_file = f"state_{sanitized_path[:50]}.json" 
-    
-    # Ensure the state file is placed in the same directory as the script
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    full_state_path = os.path.join(script_dir, unique_state_file)
+    legacy_path = os.path.join(script_dir, f"state_{sanitized_path[:50]}.json")
     
-    logger.info(f"💾 Using unique state file: {full_state_path}")
-    return StateManager(full_state_path, root_path, logger)
+    ledger = None
+    if ledger_days > 0:
+        # Named after the full root path (the legacy name is truncated, so similar roots collided)
+        root_id = hashlib.blake2b(os.path.normcase(os.path.abspath(root_path)).encode('utf-8', 'surrogateescape'),
+                                  digest_size=8).hexdigest()
+        ledger_path = os.path.join(script_dir, f"ledger_{sanitized_path[:40]}_{root_id}.bin")
+        ledger = FileLedger(ledger_path, logger, window_days=ledger_days, checkpoint_interval=checkpoint_interval)
+
+    # 2. Imported the first time the shared store has nothing for this root;
+    #    a .db was itself imported from the .json, so it is the newer of the two
+    store = state_store.partition(root_path, legacy=(os.path.splitext(legacy_path)[0] + '.db', legacy_path))
+    return StateManager(None, root_path, logger, store=store, ledger=ledger, max_keys=max_keys)
+
+
+def write_stats_file(path, stats):
+    """Heartbeat for the supervisor: atomically replaces the worker's stats JSON."""
+    try:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass # The supervisor may be reading it (Windows); try again next beat
+
+
+def worker_args(parser, args):
+    """Rebuilds the non-default options so supervised workers run with the same settings."""
+    argv = []
+    for action in parser._actions:
+        if action.dest in ('help', 'source_paths', 'processes', 'stats_file'):
+            continue
+        value = getattr(args, action.dest)
+        if value != action.default:
+            argv += [action.option_strings[0], str(value)]
+    return argv
 
 
 # --- MAIN EXECUTION ---
@@ -68,7 +137,102 @@ def initialize_state_manager(root_path):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Dahua RabbitMQ Monitor")
     parser.add_argument("source_paths", nargs='+', help="List of directories to monitor")
+    parser.add_argument("--workers", type=int, default=2, help="Number of publisher workers")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Max files waiting to be published, for live events and for catch-up each")
+    parser.add_argument("--enqueue-timeout", type=float, default=0.0,
+                        help="Seconds a live event may wait for queue space before it queues behind the catch-up backlog")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="Max files a worker publishes per pipelined batch (1 disables batching)")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="Max unconfirmed messages per connection")
+    parser.add_argument("--flush-interval", type=float, default=0.05, help="Seconds between confirm checks")
+    parser.add_argument("--backend", choices=['blocking', 'asyncio'], default='blocking',
+                        help="blocking: one connection per worker; asyncio: one shared multi-channel connection")
+    parser.add_argument("--pool-size", type=int, default=0,
+                        help="Warm connections shared by the workers across all broker nodes (0 = one per worker)")
+    parser.add_argument("--channels", type=int, default=4, help="Channels per connection (asyncio backend)")
+    parser.add_argument("--flow-max-rate", type=float, default=0,
+                        help="Adaptive flow control: ceiling in files/sec; catch-up slows down when the broker "
+                             "lags, blocks or the worker queues fill up (0 = publish as fast as possible)")
+    parser.add_argument("--flow-min-rate", type=float, default=20, help="Flow control: floor in files/sec")
+    parser.add_argument("--flow-target-ms", type=int, default=250,
+                        help="Flow control: back off when the mean publish confirm takes longer than this")
+    parser.add_argument("--flow-queues", default='',
+                        help="Flow control: comma separated worker queues whose depth is polled (passive declare)")
+    parser.add_argument("--flow-max-depth", type=int, default=50000,
+                        help="Flow control: back off while any --flow-queues queue holds more messages than this")
+    parser.add_argument("--serializer", choices=sorted(SERIALIZERS), default='json',
+                        help="Message encoding (json keeps the original payload)")
+    parser.add_argument("--envelope", type=int, default=1,
+                        help="Files packed into one message per routing key (1 = one message per file)")
+    parser.add_argument("--scan-threads", type=int, default=8, help="Directory scanning threads for catch-up")
+    parser.add_argument("--startup", choices=['concurrent', 'sequential'], default='concurrent',
+                        help="concurrent: start watching first and catch up in the background; "
+                             "sequential: finish catch-up for every root before watching")
+    parser.add_argument("--state-backend", choices=['json', 'sqlite'], default='json',
+                        help="One state file for all roots. json: state.json plus a checkpoint journal; "
+                             "sqlite: state.db, a WAL database committed continuously (always used with --processes, "
+                             "whose workers share it)")
+    parser.add_argument("--state-checkpoint-s", type=float, default=5.0,
+                        help="Seconds between journal checkpoints of changed folders (json backend) and of the ledger "
+                             "(0 = save on exit only)")
+    parser.add_argument("--state-compact-mb", type=float, default=4.0,
+                        help="json backend: fold the journal into a fresh snapshot once it reaches this size")
+    parser.add_argument("--state-flush-every", type=int, default=100,
+                        help="sqlite backend: commit once this many updates are pending")
+    parser.add_argument("--state-flush-ms", type=int, default=200,
+                        help="sqlite backend: max milliseconds an update stays uncommitted")
+    parser.add_argument("--state-keep-days", type=int, default=7,
+                        help="Forget folders whose watermark is older than this many days (checked every 5 minutes)")
+    parser.add_argument("--state-max-dirs", type=int, default=0,
+                        help="Hard cap on folders tracked per root; the oldest are evicted beyond it (0 = no cap)")
+    parser.add_argument("--ledger-days", type=int, default=0,
+                        help="Track every published file for this many days of mtimes (0 = watermark only)")
+    parser.add_argument("--settle-seconds", type=float, default=2.0,
+                        help="Quiet period before a directly written file is dispatched (0 = dispatch on create)")
+    parser.add_argument("--coalesce-ms", type=int, default=200,
+                        help="Window for merging events on the same path into one publish (0 = off)")
+    parser.add_argument("--dedup-ttl", type=float, default=1800,
+                        help="Seconds a dispatched file is remembered to suppress duplicate publishes")
+    parser.add_argument("--outbox", default=None,
+                        help="Directory for a durable on-disk outbox; files are logged there before publishing")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics on 127.0.0.1:PORT (0 = off; supervised workers use PORT+1+index)")
+    parser.add_argument("--log-mode", choices=['sync', 'async'], default='sync',
+                        help="async writes log lines from a background thread instead of the event thread")
+    parser.add_argument("--log-format", choices=['text', 'json'], default='text', help="Log line format")
+    parser.add_argument("--log-rate", type=float, default=0,
+                        help="Max INFO lines per second per message (e.g. per-file lines); the rest are summarized (0 = all)")
+    parser.add_argument("--observer", choices=['watchdog', 'inotify'], default='watchdog',
+                        help="inotify: native Linux backend with lazy watches and overflow rescans")
+    parser.add_argument("--watch-days", type=int, default=0,
+                        help="inotify: only watch existing directories modified in the last N days (0 = all)")
+    parser.add_argument("--hot-pattern", nargs='?', const=DEFAULT_PATTERN, default=None,
+                        help="Only watch/scan date partitions (whole dir names matching this regex with y/m/d groups; "
+                             "no value = dates like 2025-11-14) from the last --hot-days days")
+    parser.add_argument("--hot-depth", type=int, default=None,
+                        help="Only watch/scan the directories N levels down modified in the last --hot-days days")
+    parser.add_argument("--hot-days", type=int, default=2, help="Size of the hot window in days (2 = today and yesterday)")
+    parser.add_argument("--hot-refresh", type=int, default=300,
+                        help="Seconds between hot window refreshes (new directories are promoted immediately)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Shard the roots across this many supervised worker processes")
+    parser.add_argument("--stats-file", default=None, help=argparse.SUPPRESS) # set by the supervisor
     args = parser.parse_args()
+    log_setup = LogSetup(args.log_mode, args.log_format, args.log_rate, summary_interval=STATS_INTERVAL).start()
+
+    # Which files are published, and where: FILE_RULES in .env, else .dav -> video, images -> image
+    try:
+        rules = RuleTable.from_env(rabbit_dict)
+    except ValueError as e:
+        parser.error(str(e))
+    logger.info(f"📐 File rules: {rules.describe()}")
+
+    if args.flow_max_rate > 0 and args.flow_min_rate <= 0:
+        parser.error("--flow-min-rate must be positive")
+
+    hot_mode = args.hot_pattern is not None or args.hot_depth is not None
+    if hot_mode and args.observer == 'inotify':
+        parser.error("the hot window needs the watchdog observer; use --watch-days with --observer inotify")
 
     # Validate paths
     for path in args.source_paths:
@@ -76,11 +240,88 @@ if __name__ == "__main__":
             logger.error(f"❌ Path does not exist: {path}")
             sys.exit(1)
 
+    # --- 0. SUPERVISOR MODE: one worker process per shard of roots ---
+    if args.processes > 1 and len(args.source_paths) > 1:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        supervisor = Supervisor(
+            Supervisor.shard_roots(args.source_paths, args.processes),
+            worker_args(parser, args),
+            stats_dir=os.path.join(script_dir, 'worker_stats'),
+            stats_interval=STATS_INTERVAL,
+            metrics_port=args.metrics_port
+        )
+        supervisor.run()
+        log_setup.stop()
+        sys.exit(0)
+
     # --- 1. INITIALIZE GLOBALS BEFORE LOGIC ---
     # We init these here so 'graceful_exit' can see them
-    dispatcher = RemoteDispatcher(rabbit_dict)
-    observer = Observer()
+    pool = None
+    probe_pool = None
+    flow = None
+    if args.flow_max_rate > 0:
+        flow = FlowController(max_rate=args.flow_max_rate, min_rate=args.flow_min_rate,
+                              target_latency=args.flow_target_ms / 1000, max_depth=args.flow_max_depth)
+    serializer = create_serializer(args.serializer, rabbit_dict['server_id'])
+    if args.backend == 'asyncio':
+        # One event-loop connection shared by all workers; connects in the background
+        shared_dispatcher = AsyncRemoteDispatcher(rabbit_dict, num_channels=args.channels, serializer=serializer,
+                                                  rules=rules, flow=flow)
+        dispatcher_factory = lambda: shared_dispatcher
+    elif args.pool_size > 0:
+        # Workers lease connections from one pool spread over the cluster nodes
+        pool = ConnectionPool(rabbit_dict, size=args.pool_size, flow=flow)
+        pool.start()
+        dispatcher_factory = lambda: RemoteDispatcher(
+            rabbit_dict, max_in_flight=args.max_in_flight, flush_interval=args.flush_interval, pool=pool,
+            serializer=create_serializer(args.serializer, rabbit_dict['server_id']), envelope_size=args.envelope,
+            rules=rules, flow=flow
+        )
+    else:
+        # Each publisher worker opens its own connection on first use
+        dispatcher_factory = lambda: RemoteDispatcher(
+            rabbit_dict, max_in_flight=args.max_in_flight, flush_interval=args.flush_interval,
+            serializer=create_serializer(args.serializer, rabbit_dict['server_id']), envelope_size=args.envelope,
+            rules=rules, flow=flow
+        )
+    if flow is not None:
+        queues = [name.strip() for name in args.flow_queues.split(',') if name.strip()]
+        if queues:
+            # Passive declares borrow a pooled connection, or a dedicated one without a shared pool
+            if pool is None:
+                probe_pool = ConnectionPool(rabbit_dict, size=1, flow=flow)
+            flow.depth_probe = queue_depth_probe(pool or probe_pool, queues)
+        flow.start()
+
+    dedup = DedupCache(ttl=args.dedup_ttl)
+    settle = SettleTracker(quiet_period=args.settle_seconds) if args.settle_seconds > 0 else None
+    coalescer = EventCoalescer(window=args.coalesce_ms / 1000) if args.coalesce_ms > 0 else None
+    if args.outbox:
+        outbox_dir = args.outbox
+        if args.stats_file:
+            # Supervised workers each own a sub-outbox, stable across restarts
+            outbox_dir = os.path.join(outbox_dir, os.path.splitext(os.path.basename(args.stats_file))[0])
+        # Same submit() contract as DispatchQueue; one drainer publishes from disk
+        dispatch_queue = Outbox(outbox_dir, dispatcher_factory, batch_size=max(args.batch_size, 1), dedup=dedup,
+                                flow=flow)
+    else:
+        dispatch_queue = DispatchQueue(
+            dispatcher_factory,
+            num_workers=args.workers,
+            max_size=args.queue_size,
+            enqueue_timeout=args.enqueue_timeout,
+            batch_size=args.batch_size,
+            dedup=dedup,
+            rules=rules,
+            flow=flow
+        )
+    if args.observer == 'inotify':
+        observer = InotifyObserver(watch_days=args.watch_days)
+    else:
+        observer = Observer()
     active_managers = []
+    state_store = None
+    hot_windows = []
 
     # --- 2. DEFINE EXIT HANDLER EARLY ---
     # This must be defined BEFORE we start doing work
@@ -94,6 +335,28 @@ if __name__ == "__main__":
                 observer.join()
         except Exception as e:
             logger.error(f"Error stopping observer: {e}")
+
+        for hot_window in hot_windows:
+            hot_window.stop()
+
+        # Files still settling are left for the next catch-up scan
+        if settle is not None:
+            settle.stop()
+        if coalescer is not None:
+            coalescer.stop()
+
+        # Drain pending publishes (also closes worker connections)
+        if flow is not None:
+            flow.stop() # Shutdown drains at full speed
+        try:
+            dispatch_queue.stop(timeout=10)
+            dispatch_queue.log_stats()
+        except Exception as e:
+            logger.error(f"Error stopping dispatch queue: {e}")
+        if pool is not None:
+            pool.close()
+        if probe_pool is not None:
+            probe_pool.close()
         
         # Save all states
         if active_managers:
@@ -102,46 +365,134 @@ if __name__ == "__main__":
                     mgr.flush_state_to_disk()
                 except Exception as e:
                     logger.error(f"Error saving state: {e}")
+        if state_store is not None:
+            try:
+                state_store.close()
+            except Exception as e:
+                logger.error(f"Error saving state: {e}")
         
-        # Close connection
-        try:
-            dispatcher.close()
-        except Exception:
-            pass
-            
         logger.info("👋 Exited.")
+        log_setup.stop()
         sys.exit(0)
 
     # --- 3. REGISTER SIGNALS ---
     signal.signal(signal.SIGINT, graceful_exit)
     signal.signal(signal.SIGTERM, graceful_exit)
+    if hasattr(signal, 'SIGBREAK'):
+        # Windows: the supervisor stops workers with CTRL_BREAK_EVENT
+        signal.signal(signal.SIGBREAK, graceful_exit)
 
     # --- 4. START LOGIC (Try Block) ---
     try:
+        if args.metrics_port:
+            MetricsServer(args.metrics_port).start()
+        dispatch_queue.start()
+        if settle is not None:
+            settle.start()
+        if coalescer is not None:
+            coalescer.start()
+
+        # One store for all roots, whichever worker watches them
+        state_backend = args.state_backend
+        if args.stats_file and state_backend == 'json':
+            # Supervised workers share the store, and only SQLite can be written by several processes
+            logger.info("💾 Supervised worker: using the sqlite state backend")
+            state_backend = 'sqlite'
+        state_store = open_state_store(
+            state_backend,
+            flush_every=args.state_flush_every,
+            flush_interval=args.state_flush_ms / 1000,
+            checkpoint_interval=args.state_checkpoint_s,
+            compact_bytes=int(args.state_compact_mb * (1 << 20))
+        )
+        monitors = []
         for source_path in args.source_paths:
             logger.info(f"🔧 Setting up monitor for: {source_path}")
 
             # A. Create State Manager
-            state_mgr = initialize_state_manager(source_path)
-            state_mgr.prune_old_keys(days_to_keep=7)
+            state_mgr = initialize_state_manager(source_path, state_store, ledger_days=args.ledger_days,
+                                                 max_keys=args.state_max_dirs,
+                                                 checkpoint_interval=args.state_checkpoint_s)
+            state_mgr.prune_old_keys(days_to_keep=args.state_keep_days)
             active_managers.append(state_mgr) 
+            if args.outbox:
+                dispatch_queue.register(source_path, state_mgr)
 
             # B. Create Monitor
-            monitor = FolderMonitor(state_mgr, dispatcher, VALID_EXTENSIONS,logger, source_path)
-
-            # C. Run Catch-up 
-            # (If you Ctrl+C here now, graceful_exit IS defined, so it works!)
-            monitor.run_catchup_scan(source_path)
+            monitor = FolderMonitor(state_mgr, None, rules, logger, source_path,
+                                    dispatch_queue=dispatch_queue, dedup=dedup, settle=settle,
+                                    coalescer=coalescer)
+            scan_kwargs = {}
+            if hot_mode:
+                # Watch only the hot partitions; catch-up scans only those too
+                hot_window = HotWindow(source_path, monitor, observer, pattern=args.hot_pattern,
+                                       depth=args.hot_depth, days=args.hot_days,
+                                       refresh_interval=args.hot_refresh)
+                hot_window.start()
+                hot_windows.append(hot_window)
+                scan_kwargs = {'paths': hot_window.hot_paths(), 'flat_paths': hot_window.structural_paths()}
+            monitors.append((monitor, source_path, scan_kwargs))
+
+            if args.startup == 'sequential':
+                # C. Run Catch-up 
+                # (If you Ctrl+C here now, graceful_exit IS defined, so it works!)
+                monitor.run_catchup_scan(source_path, num_threads=args.scan_threads, **scan_kwargs)
+            else:
+                # Catch-up compares against the watermarks as they were before live events
+                state_mgr.freeze_baseline()
 
             # D. Schedule Observer
-            observer.schedule(monitor, path=source_path, recursive=True)
+            if not hot_mode:
+                observer.schedule(monitor, path=source_path, recursive=True)
 
         # Start the master observer
         observer.start()
         logger.info(f"👀 Monitoring active on {len(args.source_paths)} directories.")
 
+        if args.startup == 'concurrent':
+            # E. Catch up every root in parallel while live events flow
+            for monitor, source_path, scan_kwargs in monitors:
+                threading.Thread(
+                    target=monitor.run_catchup_scan,
+                    args=(source_path,),
+                    kwargs=dict(scan_kwargs, num_threads=args.scan_threads),
+                    name=f"catchup-{os.path.basename(source_path)}",
+                    daemon=True
+                ).start()
+
+        last_stats = time.monotonic()
+        last_prune = time.monotonic()
+        last_heartbeat = 0
         while True:
             time.sleep(1)
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                # Only the expired folders are touched, so this stays cheap on a large state
+                for mgr in active_managers:
+                    mgr.prune_old_keys(days_to_keep=args.state_keep_days)
+                last_prune = time.monotonic()
+            if args.stats_file and time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                stats = dispatch_queue.get_stats()
+                if coalescer is not None:
+                    stats.update(coalescer.get_stats())
+                if pool is not None:
+                    stats.update(pool.get_stats())
+                if flow is not None:
+                    stats.update(flow.get_stats())
+                if args.observer == 'inotify':
+                    stats.update(observer.get_stats())
+                write_stats_file(args.stats_file, stats)
+                last_heartbeat = time.monotonic()
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                dispatch_queue.log_stats()
+                if coalescer is not None:
+                    coalescer.log_stats()
+                if pool is not None:
+                    logger.info(f"📊 Pool {pool.get_stats()}")
+                if flow is not None:
+                    logger.info(f"📊 Flow {flow.get_stats()}")
+                if args.observer == 'inotify':
+                    logger.info(f"📊 inotify {observer.get_stats()}")
+                last_stats = time.monotonic()
 
     except KeyboardInterrupt:
         # Now this will work because the function is defined above
@@ -0,0 +1,98 @@
+"""
+Batch publisher confirms in RemoteDispatcher_v2, against the in-process FakeBroker.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import pika
+from fake_broker import FakeBroker
+from ConnectionPool import ConnectionPool
+from RemoteDispatcher_v2 import RemoteDispatcher
+from FileEvent import FileEvent
+
+RABBIT = {'host': 'fake', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'vhost': '/', 'exchange': 'test',
+          'server_id': 'test', 'routing_key_vid': 'test.video', 'routing_key_img': 'test.image'}
+
+
+class ConfirmTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.files = []
+        for i in range(20):
+            path = os.path.join(self.tmp, f"img_{i:03d}.jpg")
+            with open(path, 'wb') as f:
+                f.write(b'x' * 16)
+            self.files.append(path)
+        self.broker = FakeBroker(confirm_latency=0.001)
+        self.pool = ConnectionPool(RABBIT, size=1, connection_factory=self.broker.connect)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp)
+
+    def dispatcher(self, **kwargs):
+        return RemoteDispatcher(RABBIT, pool=self.pool, flush_interval=0.01, **kwargs)
+
+    def tasks(self):
+        return [(FileEvent.stat(path), self.tmp) for path in self.files]
+
+    def test_all_confirmed(self):
+        results = self.dispatcher().send_tasks(self.tasks())
+        self.assertEqual(len(results), len(self.files))
+        self.assertTrue(all(success for _, _, success in results))
+        self.assertEqual(self.broker.get_stats()['messages'], len(self.files))
+
+    def test_timeout_fails_batch_and_recovers(self):
+        dispatcher = self.dispatcher(confirm_timeout=0.2)
+        self.broker.confirm_latency = 60
+        results = dispatcher.send_tasks(self.tasks())
+        self.assertEqual(len(results), len(self.files))
+        self.assertFalse(any(success for _, _, success in results))
+
+        # The abandoned channel is closed, not handed back with the lease
+        lease = self.pool.acquire()
+        try:
+            self.assertIsNone(lease.batch_channel)
+            abandoned = lease.connection.channels[-1]
+            self.assertFalse(abandoned.is_open)
+        finally:
+            self.pool.release(lease)
+
+        self.broker.confirm_latency = 0.001
+        results = dispatcher.send_tasks(self.tasks())
+        self.assertTrue(all(success for _, _, success in results))
+
+    def test_late_confirm_from_abandoned_channel_is_ignored(self):
+        dispatcher = self.dispatcher(confirm_timeout=0.2)
+        self.broker.confirm_latency = 60
+        dispatcher.send_tasks(self.tasks()[:5])
+        abandoned = self.pool.acquire()
+        old_number = abandoned.connection.channels[-1].channel_number
+        self.pool.release(abandoned)
+
+        # The next batch sits unconfirmed on a new channel whose tags restart at 1
+        dispatcher._checkout()
+        dispatcher._ensure_batch_channel(lambda *result: None)
+        for path, watching_dir in self.tasks()[:3]:
+            dispatcher._next_tag += 1
+            dispatcher._pending[dispatcher._next_tag] = ([(path, watching_dir)], 0.0)
+        late = pika.spec.Basic.Ack(delivery_tag=5, multiple=True)
+        dispatcher._lease.dispatch_confirm(type('Frame', (), {'method': late})(), old_number)
+        self.assertEqual(len(dispatcher._pending), 3)
+        self.assertEqual(dispatcher._confirmed, [])
+
+        current = dispatcher.batch_channel.channel_number
+        dispatcher._lease.dispatch_confirm(type('Frame', (), {'method': late})(), current)
+        self.assertEqual(len(dispatcher._pending), 0)
+        dispatcher._checkin()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+DispatchQueue publishing to the in-process FakeBroker, and its shutdown.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_broker import FakeBroker
+from ConnectionPool import ConnectionPool
+from RemoteDispatcher_v2 import RemoteDispatcher
+from DispatchQueue import DispatchQueue
+from FileEvent import FileEvent
+
+RABBIT = {'host': 'fake', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'vhost': '/', 'exchange': 'test',
+          'server_id': 'test', 'routing_key_vid': 'test.video', 'routing_key_img': 'test.image'}
+
+
+class RecordingState:
+    """The update_state() side of a StateManager."""
+    def __init__(self):
+        self.updated = {}
+
+    def update_state(self, path, mtime, size=None):
+        self.updated[path] = mtime
+
+
+class DispatchQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.events = []
+        for i in range(100):
+            path = os.path.join(self.tmp, f"img_{i:03d}.jpg")
+            with open(path, 'wb') as f:
+                f.write(b'x' * 16)
+            self.events.append(FileEvent.stat(path))
+        self.broker = FakeBroker(confirm_latency=0.001)
+        self.pool = ConnectionPool(RABBIT, size=2, connection_factory=self.broker.connect)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp)
+
+    def dispatcher(self):
+        return RemoteDispatcher(RABBIT, pool=self.pool, flush_interval=0.01)
+
+    def test_publishes_and_updates_state(self):
+        state = RecordingState()
+        queue = DispatchQueue(self.dispatcher, num_workers=2, batch_size=20)
+        queue.start()
+        for event in self.events:
+            self.assertTrue(queue.submit(event, self.tmp, state, block=True))
+        queue.stop()
+        self.assertEqual(queue.dispatched, len(self.events))
+        self.assertEqual(self.broker.get_stats()['messages'], len(self.events))
+        self.assertEqual(set(state.updated), {event.path for event in self.events})
+        # Every worker checked its connection back in on exit
+        self.assertEqual(self.pool.get_stats()['pool_idle'], self.pool.get_stats()['pool_connections'])
+
+    def test_rejects_submissions_once_stopping(self):
+        queue = DispatchQueue(self.dispatcher, num_workers=1)
+        queue.start()
+        queue.stop(timeout=5)
+        self.assertFalse(queue.submit(self.events[0], self.tmp, RecordingState()))
+        self.assertEqual(queue.queue.qsize(), 0)
+        self.assertEqual(queue.enqueued, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
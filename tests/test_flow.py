@@ -0,0 +1,102 @@
+"""
+FlowController AIMD and its broker feedback, using the in-process FakeBroker.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_broker import FakeBroker
+from ConnectionPool import ConnectionPool
+from FlowController import FlowController, queue_depth_probe
+
+RABBIT = {'host': 'fake', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'vhost': '/', 'exchange': 'test',
+          'server_id': 'test', 'routing_key_vid': 'test.video', 'routing_key_img': 'test.image'}
+
+
+class FlowControllerTest(unittest.TestCase):
+    def flow(self, **kwargs):
+        # Adjusted by hand: the tests call _adjust() instead of start()
+        return FlowController(max_rate=1000, min_rate=10, initial_rate=100, target_latency=0.1, increase=50,
+                              **kwargs)
+
+    def test_additive_increase_only_when_limited(self):
+        flow = self.flow()
+        flow._adjust()
+        self.assertEqual(flow.rate, 100) # Nobody waited on the bucket
+        flow._limited = True
+        flow._adjust()
+        self.assertEqual(flow.rate, 150)
+        for _ in range(100):
+            flow._limited = True
+            flow._adjust()
+        self.assertEqual(flow.rate, 1000)
+
+    def test_multiplicative_decrease_on_latency(self):
+        flow = self.flow()
+        flow.observe_confirm(0.5)
+        flow.observe_confirm(0.3)
+        flow._adjust()
+        self.assertEqual(flow.rate, 50)
+        for _ in range(20):
+            flow.observe_confirm(1.0)
+            flow._adjust()
+        self.assertEqual(flow.rate, 10)
+        # Latency samples are per interval
+        flow._limited = True
+        flow._adjust()
+        self.assertEqual(flow.rate, 60)
+
+    def test_decrease_on_queue_depth(self):
+        flow = self.flow(max_depth=100)
+        flow.depth = 500
+        flow._adjust()
+        self.assertEqual(flow.rate, 50)
+
+    def test_live_never_waits_backlog_does(self):
+        flow = self.flow(burst_seconds=0.5)
+        self.assertEqual(flow.acquire(1000, wait=False), 0.0)
+        # Debt is capped at one burst
+        self.assertEqual(flow.tokens, -50)
+        waited = flow.acquire(1)
+        self.assertGreater(waited, 0.3)
+
+    def test_blocked_holds_backlog_until_unblocked(self):
+        broker = FakeBroker()
+        flow = self.flow()
+        pool = ConnectionPool(RABBIT, size=1, connection_factory=broker.connect, flow=flow)
+        try:
+            pool.release(pool.acquire())
+            broker.set_blocked(True)
+            self.assertTrue(flow.blocked)
+            self.assertEqual(flow.rate, 10)
+            self.assertEqual(flow.acquire(5, wait=False), 0.0) # Live still goes
+
+            done = threading.Event()
+            threading.Thread(target=lambda: (flow.acquire(1), done.set()), daemon=True).start()
+            self.assertFalse(done.wait(0.2))
+            broker.set_blocked(False)
+            self.assertTrue(done.wait(5))
+        finally:
+            pool.close()
+
+    def test_depth_probe(self):
+        broker = FakeBroker(consume_rate=0)
+        pool = ConnectionPool(RABBIT, size=1, connection_factory=broker.connect)
+        try:
+            lease = pool.acquire()
+            channel = lease.connection.channel()
+            for _ in range(7):
+                channel.basic_publish('test', 'test.video', b'x')
+            pool.release(lease)
+            self.assertEqual(queue_depth_probe(pool, ['test.video', 'test.image'])(), 7)
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
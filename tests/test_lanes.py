@@ -0,0 +1,77 @@
+"""
+LaneQueue ordering: live ahead of backlog, weighted share between lanes.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import queue
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DispatchQueue import LaneQueue
+from FileRules import DEFAULT_LANE
+
+
+class LaneQueueTest(unittest.TestCase):
+    def test_live_before_backlog(self):
+        lanes = LaneQueue({DEFAULT_LANE: 1, 'video': 1})
+        for i in range(5):
+            lanes.put(DEFAULT_LANE, ('backlog', i), live=False)
+        lanes.put('video', ('live', 0), live=True)
+        lanes.put(DEFAULT_LANE, ('live', 1), live=True)
+
+        seen = []
+        while lanes.qsize():
+            _, live, batch = lanes.get_batch(2)
+            seen.extend((live, item) for item in batch)
+        self.assertEqual([live for live, _ in seen[:2]], [True, True])
+        self.assertFalse(any(live for live, _ in seen[2:]))
+        # FIFO within a lane
+        self.assertEqual([item for _, item in seen[2:]], [('backlog', i) for i in range(5)])
+
+    def test_weighted_share(self):
+        lanes = LaneQueue({'video': 3, DEFAULT_LANE: 1})
+        for i in range(400):
+            lanes.put('video', i, live=False)
+            lanes.put(DEFAULT_LANE, i, live=False)
+
+        counts = {'video': 0, DEFAULT_LANE: 0}
+        for _ in range(40):
+            lane, _, batch = lanes.get_batch(10)
+            counts[lane] += len(batch)
+        self.assertEqual(counts['video'], 3 * counts[DEFAULT_LANE])
+
+    def test_idle_lane_banks_no_credit(self):
+        lanes = LaneQueue({'video': 1, DEFAULT_LANE: 1})
+        for i in range(100):
+            lanes.put(DEFAULT_LANE, i, live=False)
+        for _ in range(4):
+            lanes.get_batch(10)
+        # video was idle meanwhile: it starts at the current virtual time, one batch behind
+        # the default lane, instead of at 0 with the whole backlog as credit
+        for i in range(50):
+            lanes.put('video', i, live=False)
+        order = [lanes.get_batch(5)[0] for _ in range(8)]
+        self.assertEqual(order.count('video'), 5)
+        self.assertEqual(order.count(DEFAULT_LANE), 3)
+
+    def test_unknown_lane_uses_default(self):
+        lanes = LaneQueue({DEFAULT_LANE: 1})
+        lanes.put('nope', 'x', live=True)
+        self.assertEqual(lanes.get_batch(1), (DEFAULT_LANE, True, ['x']))
+
+    def test_classes_bounded_separately(self):
+        lanes = LaneQueue({DEFAULT_LANE: 1}, max_size=2)
+        lanes.put(DEFAULT_LANE, 1, live=False)
+        lanes.put(DEFAULT_LANE, 2, live=False)
+        with self.assertRaises(queue.Full):
+            lanes.put(DEFAULT_LANE, 3, live=False, block=False)
+        # A full backlog never blocks live events
+        lanes.put(DEFAULT_LANE, 4, live=True, block=False)
+        with self.assertRaises(queue.Empty):
+            LaneQueue({DEFAULT_LANE: 1}).get_batch(1, timeout=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
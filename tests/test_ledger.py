@@ -0,0 +1,100 @@
+"""
+FileLedger window expiry, journal replay and crash gaps.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from FileLedger import FileLedger, DAY, MIN_BLOOM_BITS
+
+logger = logging.getLogger(__name__)
+
+
+class FileLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'ledger.bin')
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def ledger(self, **kwargs):
+        ledger = FileLedger(self.path, logger, window_days=3, **kwargs)
+        ledger.start_time = 0 # Cover the whole window, not just from now on
+        return ledger
+
+    def test_expire_drops_old_days(self):
+        ledger = self.ledger()
+        ledger.add('new.jpg', 1, self.now - 60)
+        ledger.add('old.jpg', 1, self.now - 2.5 * DAY)
+        self.assertEqual(len(ledger.buckets), 2)
+        self.assertTrue(ledger.contains('old.jpg', 1, self.now - 2.5 * DAY))
+
+        ledger.window_days = 1
+        self.assertEqual(ledger.expire(), 1)
+        self.assertFalse(ledger.contains('old.jpg', 1, self.now - 2.5 * DAY))
+        self.assertTrue(ledger.contains('new.jpg', 1, self.now - 60))
+        # Outside the window the watermark decides, and nothing is added
+        self.assertFalse(ledger.covers(self.now - 2.5 * DAY))
+        ledger.add('old.jpg', 1, self.now - 2.5 * DAY)
+        self.assertFalse(ledger.contains('old.jpg', 1, self.now - 2.5 * DAY))
+
+    def test_expire_drops_gaps(self):
+        ledger = self.ledger()
+        ledger.gaps = [[self.now - 2.5 * DAY, self.now - 2.4 * DAY], [self.now - 60, self.now - 30]]
+        ledger.window_days = 1
+        ledger.expire()
+        self.assertEqual(ledger.gaps, [[self.now - 60, self.now - 30]])
+        self.assertFalse(ledger.covers(self.now - 45))
+
+    def test_clean_close_round_trip(self):
+        ledger = self.ledger()
+        for i in range(1000):
+            ledger.add(f"{i}.jpg", i, self.now - i)
+        ledger.close()
+
+        loaded = FileLedger(self.path, logger, window_days=3)
+        self.assertEqual(len(loaded), 1000)
+        self.assertEqual(loaded.gaps, [])
+        self.assertTrue(all(loaded.contains(f"{i}.jpg", i, self.now - i) for i in range(1000)))
+
+    def test_crash_replays_journal_and_records_gap(self):
+        ledger = self.ledger(checkpoint_interval=60)
+        ledger.save()
+        ledger.add('a.jpg', 1, self.now - 60)
+        self.assertEqual(ledger.checkpoint(), 1)
+        # Confirmed after the last checkpoint, then killed
+        after_checkpoint = time.time()
+        ledger.add('b.jpg', 1, after_checkpoint)
+        time.sleep(0.01)
+
+        loaded = FileLedger(self.path, logger, window_days=3)
+        self.assertTrue(loaded.contains('a.jpg', 1, self.now - 60))
+        self.assertFalse(loaded.contains('b.jpg', 1, after_checkpoint))
+        self.assertEqual(len(loaded.gaps), 1)
+        # Files modified since the last checkpoint fall back to the watermark
+        self.assertFalse(loaded.covers(after_checkpoint))
+        self.assertTrue(loaded.covers(self.now - 60))
+
+    def test_bloom_grows_with_the_day(self):
+        ledger = self.ledger(bloom_bits_per_key=10)
+        ledger.add('quiet.jpg', 1, self.now - 2 * DAY)
+        for i in range(5000):
+            ledger.add(f"{i}.jpg", i, self.now - 60)
+        quiet = ledger.buckets[int((self.now - 2 * DAY) // DAY)]
+        busy = ledger.buckets[int((self.now - 60) // DAY)]
+        self.assertEqual(quiet.bloom_bits, MIN_BLOOM_BITS)
+        self.assertGreaterEqual(busy.bloom_bits, 5000 * 10)
+        self.assertTrue(all(ledger.contains(f"{i}.jpg", i, self.now - 60) for i in range(5000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
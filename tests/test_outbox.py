@@ -0,0 +1,164 @@
+"""
+Outbox crash recovery and failure handling, publishing to the in-process FakeBroker.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_broker import FakeBroker
+from ConnectionPool import ConnectionPool
+from RemoteDispatcher_v2 import RemoteDispatcher
+from FileEvent import FileEvent
+from Outbox import Outbox
+
+RABBIT = {'host': 'fake', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'vhost': '/', 'exchange': 'test',
+          'server_id': 'test', 'routing_key_vid': 'test.video', 'routing_key_img': 'test.image'}
+
+
+class RecordingState:
+    """The update_state() side of a StateManager."""
+    def __init__(self):
+        self.updated = {}
+
+    def update_state(self, path, mtime, size=None):
+        self.updated[path] = mtime
+
+
+class FailingDispatcher:
+    def __init__(self):
+        self.closed = False
+
+    def send_tasks(self, tasks, on_result=None):
+        raise ConnectionError("broker down")
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.watch_dir = os.path.join(self.tmp, 'watch')
+        self.outbox_dir = os.path.join(self.tmp, 'outbox')
+        os.makedirs(self.watch_dir)
+        self.files = []
+        for i in range(50):
+            path = os.path.join(self.watch_dir, f"img_{i:03d}.jpg")
+            with open(path, 'wb') as f:
+                f.write(b'x' * 16)
+            self.files.append(path)
+        self.broker = FakeBroker(confirm_latency=0.001)
+        self.pool = ConnectionPool(RABBIT, size=1, connection_factory=self.broker.connect)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp)
+
+    def dispatcher(self):
+        return RemoteDispatcher(RABBIT, pool=self.pool, flush_interval=0.01)
+
+    def test_replays_after_crash(self):
+        state = RecordingState()
+        outbox = Outbox(self.outbox_dir, self.dispatcher, segment_size=4096, batch_size=10)
+        for path in self.files:
+            self.assertTrue(outbox.submit(FileEvent.stat(path), self.watch_dir, state))
+        # Crash: nothing was drained, the log only reached the page cache
+        outbox._write_map.flush()
+        self.assertEqual(self.broker.get_stats()['messages'], 0)
+
+        restarted = Outbox(self.outbox_dir, self.dispatcher, segment_size=4096, batch_size=10)
+        self.assertEqual(restarted.pending_bytes(), outbox.pending_bytes())
+        state = RecordingState()
+        restarted.register(self.watch_dir, state)
+        restarted.start()
+        try:
+            self.assertTrue(wait_for(lambda: restarted.pending_bytes() == 0))
+        finally:
+            restarted.stop()
+        self.assertEqual(self.broker.get_stats()['messages'], len(self.files))
+        self.assertEqual(set(state.updated), set(self.files))
+        # Consumed segments are gone
+        self.assertEqual(len(restarted._segments()), 1)
+
+    def test_restart_resumes_at_cursor(self):
+        state = RecordingState()
+        outbox = Outbox(self.outbox_dir, self.dispatcher, segment_size=4096, batch_size=10)
+        for path in self.files[:20]:
+            outbox.submit(FileEvent.stat(path), self.watch_dir, state)
+        outbox.start()
+        self.assertTrue(wait_for(lambda: outbox.pending_bytes() == 0))
+        outbox.stop()
+        for path in self.files[20:]:
+            outbox.submit(FileEvent.stat(path), self.watch_dir, state)
+        outbox._write_map.flush()
+
+        restarted = Outbox(self.outbox_dir, self.dispatcher, segment_size=4096, batch_size=10)
+        restarted.register(self.watch_dir, state)
+        restarted.start()
+        try:
+            self.assertTrue(wait_for(lambda: restarted.pending_bytes() == 0))
+        finally:
+            restarted.stop()
+        # Nothing published twice
+        self.assertEqual(self.broker.get_stats()['messages'], len(self.files))
+
+    def test_orphans_wait_for_register(self):
+        state = RecordingState()
+        outbox = Outbox(self.outbox_dir, self.dispatcher, batch_size=10)
+        for path in self.files[:5]:
+            outbox.submit(FileEvent.stat(path), self.watch_dir, state)
+        outbox.managers.clear() # As after a restart, before the root is set up
+        outbox.start()
+        try:
+            self.assertTrue(wait_for(lambda: outbox.pending_bytes() == 0))
+            self.assertEqual(state.updated, {})
+            outbox.register(self.watch_dir, state)
+            self.assertEqual(set(state.updated), set(self.files[:5]))
+        finally:
+            outbox.stop()
+
+    def test_broker_down_keeps_batch_and_counts_failures(self):
+        dispatcher = FailingDispatcher()
+        outbox = Outbox(self.outbox_dir, lambda: dispatcher, batch_size=10)
+        for path in self.files[:5]:
+            outbox.submit(FileEvent.stat(path), self.watch_dir, RecordingState())
+        pending = outbox.pending_bytes()
+        outbox.start()
+        self.assertTrue(wait_for(lambda: outbox.failed >= 5))
+        outbox.stop()
+        self.assertEqual(outbox.pending_bytes(), pending)
+        # Closed by the drainer on its way out
+        self.assertTrue(dispatcher.closed)
+
+    def test_gone_files_do_not_block_the_head(self):
+        outbox = Outbox(self.outbox_dir, FailingDispatcher, batch_size=10)
+        state = RecordingState()
+        for path in self.files[:5]:
+            outbox.submit(FileEvent.stat(path), self.watch_dir, state)
+            os.remove(path)
+        outbox.start()
+        try:
+            self.assertTrue(wait_for(lambda: outbox.pending_bytes() == 0))
+        finally:
+            outbox.stop()
+        self.assertEqual(outbox.dropped, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
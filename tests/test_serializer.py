@@ -0,0 +1,62 @@
+"""
+Every serializer's messages decode back to the JSON payload shape.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Serializer import SERIALIZERS, BATCH_PARAM, MAX_ENVELOPE, create_serializer, decode, msgpack
+
+EVENTS = [
+    ('C:\\SFTP_Root\\cam01\\2025-11-02\\img_001.jpg', 'C:\\SFTP_Root', 1700000000.5, 1234, 1699999999.25),
+    ('C:\\SFTP_Root\\cam01\\2025-11-02\\img_002.jpg', 'C:\\SFTP_Root', 1700000001.5, 0, 1700000000.0),
+    ('/srv/ftp/cam02/2025-11-02/ch1_clip.dav', '/srv/ftp', 1700000002.5, 2**40, 1700000001.0),
+]
+
+
+class SerializerTest(unittest.TestCase):
+    def serializers(self):
+        for name in SERIALIZERS:
+            if name == 'msgpack' and msgpack is None:
+                continue
+            yield name, create_serializer(name, 'server-1')
+
+    def check(self, name, decoded, events):
+        self.assertEqual(len(decoded), len(events), name)
+        for event, (file_path, watching_dir, _, size, mtime) in zip(decoded, events):
+            self.assertEqual(event['FilePath'], file_path, name)
+            self.assertEqual(event['WatchingDir'], watching_dir, name)
+            self.assertEqual(event['FileSize'], size, name)
+            self.assertEqual(event['FileMtime'], mtime, name)
+            self.assertEqual(event['ServerId'], 'server-1', name)
+            self.assertEqual(event['EventSrc'], 'shell', name)
+
+    def test_single(self):
+        for name, serializer in self.serializers():
+            for event in EVENTS:
+                self.check(name, decode(serializer.encode(*event), serializer.content_type), [event])
+
+    def test_batch(self):
+        for name, serializer in self.serializers():
+            body = serializer.encode_batch(EVENTS)
+            self.check(name, decode(body, serializer.content_type + BATCH_PARAM), EVENTS)
+
+    def test_struct_envelope_limit(self):
+        serializer = create_serializer('struct', 'server-1')
+        # Every event in its own directory and watching dir: the worst case for the string table
+        events = [(f'/w{i}/d{i}/f.jpg', f'/w{i}', 0.0, 1, 1.0) for i in range(MAX_ENVELOPE)]
+        self.assertEqual(len(decode(serializer.encode_batch(events), serializer.content_type)), MAX_ENVELOPE)
+        with self.assertRaises(ValueError):
+            serializer.encode_batch(events + [('/x/y/f.jpg', '/x', 0.0, 1, 1.0)])
+
+    def test_rejects_unknown_magic(self):
+        body = create_serializer('struct', 'server-1').encode(*EVENTS[0])
+        with self.assertRaises(ValueError):
+            decode(b'FEV0' + body[4:], 'application/x-file-event')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+State store flushes and checkpoints: nothing recorded is lost when a write fails.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from StateStore import JsonStateStore, SqliteStateStore, SharedStateStore
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteStateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp, 'state.db')
+        # Large interval and threshold: the tests flush by hand
+        self.store = SqliteStateStore(self.db_file, logger, flush_every=10**6, flush_interval=60, busy_timeout=0.05)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def test_flush_persists(self):
+        self.store.record('a', 1.0)
+        self.store.record_mark('a', 2.0)
+        self.store.flush()
+        self.assertEqual(self.store.load(), ({'a': 1.0}, {'a': 2.0}))
+
+    def test_failed_flush_keeps_batch(self):
+        self.store.record('a', 1.0)
+        self.store.record('b', 1.0)
+        self.store.record_mark('a', 2.0)
+        other = sqlite3.connect(self.db_file)
+        other.execute("BEGIN IMMEDIATE") # Another writer holds the database
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                self.store.flush()
+            self.store.record('b', 3.0) # Newer than the failed batch
+        finally:
+            other.rollback()
+            other.close()
+        self.store.flush()
+        self.assertEqual(self.store.load(), ({'a': 1.0, 'b': 3.0}, {'a': 2.0}))
+
+    def test_delete_wins_over_buffered_update(self):
+        self.store.record('a', 1.0)
+        self.store.flush()
+        self.store.record('a', 2.0)
+        self.store.delete(['a'], [])
+        self.store.flush()
+        self.assertEqual(self.store.load(), ({}, {}))
+
+
+class JsonStateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp, 'state.json')
+        self.store = JsonStateStore(self.state_file, logger, checkpoint_interval=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_checkpoint_replays(self):
+        self.store.record('a', 1.0)
+        self.store.record_mark('a', 2.0)
+        self.assertEqual(self.store.checkpoint(), 2)
+        self.store.delete(['a'], [])
+        self.store.record('b', 3.0)
+        self.store.checkpoint()
+        self.assertEqual(JsonStateStore(self.state_file, logger).load(), ({'b': 3.0}, {'a': 2.0}))
+
+    def test_failed_checkpoint_keeps_changes(self):
+        self.store.record('a', 1.0)
+        self.store.record('b', 1.0)
+        os.mkdir(self.store.journal_file) # Appending fails
+        with self.assertRaises(OSError):
+            self.store.checkpoint()
+        self.store.record('b', 3.0)
+        os.rmdir(self.store.journal_file)
+        self.assertEqual(self.store.checkpoint(), 2)
+        self.assertEqual(JsonStateStore(self.state_file, logger).load()[0], {'a': 1.0, 'b': 3.0})
+
+
+class SharedStateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_roots_do_not_collide(self):
+        shared = SharedStateStore(JsonStateStore(self.state_file, logger), logger)
+        first = shared.partition('/data/cam')
+        second = shared.partition('/data/cam_2')
+        for part, ts in ((first, 1.0), (second, 2.0)):
+            part.load()
+            part.start(lambda ts=ts: ({'day': ts}, {}))
+        shared.close()
+
+        shared = SharedStateStore(JsonStateStore(self.state_file, logger), logger)
+        self.assertEqual(shared.partition('/data/cam').load(), ({'day': 1.0}, {}))
+        self.assertEqual(shared.partition('/data/cam_2').load(), ({'day': 2.0}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()